@@ -0,0 +1,70 @@
+"""Benchmarks the structure-aware chunker against the previous sentence-concatenation chunker.
+
+Usage: python benchmarks/bench_chunker.py [megabytes]
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from chunker import chunk_text, approximate_tokens
+
+LEGACY_MAX_CHUNK_SIZE = 12000
+
+def legacy_smart_chunk_text(text):
+    """The original implementation: split on '. ' and grow chunks by string concatenation."""
+    chunks = []
+    current_chunk = ""
+    for sentence in text.split('. '):
+        if len(current_chunk) + len(sentence) < LEGACY_MAX_CHUNK_SIZE:
+            current_chunk += sentence + ". "
+        else:
+            chunks.append(current_chunk)
+            current_chunk = sentence + ". "
+    if current_chunk:
+        chunks.append(current_chunk)
+    return chunks
+
+WORDS = "system user shall must login password account report data record audit access display validate submit request response error message within seconds".split()
+
+def make_spec(target_bytes, seed=7):
+    """Builds a synthetic requirement spec with sections, requirement IDs, lists and prose."""
+    rng = random.Random(seed)
+    parts = []
+    size = 0
+    section = 0
+    req = 0
+    while size < target_bytes:
+        section += 1
+        block = [f"\n{section}. SECTION {section} REQUIREMENTS\n\n"]
+        for _ in range(rng.randint(3, 8)):
+            req += 1
+            sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(12, 30)))
+            block.append(f"REQ-{req:05d}: The {sentence}.\n")
+            for item in range(rng.randint(0, 3)):
+                block.append(f"  - {' '.join(rng.choice(WORDS) for _ in range(8))}\n")
+            block.append("\n")
+        text = "".join(block)
+        parts.append(text)
+        size += len(text)
+    return "".join(parts)
+
+def run(label, fn, text):
+    start = time.perf_counter()
+    chunks = fn(text)
+    elapsed = time.perf_counter() - start
+    sizes = [approximate_tokens(len(c if isinstance(c, str) else c['text'])) for c in chunks]
+    print(f"{label:<28} chunks={len(chunks):<6} max_tokens={max(sizes):<6} time={elapsed:.3f}s")
+
+if __name__ == '__main__':
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    text = make_spec(int(megabytes * 1024 * 1024))
+    print(f"Input: {len(text) / 1024 / 1024:.1f} MB")
+    run("legacy smart_chunk_text", legacy_smart_chunk_text, text)
+    run("chunk_text (no overlap)", lambda t: chunk_text(t, max_tokens=3000, overlap_tokens=0), text)
+    run("chunk_text (200 overlap)", lambda t: chunk_text(t, max_tokens=3000, overlap_tokens=200), text)
+    # A single enormous 'sentence' used to become one oversized chunk
+    run("legacy, no sentence breaks", legacy_smart_chunk_text, text.replace('. ', ', '))
+    run("chunk_text, no sentence breaks", lambda t: chunk_text(t, max_tokens=3000), text.replace('. ', ', ').replace('\n', ' '))
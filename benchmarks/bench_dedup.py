@@ -0,0 +1,80 @@
+"""Measures MinHash LSH test case deduplication on large synthetic suites.
+
+Every fifth case is a reworded copy of an earlier one (a few words changed or dropped), like the
+restated requirements that span chunk boundaries. Reports time per case and how many of the
+planted duplicates were found; a pairwise Jaccard scan is timed on a smaller suite for scale.
+
+Usage: python benchmarks/bench_dedup.py [cases]
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from dedup import TestCaseDeduplicator, shingles, jaccard, DEDUP_SIMILARITY
+
+WORDS = ("system user login password account report data record audit access display validate submit "
+         "request response error message seconds admin role export import invoice order payment cart "
+         "search filter page session token email notification schedule upload download").split()
+
+def make_case(rng, i):
+    return {
+        'test_case_id': f"TC-{i}",
+        'description': "Verify that " + " ".join(rng.choice(WORDS) for _ in range(12)),
+        'steps': [" ".join(rng.choice(WORDS) for _ in range(10)) for _ in range(4)],
+        'expected_result': " ".join(rng.choice(WORDS) for _ in range(12))
+    }
+
+def reword(rng, case, i):
+    copy = {'test_case_id': f"TC-{i}", 'description': case['description'], 'steps': list(case['steps']), 'expected_result': case['expected_result']}
+    step_index = rng.randrange(len(copy['steps']))
+    words = copy['steps'][step_index].split()
+    words[rng.randrange(len(words))] = rng.choice(WORDS)
+    copy['steps'][step_index] = " ".join(words)
+    return copy
+
+def make_suite(n, seed=11):
+    rng = random.Random(seed)
+    cases, planted = [], 0
+    for i in range(n):
+        if i % 5 == 4:
+            cases.append(reword(rng, cases[rng.randrange(i)], i))
+            planted += 1
+        else:
+            cases.append(make_case(rng, i))
+    return cases, planted
+
+def pairwise(cases):
+    kept = []
+    removed = 0
+    for tc in cases:
+        s = shingles(tc)
+        if any(jaccard(s, other) >= DEDUP_SIMILARITY for other in kept):
+            removed += 1
+        else:
+            kept.append(s)
+    return removed
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    for size in (n // 10, n):
+        cases, planted = make_suite(size)
+        started = time.perf_counter()
+        deduplicator = TestCaseDeduplicator()
+        unique = deduplicator.remove_duplicates(cases)
+        elapsed = time.perf_counter() - started
+        stats = deduplicator.stats()
+        print(f"LSH      {size:6d} cases: {elapsed:6.2f}s ({elapsed / size * 1e6:5.0f} us/case), "
+              f"removed {stats['duplicates_removed']} of {planted} planted duplicates, "
+              f"{stats['candidate_comparisons']} exact comparisons, {len(unique)} kept")
+
+    cases, planted = make_suite(n // 10)
+    started = time.perf_counter()
+    removed = pairwise(cases)
+    elapsed = time.perf_counter() - started
+    print(f"Pairwise {len(cases):6d} cases: {elapsed:6.2f}s, removed {removed} of {planted} planted duplicates (grows quadratically)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""Compares time and peak memory of the streaming CSV/TXT/XLSX exporters against the previous
+exporters, which rendered the whole file into memory (StringIO -> encode -> BytesIO, and a
+regular openpyxl Workbook).
+
+Each measurement runs in a fresh subprocess so peak RSS (VmHWM) is not shared between runs.
+The suite itself is built before the baseline is taken, so "added" is the exporter's own cost.
+Streamed output is written to /dev/null chunk by chunk, as a response would send it.
+
+Usage: python benchmarks/bench_exporters.py [cases]
+"""
+import os
+import io
+import sys
+import csv
+import time
+import random
+import resource
+import subprocess
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from exporters import EXPORTERS, EXPORT_HEADERS, format_rtm_for_export
+
+WORDS = "system user login password account report data record audit access display validate submit request response error".split()
+
+def make_suite(n, seed=11):
+    rng = random.Random(seed)
+    sentence = lambda k: " ".join(rng.choice(WORDS) for _ in range(k))
+    return [{
+        'test_case_id': f"TC-{i:05d}",
+        'requirement_id': f"REQ-{i // 3:04d}",
+        'description': f"Verify that {sentence(14)}",
+        'test_type': rng.choice(['Positive', 'Negative', 'Boundary']),
+        'priority': rng.choice(['High', 'Medium', 'Low']),
+        'steps': [sentence(10) for _ in range(rng.randint(3, 7))],
+        'expected_result': sentence(12),
+        'rtm_compliance_mapping': f"REQ-{i // 3:04d}",
+        'confidence_score': f"{rng.randint(70, 99)}%"
+    } for i in range(n)]
+
+def legacy_row(tc, headers):
+    row = []
+    for header in headers:
+        if header == 'steps':
+            row.append("\n".join(tc.get('steps', [])))
+        elif header == 'rtm_compliance_mapping':
+            row.append(format_rtm_for_export(tc.get('rtm_compliance_mapping')))
+        else:
+            row.append(tc.get(header, 'N/A'))
+    return row
+
+def legacy_csv(test_cases, headers):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(headers)
+    for tc in test_cases:
+        writer.writerow(legacy_row(tc, headers))
+    return io.BytesIO(output.getvalue().encode('utf-8'))
+
+def legacy_txt(test_cases, headers):
+    output = io.StringIO()
+    for tc in test_cases:
+        for header in headers:
+            if header == 'steps':
+                steps = "\n".join([f"  {i+1}. {s}" for i, s in enumerate(tc.get('steps', []))])
+                output.write(f"Steps:\n{steps}\n")
+            elif header == 'rtm_compliance_mapping':
+                output.write(f"RTM Compliance Mapping: {format_rtm_for_export(tc.get('rtm_compliance_mapping'))}\n")
+            else:
+                output.write(f"{header.replace('_', ' ').title()}: {tc.get(header, 'N/A')}\n")
+        output.write("-" * 30 + "\n")
+    return io.BytesIO(output.getvalue().encode('utf-8'))
+
+def legacy_xlsx(test_cases, headers):
+    from openpyxl import Workbook
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.title = "Test Cases"
+    sheet.append(headers)
+    for tc in test_cases:
+        sheet.append(legacy_row(tc, headers))
+    output = io.BytesIO()
+    workbook.save(output)
+    output.seek(0)
+    return output
+
+LEGACY = {'csv': legacy_csv, 'txt': legacy_txt, 'xlsx': legacy_xlsx}
+
+def rss_kb(field):
+    # VmHWM resets on exec, unlike ru_maxrss, which Linux carries over from the parent
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_one(variant, format, n):
+    """Exports n cases in one format and prints 'seconds bytes baseline_kb peak_kb'."""
+    test_cases = make_suite(n)
+    import openpyxl # Imports are not part of the timing or the baseline
+    baseline_kb = rss_kb('VmRSS')
+    started = time.perf_counter()
+    written = 0
+    with open(os.devnull, 'wb') as sink:
+        if variant == 'legacy':
+            buffer = LEGACY[format](test_cases, EXPORT_HEADERS)
+            written = sink.write(buffer.getvalue())
+        else:
+            for chunk in EXPORTERS[format][0](test_cases, EXPORT_HEADERS):
+                written += sink.write(chunk)
+    elapsed = time.perf_counter() - started
+    print(elapsed, written, baseline_kb, rss_kb('VmHWM'))
+
+def measure(variant, format, n):
+    output = subprocess.run([sys.executable, __file__, '--run', variant, format, str(n)], capture_output=True, text=True, check=True).stdout
+    seconds, written, baseline_kb, peak_kb = output.split()[-4:]
+    return float(seconds), int(written), int(baseline_kb), int(peak_kb)
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == '--run':
+        run_one(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+        return
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print(f"{n:,} test cases")
+    for format in ('csv', 'txt', 'xlsx'):
+        print(f"{format}:")
+        for variant in ('legacy', 'streaming'):
+            seconds, written, baseline_kb, peak_kb = measure(variant, format, n)
+            print(f"  {variant:>9}: {seconds:6.2f}s  {written / 1e6:6.1f} MB  peak RSS {peak_kb / 1024:7.1f} MB "
+                  f"(+{(peak_kb - baseline_kb) / 1024:.1f} MB over the loaded suite)")
+
+if __name__ == '__main__':
+    main()
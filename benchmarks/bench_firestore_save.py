@@ -0,0 +1,150 @@
+"""Measures how long saving a suite to Firestore holds up the request, and whether it succeeds.
+
+Firestore is replaced by an in-process stand-in that enforces its limits: 1 MiB per document,
+500 writes and 10 MiB per commit. Each commit costs --latency seconds plus --per-mb seconds per
+MiB sent, to model a remote Firestore.
+
+Two savers are compared:
+  legacy      the previous save: the whole suite as one document, written inside the request
+  background  firebase_integrator.FirestoreWriter: sharded documents in batched writes committed
+              in parallel; the request only queues the save
+
+Usage: python benchmarks/bench_firestore_save.py [cases ...] [--latency 0.05] [--per-mb 0.05]
+"""
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import itertools
+import threading
+import contextlib
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from firebase_integrator import FirestoreWriter
+
+MAX_DOCUMENT_BYTES = 1024 * 1024
+MAX_COMMIT_WRITES = 500
+MAX_COMMIT_BYTES = 10 * 1024 * 1024
+
+class StandInDocument:
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+        self.id = path.rsplit('/', 1)[1]
+
+    def collection(self, name):
+        return StandInCollection(self.client, f"{self.path}/{name}")
+
+    def set(self, data):
+        self.client.commit([(self, data)])
+
+    def update(self, data):
+        self.client.commit([(self, data)])
+
+class StandInCollection:
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+
+    def document(self, document_id=None):
+        return StandInDocument(self.client, f"{self.path}/{document_id or next(self.client.ids)}")
+
+class StandInBatch:
+    def __init__(self, client):
+        self.client = client
+        self.writes = []
+
+    def set(self, doc_ref, data):
+        self.writes.append((doc_ref, data))
+
+    def commit(self):
+        self.client.commit(self.writes)
+
+class StandInFirestore:
+    latency = 0.05
+    per_mb = 0.05
+
+    def __init__(self):
+        self.ids = (f"doc{n:06d}" for n in itertools.count(1))
+        self.lock = threading.Lock()
+        self.commits = 0
+
+    def collection(self, name):
+        return StandInCollection(self, name)
+
+    def batch(self):
+        return StandInBatch(self)
+
+    def commit(self, writes):
+        if len(writes) > MAX_COMMIT_WRITES:
+            raise ValueError(f"{len(writes)} writes in one commit (at most {MAX_COMMIT_WRITES})")
+        sizes = [len(json.dumps(data, default=str)) for _, data in writes]
+        if max(sizes) > MAX_DOCUMENT_BYTES:
+            raise ValueError(f"document of {max(sizes):,} bytes exceeds the 1 MiB limit")
+        if sum(sizes) > MAX_COMMIT_BYTES:
+            raise ValueError(f"commit of {sum(sizes):,} bytes exceeds the 10 MiB limit")
+        with self.lock:
+            self.commits += 1
+        time.sleep(self.latency + self.per_mb * sum(sizes) / (1024 * 1024))
+
+WORDS = "system user login password account report data record audit access display validate submit request response error".split()
+
+def make_suite(n):
+    sentence = lambda i, k: " ".join(WORDS[(i * 7 + j) % len(WORDS)] for j in range(k))
+    return [{
+        'test_case_id': f"TC-{i:05d}",
+        'requirement_id': f"REQ-{i // 3:04d}",
+        'description': f"Verify that {sentence(i, 14)}",
+        'test_type': 'Positive',
+        'priority': 'High',
+        'steps': [sentence(i + s, 10) for s in range(5)],
+        'expected_result': sentence(i, 12),
+        'rtm_compliance_mapping': f"REQ-{i // 3:04d}",
+        'confidence_score': '90%'
+    } for i in range(n)]
+
+def legacy_save(client, test_cases):
+    client.collection('users').document('bench').collection('test_case_history').document().set({'timestamp': time.time(), 'test_cases': test_cases})
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('cases', type=int, nargs='*')
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--per-mb', type=float, default=0.05)
+    args = parser.parse_args()
+    StandInFirestore.latency = args.latency
+    StandInFirestore.per_mb = args.per_mb
+
+    for n in args.cases or [500, 5000, 20000]:
+        test_cases = make_suite(n)
+        print(f"{n:,} test cases ({len(json.dumps(test_cases)) / 1e6:.1f} MB):")
+
+        client = StandInFirestore()
+        started = time.perf_counter()
+        try:
+            legacy_save(client, test_cases)
+            outcome = "saved"
+        except ValueError as e:
+            outcome = f"failed: {e}"
+        print(f"      legacy: request blocked {time.perf_counter() - started:6.3f}s, {outcome}")
+
+        client = StandInFirestore()
+        writer = FirestoreWriter(client)
+        # Keep the writer's own progress messages out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            save = writer.submit('bench', test_cases)
+            blocked = time.perf_counter() - started
+            status = save
+            while status['status'] in ('queued', 'writing'):
+                time.sleep(0.005)
+                status = writer.status('bench', save['save_id'])
+            finished = time.perf_counter() - started
+        outcome = f"{status['status']} ({status['shard_count']} shards, {client.commits} commits)" + (f": {status['error']}" if status['error'] else "")
+        print(f"  background: request blocked {blocked:6.3f}s, {outcome} after {finished:.3f}s")
+
+if __name__ == '__main__':
+    main()
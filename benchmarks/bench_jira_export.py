@@ -0,0 +1,221 @@
+"""Measures Jira export throughput (issues/second) against a local HTTP stand-in for Jira.
+
+The stand-in answers the endpoints both exporters use. Every request costs --latency seconds,
+plus --per-issue seconds for each issue it creates, to model a remote Jira. --throttle-every N
+makes every Nth bulk call answer 429 with Retry-After: --retry-after. Each new connection
+costs --connect-latency seconds, standing in for the TCP and TLS handshakes.
+
+Two exporters are compared:
+  sequential  the previous exporter: jira.create_issue() per test case (a POST, then a GET of
+              the created issue), one at a time
+  bulk        alm_integrator.create_jira_issues: bulk-create batches of up to 50, several in
+              flight at once, with per-batch Retry-After handling
+
+A second scenario runs --exports small exports of --export-size issues, the usual shape of
+exports from the UI. It compares a new session per export (ALM_CLIENT_TTL_SECONDS=0) with the
+pooled keep-alive sessions, which also skip the project check on repeat exports.
+
+A third scenario exports --issues cases with sync, edits --edited of them and exports again:
+a full re-export (sync off) against the sync, which updates only the edited issues.
+
+Usage: python benchmarks/bench_jira_export.py [--issues 1000] [--sequential-issues 200]
+       [--latency 0.02] [--per-issue 0.002] [--throttle-every 0] [--retry-after 1]
+       [--connect-latency 0.05] [--exports 20] [--export-size 10] [--edited 20]
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import itertools
+import tempfile
+import contextlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+PROJECT_KEY = 'BENCH'
+
+class JiraStandIn(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # Keep-alive, as a real Jira serves it
+    latency = 0.02
+    per_issue = 0.002
+    throttle_every = 0
+    retry_after = '1'
+    connect_latency = 0.05
+    counter = itertools.count(1)
+    bulk_calls = itertools.count(1)
+    stats = {'requests': 0, 'throttled': 0, 'connections': 0}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.lock:
+            self.stats['connections'] += 1
+        time.sleep(self.connect_latency)
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _issue(self):
+        key = f"{PROJECT_KEY}-{next(self.counter)}"
+        return {'id': key.split('-')[1], 'key': key, 'self': f"http://{self.headers['Host']}/rest/api/2/issue/{key}"}
+
+    def _begin(self, created=0):
+        with self.lock:
+            self.stats['requests'] += 1
+        time.sleep(self.latency + self.per_issue * created)
+
+    def do_GET(self):
+        self._begin()
+        if self.path.startswith('/rest/api/2/serverInfo'):
+            self._send(200, {'baseUrl': f"http://{self.headers['Host']}", 'version': '9.12.0', 'versionNumbers': [9, 12, 0], 'deploymentType': 'Server'})
+        elif self.path.startswith(f'/rest/api/2/project/{PROJECT_KEY}'):
+            self._send(200, {'id': '10000', 'key': PROJECT_KEY, 'name': 'Benchmark'})
+        elif self.path.startswith('/rest/api/2/issue/'):
+            key = self.path.rsplit('/', 1)[1].split('?')[0]
+            self._send(200, {'id': key.split('-')[-1], 'key': key, 'self': f"http://{self.headers['Host']}{self.path}", 'fields': {'summary': ''}})
+        else:
+            self._send(404, {'errorMessages': ['Not found']})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self.path == '/rest/api/2/issue/bulk':
+            updates = body.get('issueUpdates', [])
+            if self.throttle_every and next(self.bulk_calls) % self.throttle_every == 0:
+                self._begin()
+                with self.lock:
+                    self.stats['throttled'] += 1
+                self._send(429, {'errorMessages': ['Rate limit exceeded']}, {'Retry-After': self.retry_after})
+                return
+            self._begin(len(updates))
+            self._send(201, {'issues': [self._issue() for _ in updates], 'errors': []})
+        elif self.path == '/rest/api/2/issue':
+            self._begin(1)
+            self._send(201, self._issue())
+        else:
+            self._begin()
+            self._send(404, {'errorMessages': ['Not found']})
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._begin()
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+def make_suite(n):
+    return [{
+        'test_case_id': f"TC-{i:05d}",
+        'requirement_id': f"REQ-{i // 3:04d}",
+        'description': f"Verify requirement {i // 3} behaves as specified (case {i})",
+        'test_type': 'Positive',
+        'priority': 'High',
+        'steps': ['Open the application', 'Perform the action', 'Check the result'],
+        'expected_result': 'The system behaves as specified',
+        'rtm_compliance_mapping': f"REQ-{i // 3:04d}",
+        'confidence_score': '90%'
+    } for i in range(n)]
+
+def sequential_export(server, test_cases):
+    """The previous exporter's loop: one create_issue call per test case."""
+    from jira import JIRA
+    from alm_integrator import build_issue_fields
+    jira = JIRA(options={'server': server}, basic_auth=('bench@example.com', 'token'))
+    jira.project(PROJECT_KEY)
+    return [f"Successfully created issue: {jira.create_issue(fields=build_issue_fields(tc, PROJECT_KEY)).key}" for tc in test_cases]
+
+def bulk_export(server, test_cases):
+    from alm_integrator import create_jira_issues
+    return create_jira_issues(server, 'bench@example.com', 'token', PROJECT_KEY, test_cases)
+
+def sync_export(sync):
+    from alm_integrator import create_jira_issues
+    return lambda server, test_cases: create_jira_issues(server, 'bench@example.com', 'token', PROJECT_KEY, test_cases, sync=sync())
+
+def run(name, export, server, n, exports=1, test_cases=None):
+    test_cases = test_cases or make_suite(n)
+    before = dict(JiraStandIn.stats)
+    started = time.perf_counter()
+    created = 0
+    # Keep the exporters' own progress messages out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(exports):
+            confirmations = export(server, test_cases)
+            created += sum(1 for message in confirmations if message.startswith(('Successfully created issue', 'Successfully updated issue', 'Unchanged')))
+    elapsed = time.perf_counter() - started
+    delta = {key: JiraStandIn.stats[key] - before[key] for key in before}
+    label = f"{exports} x {n}" if exports > 1 else f"{n}"
+    print(f"  {name:>10}: {label:>7} issues in {elapsed:6.2f}s = {created / elapsed:8.1f} issues/s "
+          f"({delta['requests']} HTTP requests, {delta['connections']} connections, {delta['throttled']} throttled, {n * exports - created} failed)")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--issues', type=int, default=1000)
+    parser.add_argument('--sequential-issues', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--per-issue', type=float, default=0.002)
+    parser.add_argument('--throttle-every', type=int, default=0)
+    parser.add_argument('--retry-after', default='1')
+    parser.add_argument('--connect-latency', type=float, default=0.05)
+    parser.add_argument('--exports', type=int, default=20)
+    parser.add_argument('--export-size', type=int, default=10)
+    parser.add_argument('--edited', type=int, default=20)
+    args = parser.parse_args()
+    JiraStandIn.latency = args.latency
+    JiraStandIn.per_issue = args.per_issue
+    JiraStandIn.throttle_every = args.throttle_every
+    JiraStandIn.retry_after = args.retry_after
+    JiraStandIn.connect_latency = args.connect_latency
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), JiraStandIn)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    server = f"http://127.0.0.1:{httpd.server_address[1]}"
+    print(f"Stand-in Jira at {server}: {args.latency * 1000:.0f} ms per request + {args.per_issue * 1000:.1f} ms per created issue, "
+          f"{args.connect_latency * 1000:.0f} ms per new connection"
+          + (f", every {args.throttle_every}th bulk call throttled (Retry-After: {args.retry_after})" if args.throttle_every else ""))
+
+    run('sequential', sequential_export, server, args.sequential_issues)
+    run('bulk', bulk_export, server, args.issues)
+
+    import alm_integrator
+    print(f"{args.exports} exports of {args.export_size} issues:")
+    alm_integrator.alm_clients = alm_integrator.AlmClientPool(ttl_seconds=0)
+    run('unpooled', bulk_export, server, args.export_size, args.exports)
+    alm_integrator.alm_clients = alm_integrator.AlmClientPool(ttl_seconds=600)
+    run('pooled', bulk_export, server, args.export_size, args.exports)
+
+    from result_store import ResultStore
+    print(f"Re-export of {args.issues} issues after editing {args.edited}:")
+    with tempfile.TemporaryDirectory() as directory:
+        store = ResultStore(os.path.join(directory, 'results.sqlite3'))
+        test_cases = make_suite(args.issues)
+        result_id = store.create('bench', test_cases)['result_id']
+        sync = lambda: alm_integrator.AlmSync(store, result_id, server, PROJECT_KEY)
+        with contextlib.redirect_stdout(io.StringIO()):
+            sync_export(sync)(server, test_cases)
+        for test_case in test_cases[:args.edited]:
+            test_case['expected_result'] = 'The system behaves as newly specified'
+        run('full', bulk_export, server, args.issues, test_cases=test_cases)
+        run('sync', sync_export(sync), server, args.issues, test_cases=test_cases)
+        store._conn.close()
+
+    for endpoint, metrics in alm_integrator.alm_stats()['endpoints'].items():
+        print(f"  {endpoint}: {metrics['calls']} calls, p50 {metrics['p50_seconds'] * 1000:.0f} ms, p95 {metrics['p95_seconds'] * 1000:.0f} ms")
+    httpd.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Compares peak memory and time of the streaming DOCX/XML parsers against the previous
+python-docx / ElementTree.fromstring parsers.
+
+Each measurement runs in a fresh subprocess so peak RSS (VmHWM) is not shared between runs.
+
+Usage: python benchmarks/bench_parsers.py [paragraphs]
+"""
+import os
+import sys
+import time
+import random
+import resource
+import tempfile
+import subprocess
+from io import BytesIO
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+WORDS = "system user shall must login password account report data record audit access display validate submit request response error message within seconds".split()
+
+def make_docx(path, paragraphs, seed=7):
+    """Writes a DOCX with headings, requirement paragraphs and a small table every 50 paragraphs."""
+    from docx import Document
+    rng = random.Random(seed)
+    doc = Document()
+    for i in range(paragraphs):
+        if i % 50 == 0:
+            doc.add_heading(f"{i // 50 + 1}. Section {i // 50 + 1}", level=1)
+            table = doc.add_table(rows=3, cols=3)
+            for row in table.rows:
+                for cell in row.cells:
+                    cell.text = " ".join(rng.choice(WORDS) for _ in range(4))
+        doc.add_paragraph(f"REQ-{i + 1}: The " + " ".join(rng.choice(WORDS) for _ in range(30)) + ".")
+    doc.save(path)
+
+def make_xml(path, paragraphs, seed=7):
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("<specification>\n")
+        for i in range(paragraphs):
+            if i % 50 == 0:
+                f.write(f"<section id='{i // 50 + 1}'><title>Section {i // 50 + 1}</title>\n")
+            f.write(f"<requirement id='REQ-{i + 1}'><text>The " + " ".join(rng.choice(WORDS) for _ in range(30)) + ".</text></requirement>\n")
+            if i % 50 == 49:
+                f.write("</section>\n")
+        if paragraphs % 50:
+            f.write("</section>\n")
+        f.write("</specification>\n")
+
+def legacy_docx(content):
+    from docx import Document
+    from chunker import chunk_text
+    doc = Document(BytesIO(content))
+    return chunk_text("\n".join(p.text for p in doc.paragraphs))
+
+def legacy_xml(content):
+    import xml.etree.ElementTree as ET
+    from chunker import chunk_text
+    root = ET.fromstring(content)
+    return chunk_text(" ".join(elem.text for elem in root.iter() if elem.text))
+
+def streaming(ext, content):
+    from document_parser import iter_document_chunks
+    return list(iter_document_chunks('spec' + ext, content))
+
+def peak_rss_kb():
+    # VmHWM resets on exec, unlike ru_maxrss, which Linux carries over from the parent
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_one(variant, path):
+    """Runs one parser variant on `path` and prints 'seconds chunks characters peak_rss_kb'."""
+    with open(path, 'rb') as f:
+        content = f.read()
+    ext = os.path.splitext(path)[1]
+    # Imports are not part of the timing
+    if variant == 'legacy':
+        import docx, chunker
+    else:
+        import document_parser
+    started = time.perf_counter()
+    if variant == 'legacy':
+        chunks = legacy_docx(content) if ext == '.docx' else legacy_xml(content)
+    else:
+        chunks = streaming(ext, content)
+    elapsed = time.perf_counter() - started
+    characters = sum(len(chunk['text']) for chunk in chunks)
+    print(elapsed, len(chunks), characters, peak_rss_kb())
+
+def measure(variant, path):
+    output = subprocess.run([sys.executable, __file__, '--run', variant, path], capture_output=True, text=True, check=True).stdout
+    seconds, chunks, characters, peak_kb = output.split()[-4:]
+    return float(seconds), int(chunks), int(characters), int(peak_kb)
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == '--run':
+        run_one(sys.argv[2], sys.argv[3])
+        return
+    paragraphs = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    with tempfile.TemporaryDirectory() as tmp:
+        docx_path = os.path.join(tmp, 'spec.docx')
+        xml_path = os.path.join(tmp, 'spec.xml')
+        make_docx(docx_path, paragraphs)
+        make_xml(xml_path, paragraphs)
+        for path in (docx_path, xml_path):
+            print(f"{os.path.basename(path)}: {os.path.getsize(path) / 1e6:.1f} MB on disk")
+            for variant in ('legacy', 'streaming'):
+                seconds, chunks, characters, peak_kb = measure(variant, path)
+                print(f"  {variant:>9}: {seconds:6.2f}s  {chunks:5d} chunks  {characters:>10,d} chars  peak RSS {peak_kb / 1024:7.1f} MB")
+
+if __name__ == '__main__':
+    main()
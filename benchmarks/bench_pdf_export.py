@@ -0,0 +1,128 @@
+"""Compares the streaming PDF exporter with the previous FPDF exporter at 1k/10k/50k rows.
+
+The previous exporter measured every cell with multi_cell(split_only=True), drew it again with
+multi_cell, and encoded text to latin-1 (non-Latin characters became '?'). It is reproduced
+here with that encoding step adapted to fpdf2's bytearray output so it can run at all. Being
+slow, it is only run up to --legacy-max rows (default 10000).
+
+Each measurement runs in a fresh subprocess so peak RSS (VmHWM) is not shared between runs.
+Output is written to /dev/null as it is produced, as a streamed response would send it.
+
+Usage: python benchmarks/bench_pdf_export.py [rows ...] [--legacy-max N]
+"""
+import os
+import sys
+import time
+import random
+import resource
+import subprocess
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from exporters import EXPORT_HEADERS, export_row, iter_pdf
+
+WORDS = "system user login password account report data record audit access display validate submit request response error".split()
+# Some rows carry non-Latin requirement text, which the old exporter could not represent
+PHRASES = ["Проверка входа пользователя", "Ελέγχος πρόσβασης", "Überprüfung der Anmeldung"]
+
+def make_suite(n, seed=5):
+    rng = random.Random(seed)
+    sentence = lambda k: " ".join(rng.choice(WORDS) for _ in range(k))
+    return [{
+        'test_case_id': f"TC-{i:05d}",
+        'requirement_id': f"REQ-{i // 3:04d}",
+        'description': (rng.choice(PHRASES) + ": " if i % 5 == 0 else "Verify that ") + sentence(16),
+        'test_type': rng.choice(['Positive', 'Negative', 'Boundary']),
+        'priority': rng.choice(['High', 'Medium', 'Low']),
+        'steps': [sentence(8) for _ in range(rng.randint(2, 5))],
+        'expected_result': sentence(12),
+        'rtm_compliance_mapping': f"REQ-{i // 3:04d}"
+    } for i in range(n)]
+
+def legacy_pdf(test_cases, headers):
+    from fpdf import FPDF
+    pdf = FPDF(orientation='L')
+    pdf.add_page()
+    pdf.set_font("Helvetica", size=8)
+    col_widths = [20, 25, 50, 20, 20, 50, 50, 50]
+    for i, header in enumerate(headers):
+        pdf.cell(col_widths[i], 10, header.replace('_', ' ').title(), 1)
+    pdf.ln()
+    for tc in test_cases:
+        row = [str(value) for value in export_row(tc, headers)]
+        y_before = pdf.get_y()
+        max_height = 0
+        for i, item in enumerate(row):
+            pdf.set_font("Helvetica", size=8)
+            sanitized_item = item.encode('latin-1', 'replace').decode('latin-1')
+            num_lines = len(pdf.multi_cell(col_widths[i], 5, sanitized_item, split_only=True))
+            max_height = max(max_height, num_lines * 5)
+        pdf.set_y(y_before)
+        for i, item in enumerate(row):
+            sanitized_item = item.encode('latin-1', 'replace').decode('latin-1')
+            pdf.multi_cell(col_widths[i], max_height, sanitized_item, border=1, align='L')
+            if i < len(row) - 1:
+                pdf.set_y(y_before)
+                pdf.set_x(pdf.get_x() + col_widths[i])
+        pdf.ln(max_height)
+    return bytes(pdf.output())
+
+def rss_kb(field):
+    # VmHWM resets on exec, unlike ru_maxrss, which Linux carries over from the parent
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_one(variant, n):
+    """Exports n rows and prints 'seconds bytes baseline_kb peak_kb'."""
+    test_cases = make_suite(n)
+    if variant == 'legacy':
+        import fpdf # Imports and font loading are not part of the timing or the baseline
+    else:
+        from pdf_export import load_font_metrics
+        load_font_metrics()
+    baseline_kb = rss_kb('VmRSS')
+    started = time.perf_counter()
+    written = 0
+    with open(os.devnull, 'wb') as sink:
+        if variant == 'legacy':
+            written = sink.write(legacy_pdf(test_cases, EXPORT_HEADERS))
+        else:
+            for chunk in iter_pdf(test_cases, EXPORT_HEADERS):
+                written += sink.write(chunk)
+    elapsed = time.perf_counter() - started
+    print(elapsed, written, baseline_kb, rss_kb('VmHWM'))
+
+def measure(variant, n):
+    output = subprocess.run([sys.executable, __file__, '--run', variant, str(n)], capture_output=True, text=True, check=True).stdout
+    seconds, written, baseline_kb, peak_kb = output.split()[-4:]
+    return float(seconds), int(written), int(baseline_kb), int(peak_kb)
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == '--run':
+        run_one(sys.argv[2], int(sys.argv[3]))
+        return
+    args = sys.argv[1:]
+    legacy_max = 10000
+    if '--legacy-max' in args:
+        index = args.index('--legacy-max')
+        legacy_max = int(args[index + 1])
+        del args[index:index + 2]
+    sizes = [int(arg) for arg in args] or [1000, 10000, 50000]
+    for n in sizes:
+        print(f"{n:,} rows:")
+        for variant in ('legacy', 'streaming'):
+            if variant == 'legacy' and n > legacy_max:
+                print(f"  {variant:>9}: skipped (over --legacy-max {legacy_max:,})")
+                continue
+            seconds, written, baseline_kb, peak_kb = measure(variant, n)
+            print(f"  {variant:>9}: {seconds:7.2f}s  {n / seconds:8,.0f} rows/s  {written / 1e6:6.1f} MB  "
+                  f"peak RSS {peak_kb / 1024:7.1f} MB (+{(peak_kb - baseline_kb) / 1024:.1f} MB over the loaded suite)")
+
+if __name__ == '__main__':
+    main()
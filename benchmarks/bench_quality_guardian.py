@@ -0,0 +1,67 @@
+"""Compares per-case and batched quality checks against a simulated Gemini model.
+
+Usage: python benchmarks/bench_quality_guardian.py [num_cases] [latency_seconds]
+"""
+import os
+import re
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+import test_generator
+import quality_guardian
+from llm_scheduler import LLMScheduler
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+class SimulatedModel:
+    """Answers review prompts after a fixed delay, standing in for a network round-trip."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def generate_content(self, prompt):
+        self.calls += 1
+        time.sleep(self.latency)
+        ids = re.findall(r"Test Case ID: (.*)", prompt)
+        if len(ids) > 1 or '"test_case_id"' in prompt:
+            return FakeResponse(json.dumps([
+                {'test_case_id': tc_id.strip(), 'plausibility': 'Yes - steps are clear.', 'rtm': 'Yes - mapping is relevant.'}
+                for tc_id in ids
+            ]))
+        return FakeResponse("Yes - looks reasonable.")
+
+def make_test_cases(count):
+    return [{
+        'test_case_id': f'TC-{i:04d}',
+        'requirement_id': f'REQ-{i % 50}',
+        'description': f'Verify behaviour {i}',
+        'test_type': 'Functional',
+        'priority': 'Medium',
+        'steps': ['Open the application', 'Perform the action', 'Observe the result'],
+        'expected_result': 'The action succeeds.',
+        'rtm_compliance_mapping': f'RULE-{i % 7}'
+    } for i in range(count)]
+
+def run(label, num_cases, latency, batch_size):
+    model = SimulatedModel(latency)
+    quality_guardian.gemini_model = model
+    test_generator.gemini_model = model
+    start = time.perf_counter()
+    quality_guardian.run_quality_checks(make_test_cases(num_cases), batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<20} cases={num_cases:<6} calls={model.calls:<6} time={elapsed:.2f}s")
+
+if __name__ == '__main__':
+    # Measure the call pattern itself, not the production rate limits
+    test_generator.llm_scheduler = LLMScheduler(max_in_flight=8, requests_per_minute=0)
+    num_cases = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    run("per-case", num_cases, latency, batch_size=1)
+    for size in (5, 10, 20):
+        run(f"batched (size={size})", num_cases, latency, batch_size=size)
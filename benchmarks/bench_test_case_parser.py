@@ -0,0 +1,94 @@
+"""Compares the single-pass TestCase parser with the previous regex-per-field dict parser.
+
+Reports parse throughput on a synthetic AI response and the memory held by 10k parsed cases
+(as dicts vs. slotted TestCase objects), measured with tracemalloc.
+
+Usage: python benchmarks/bench_test_case_parser.py [cases]
+"""
+import os
+import re
+import sys
+import time
+import random
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from test_case_model import parse_test_cases, to_dicts
+
+def legacy_parse_ai_response_to_dicts(text):
+    """The original parser: nine regex scans per block, patterns compiled (or cache-looked-up) per call."""
+    test_cases = []
+    for block in text.split("===TEST CASE START==="):
+        if "===TEST CASE END===" not in block:
+            continue
+        test_case = {}
+        id_match = re.search(r"ID: (.*?)\n", block)
+        if id_match: test_case['test_case_id'] = id_match.group(1).strip()
+        req_match = re.search(r"REQ: (.*?)\n", block)
+        if req_match: test_case['requirement_id'] = req_match.group(1).strip()
+        desc_match = re.search(r"DESC: (.*?)\n", block)
+        if desc_match: test_case['description'] = desc_match.group(1).strip()
+        type_match = re.search(r"TYPE: (.*?)\n", block)
+        if type_match: test_case['test_type'] = type_match.group(1).strip()
+        priority_match = re.search(r"PRIORITY: (.*?)\n", block)
+        if priority_match: test_case['priority'] = priority_match.group(1).strip()
+        steps = re.findall(r"STEP: (.*?)\n", block)
+        test_case['steps'] = [s.strip() for s in steps]
+        expected_match = re.search(r"EXPECTED: (.*?)\n", block)
+        if expected_match: test_case['expected_result'] = expected_match.group(1).strip()
+        rtm_match = re.search(r"RTM: (.*?)\n", block)
+        if rtm_match: test_case['rtm_compliance_mapping'] = rtm_match.group(1).strip()
+        confidence_match = re.search(r"CONFIDENCE: (.*?)\n", block)
+        if confidence_match: test_case['confidence_score'] = confidence_match.group(1).strip()
+        if test_case.get('description'):
+            test_cases.append(test_case)
+    return test_cases
+
+WORDS = "system user login password account report data record audit access display validate submit request response error".split()
+
+def make_response(n, seed=3):
+    rng = random.Random(seed)
+    sentence = lambda k: " ".join(rng.choice(WORDS) for _ in range(k))
+    parts = []
+    for i in range(n):
+        parts.append("===TEST CASE START===\n")
+        parts.append(f"ID: TC-{i:05d}\nREQ: REQ-{i // 3:04d}\nDESC: Verify that {sentence(12)}\n")
+        parts.append(f"TYPE: {rng.choice(['Positive', 'Negative', 'Boundary'])}\nPRIORITY: {rng.choice(['High', 'Medium', 'Low'])}\n")
+        for _ in range(rng.randint(3, 6)):
+            parts.append(f"STEP: {sentence(8)}\n")
+        parts.append(f"EXPECTED: {sentence(10)}\nRTM: REQ-{i // 3:04d}\nCONFIDENCE: {rng.randint(70, 99)}%\n")
+        parts.append("===TEST CASE END===\n")
+    return "".join(parts)
+
+def held_bytes(build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return held, kept
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    text = make_response(n)
+    assert legacy_parse_ai_response_to_dicts(text) == to_dicts(parse_test_cases(text)), "parsers disagree"
+
+    for name, parse in (('regex dicts', legacy_parse_ai_response_to_dicts), ('single-pass TestCase', parse_test_cases),
+                        ('single-pass -> dicts', lambda t: to_dicts(parse_test_cases(t)))):
+        best = min(_timed(parse, text) for _ in range(3))
+        print(f"{name:>22}: {n / best:10,.0f} cases/s ({len(text) / best / 1e6:.1f} MB/s)")
+
+    # Memory held by the parsed suite (the response text itself is excluded)
+    dict_bytes, _ = held_bytes(lambda: legacy_parse_ai_response_to_dicts(text))
+    object_bytes, _ = held_bytes(lambda: parse_test_cases(text))
+    print(f"Memory per {n:,} cases: dicts {dict_bytes / 1e6:.1f} MB, TestCase {object_bytes / 1e6:.1f} MB "
+          f"({dict_bytes / n:.0f} vs {object_bytes / n:.0f} bytes per case, including strings)")
+
+def _timed(parse, text):
+    started = time.perf_counter()
+    parse(text)
+    return time.perf_counter() - started
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,35 @@
 
 import os
 import json
+import time
+import random
+import hashlib
+import threading
+import contextlib
+import email.utils
+import concurrent.futures
 import requests # New import for making HTTP requests
 import base64 # New import for encoding credentials
-from jira import JIRA
+from requests.adapters import HTTPAdapter
+from collections import deque
+
+from metrics import span
+
+# Issues per call to Jira's bulk-create endpoint, which accepts at most 50
+JIRA_BULK_BATCH_SIZE = max(1, min(50, int(os.getenv('JIRA_BULK_BATCH_SIZE', '50'))))
+# Bulk-create batches (and Zephyr Scale calls) in flight at once for one export
+JIRA_EXPORT_CONCURRENCY = max(1, int(os.getenv('JIRA_EXPORT_CONCURRENCY', '4')))
+# A rate-limited (429) or unavailable (503) call is retried this many times, honouring Retry-After
+JIRA_MAX_RETRIES = int(os.getenv('JIRA_MAX_RETRIES', '5'))
+JIRA_MAX_RETRY_WAIT_SECONDS = float(os.getenv('JIRA_MAX_RETRY_WAIT_SECONDS', '60'))
+JIRA_REQUEST_TIMEOUT_SECONDS = 30
+RETRYABLE_STATUS_CODES = (429, 503)
+# Pooled keep-alive sessions (and the projects already found with them) are closed after this long unused; 0 disables pooling
+ALM_CLIENT_TTL_SECONDS = float(os.getenv('ALM_CLIENT_TTL_SECONDS', '600'))
+ZEPHYR_API_BASE_URL = "https://api.zephyrscale.smartbear.com/v2" # Base URL for Zephyr Scale Cloud API
+# Synced issues are labelled with this prefix plus an idempotency key; empty disables the labels
+# (and with them the recovery of creates an interrupted export sent but never recorded)
+JIRA_SYNC_LABEL_PREFIX = os.getenv('JIRA_SYNC_LABEL_PREFIX', 'tcgen-')
 
 def format_rtm_for_jira(rtm):
     """Helper function to format the RTM field for the Jira description."""
@@ -19,13 +45,196 @@ def format_rtm_for_jira(rtm):
         return "\n".join([f"- {format_rtm_for_jira(item)}" for item in rtm])
     return str(rtm)
 
+def retry_delay(response, attempt: int) -> float:
+    """Seconds to wait before retrying a throttled call: Retry-After if the server sent one
+    (as seconds or an HTTP date), otherwise exponential backoff with jitter."""
+    retry_after = response.headers.get('Retry-After')
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            return min(max(delay, 0.0), JIRA_MAX_RETRY_WAIT_SECONDS)
+    return min(2 ** attempt * random.uniform(0.5, 1.0), JIRA_MAX_RETRY_WAIT_SECONDS)
+
+def request_with_retries(session, method: str, url: str, endpoint: str = None, **kwargs):
+    """Sends a request, retrying while the server answers 429 or 503.
+
+    Those statuses mean the request was refused before it was processed, so even a POST that
+    creates issues is safe to resend. Connection errors are not retried: the issues may have
+    been created already. Returns the last response.
+    Each attempt's latency is recorded in endpoint_metrics under endpoint (default: the method).
+    """
+    kwargs.setdefault('timeout', JIRA_REQUEST_TIMEOUT_SECONDS)
+    endpoint = endpoint or method
+    for attempt in range(JIRA_MAX_RETRIES + 1):
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            endpoint_metrics.record(endpoint, time.perf_counter() - started)
+            raise
+        endpoint_metrics.record(endpoint, time.perf_counter() - started, response.status_code)
+        if response.status_code not in RETRYABLE_STATUS_CODES or attempt == JIRA_MAX_RETRIES:
+            return response
+        delay = retry_delay(response, attempt)
+        print(f"--- JIRA INTEGRATION: {response.status_code} from {url}; retrying in {delay:.1f}s ({attempt + 1}/{JIRA_MAX_RETRIES}). ---")
+        time.sleep(delay)
+    return response
+
+def create_session(email: str = None, token: str = None, pool_size: int = JIRA_EXPORT_CONCURRENCY):
+    """A requests session with basic auth and enough pooled connections for the export's workers."""
+    session = requests.Session()
+    if email or token:
+        session.auth = (email, token)
+    session.headers.update({'Accept': 'application/json', 'Content-Type': 'application/json'})
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+class EndpointMetrics:
+    """Latency of ALM API calls per endpoint. Recent samples are kept for percentiles.
+
+    Every attempt counts as a call, including throttled ones. Errors are HTTP 4xx/5xx answers
+    and requests that got no answer at all.
+    """
+    SAMPLES = 512
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {} # endpoint -> counters and recent latencies
+
+    def record(self, endpoint: str, seconds: float, status: int = None):
+        with self._lock:
+            metrics = self._endpoints.setdefault(endpoint, {'calls': 0, 'errors': 0, 'total_seconds': 0.0, 'max_seconds': 0.0, 'samples': deque(maxlen=self.SAMPLES)})
+            metrics['calls'] += 1
+            if status is None or status >= 400:
+                metrics['errors'] += 1
+            metrics['total_seconds'] += seconds
+            metrics['max_seconds'] = max(metrics['max_seconds'], seconds)
+            metrics['samples'].append(seconds)
+
+    def stats(self) -> dict:
+        with self._lock:
+            report = {}
+            for endpoint, metrics in sorted(self._endpoints.items()):
+                samples = sorted(metrics['samples'])
+                report[endpoint] = {
+                    'calls': metrics['calls'],
+                    'errors': metrics['errors'],
+                    'avg_seconds': metrics['total_seconds'] / metrics['calls'],
+                    'p50_seconds': samples[len(samples) // 2],
+                    'p95_seconds': samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+                    'max_seconds': metrics['max_seconds']
+                }
+            return report
+
+endpoint_metrics = EndpointMetrics()
+
+class AlmClientPool:
+    """Keep-alive sessions shared by every export in this process.
+
+    Sessions are keyed by server and a hash of the credentials, so an export reuses the
+    connections (and TLS sessions) of the previous export that used the same account, and never
+    the session (or cookies) of another account. Each
+    entry also remembers the projects that were found with it, so a repeat export skips the
+    connection check. Entries unused for ttl_seconds are closed once no export holds them.
+    """
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._clients = {} # (server, credential hash) -> {'session', 'projects', 'leases', 'last_used'}
+        self._hits = 0
+        self._misses = 0
+        self._expired = 0
+
+    @staticmethod
+    def _key(server: str, email: str, token: str, api_key: str) -> tuple:
+        credentials = hashlib.sha256(f"{email or ''}\0{token or ''}\0{api_key or ''}".encode('utf-8')).hexdigest()
+        return server.rstrip('/'), credentials
+
+    def _prune(self, now: float):
+        for key, client in list(self._clients.items()):
+            if not client['leases'] and now - client['last_used'] > self.ttl_seconds:
+                del self._clients[key]
+                client['session'].close()
+                self._expired += 1
+
+    @contextlib.contextmanager
+    def lease(self, server: str, email: str = None, token: str = None, api_key: str = None):
+        """Yields the pooled client for these credentials: a dict with 'session' and the set of
+        'projects' already found with it. With a TTL of 0 a fresh session is made and closed.
+
+        api_key is a token the caller sends in its own headers (Zephyr Scale); it only selects the
+        session, which is not given auth for it.
+        """
+        if self.ttl_seconds <= 0:
+            client = {'session': create_session(email, token), 'projects': set()}
+            try:
+                yield client
+            finally:
+                client['session'].close()
+            return
+        key = self._key(server, email, token, api_key)
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            client = self._clients.get(key)
+            if client is None:
+                self._misses += 1
+                client = self._clients[key] = {'session': create_session(email, token), 'projects': set(), 'leases': 0, 'last_used': now}
+            else:
+                self._hits += 1
+            client['leases'] += 1
+        try:
+            yield client
+        finally:
+            with self._lock:
+                client['leases'] -= 1
+                client['last_used'] = time.monotonic()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'clients': len(self._clients),
+                'in_use': sum(1 for client in self._clients.values() if client['leases']),
+                'hits': self._hits,
+                'misses': self._misses,
+                'expired': self._expired,
+                'ttl_seconds': self.ttl_seconds
+            }
+
+alm_clients = AlmClientPool(ALM_CLIENT_TTL_SECONDS)
+# (server, project key) pairs whose create screen has no Labels field; their issues are created unlabelled
+projects_without_labels = set()
+
+def alm_stats() -> dict:
+    """Pooled client counters and per-endpoint latencies for monitoring."""
+    return {'clients': alm_clients.stats(), 'endpoints': endpoint_metrics.stats()}
+
+def format_zephyr_steps(test_case_data: dict) -> list:
+    """Formats steps for the Zephyr Scale API; the expected result goes with the last step."""
+    steps = test_case_data.get('steps', [])
+    return [{
+        "step": step_desc,
+        "testData": "", # Our current test case format doesn't have separate test data
+        "expectedResult": test_case_data.get('expected_result', '') if i == len(steps) - 1 else ""
+    } for i, step_desc in enumerate(steps)]
+
 # --- NEW HELPER FUNCTION FOR ZEPHYR SCALE API ---
-def create_zephyr_test_case(jira_server: str, zephyr_api_token: str, project_key: str, jira_issue_key: str, test_case_data: dict):
+def create_zephyr_test_case(jira_server: str, zephyr_api_token: str, project_key: str, jira_issue_key: str, test_case_data: dict, session=None):
     """
     Creates a structured test case in Zephyr Scale via its REST API.
     This assumes a Jira issue (e.g., a Story) has already been created and linked.
+    Throttled calls (429/503) are retried as advised by Retry-After. Without a session, the
+    pooled keep-alive Zephyr Scale session is used.
     """
-    zephyr_api_base_url = "https://api.zephyrscale.smartbear.com/v2" # Base URL for Zephyr Scale Cloud API
     
     headers = {
         "Content-Type": "application/json",
@@ -34,14 +243,7 @@ def create_zephyr_test_case(jira_server: str, zephyr_api_token: str, project_key
 
     print(f"--- DEBUG: Zephyr Scale API Headers: {headers}") # Debugging line
 
-    # Format steps for Zephyr Scale API
-    zephyr_steps = []
-    for i, step_desc in enumerate(test_case_data.get('steps', [])):
-        zephyr_steps.append({
-            "step": step_desc,
-            "testData": "", # Our current test case format doesn't have separate test data
-            "expectedResult": test_case_data.get('expected_result', '') if i == len(test_case_data.get('steps', [])) - 1 else "" # Expected result usually goes with the last step
-        })
+    zephyr_steps = format_zephyr_steps(test_case_data)
 
     # Construct Zephyr Scale Test Case payload
     zephyr_payload = {
@@ -65,8 +267,12 @@ def create_zephyr_test_case(jira_server: str, zephyr_api_token: str, project_key
 
     print(f"--- DEBUG: Zephyr Scale API Payload: {json.dumps(zephyr_payload, indent=2)}")
 
+    response = None
     try:
-        response = requests.post(f"{zephyr_api_base_url}/testcases", headers=headers, data=json.dumps(zephyr_payload))
+        with contextlib.ExitStack() as stack:
+            if session is None:
+                session = stack.enter_context(alm_clients.lease(ZEPHYR_API_BASE_URL, api_key=zephyr_api_token))['session']
+            response = request_with_retries(session, 'POST', f"{ZEPHYR_API_BASE_URL}/testcases", endpoint='zephyr POST /testcases', headers=headers, data=json.dumps(zephyr_payload))
         response.raise_for_status() # Raise an exception for HTTP errors
         zephyr_response = response.json()
         print(f"--- DEBUG: Zephyr Scale API Response: {json.dumps(zephyr_response, indent=2)}")
@@ -77,31 +283,36 @@ def create_zephyr_test_case(jira_server: str, zephyr_api_token: str, project_key
             print(f"--- ERROR: Zephyr Scale API Response Text: {response.text}")
         raise # Re-raise the exception to be caught by the calling function
 
-# --- MODIFIED create_jira_issues FUNCTION ---
-def create_jira_issues(jira_server: str, jira_email: str, jira_token: str, project_key: str, test_cases: list, is_zephyr_api_integration: bool = False, zephyr_api_token: str = None):
-    """
-    Connects to Jira and creates issues. If is_zephyr_api_integration is True,
-    it creates a Jira 'Story' and then a linked Zephyr Scale Test Case.
-    """
-    try:
-        print(f"--- JIRA INTEGRATION: Connecting to {jira_server}... ---")
-        jira_options = {'server': jira_server}
-        jira = JIRA(options=jira_options, basic_auth=(jira_email, jira_token))
-        jira.project(project_key)
-        print("--- JIRA INTEGRATION: Connection successful. ---")
-    except Exception as e:
-        error_message = f"Error connecting to Jira or finding project '{project_key}'. Please check your Server URL, Email, API Token, and Project Key. Error: {e}"
-        print(f"--- JIRA INTEGRATION: {error_message} ---")
-        return [error_message]
-
-    confirmations = []
-    for test_case in test_cases:
-        steps = test_case.get('steps', [])
-        rtm_str = format_rtm_for_jira(test_case.get('rtm_compliance_mapping'))
-        steps_str = "\n".join(f"# {step}" for step in steps) # Format steps for description
-
-        # Prepare common description content
-        description_content = f"""h3. Requirement ID
+
+def update_zephyr_test_case(zephyr_api_token: str, zephyr_test_case_key: str, test_case_data: dict, session):
+    """Brings an existing Zephyr Scale test case in line with an edited test case: its name,
+    objective and labels, then its steps (replaced as a whole). Raises on API errors."""
+    headers = {"Content-Type": "application/json", "api_key": zephyr_api_token}
+    url = f"{ZEPHYR_API_BASE_URL}/testcases/{zephyr_test_case_key}"
+    response = request_with_retries(session, 'GET', url, endpoint='zephyr GET /testcases', headers=headers)
+    response.raise_for_status()
+    # The update endpoint takes the whole test case back, so change the fetched one
+    zephyr_test_case = response.json()
+    zephyr_test_case['name'] = test_case_data.get('description', 'No description provided')
+    zephyr_test_case['objective'] = test_case_data.get('description', 'No objective provided')
+    zephyr_test_case['labels'] = [test_case_data.get('test_type', 'Automated')]
+    response = request_with_retries(session, 'PUT', url, endpoint='zephyr PUT /testcases', headers=headers, data=json.dumps(zephyr_test_case))
+    response.raise_for_status()
+    steps_payload = {
+        "mode": "OVERWRITE",
+        "items": [{"inline": {"description": step["step"], "testData": step["testData"], "expectedResult": step["expectedResult"]}} for step in format_zephyr_steps(test_case_data)]
+    }
+    response = request_with_retries(session, 'POST', f"{url}/teststeps", endpoint='zephyr POST /teststeps', headers=headers, data=json.dumps(steps_payload))
+    response.raise_for_status()
+    return zephyr_test_case_key
+
+
+def format_issue_description(test_case: dict) -> str:
+    steps = test_case.get('steps', [])
+    rtm_str = format_rtm_for_jira(test_case.get('rtm_compliance_mapping'))
+    steps_str = "\n".join(f"# {step}" for step in steps) # Format steps for description
+
+    return f"""h3. Requirement ID
         {test_case.get('requirement_id', 'N/A')}
 
         h3. Test Type
@@ -127,58 +338,341 @@ def create_jira_issues(jira_server: str, jira_email: str, jira_token: str, proje
         {test_case.get('expected_result', 'N/A')}
         """
 
-        jira_issue_key = None
-        zephyr_test_case_key = None
+def build_issue_fields(test_case: dict, project_key: str, is_zephyr_api_integration: bool = False) -> dict:
+    """The Jira fields for a test case: a Task, or a Story that contains the Zephyr Scale test case."""
+    description = test_case.get('description', 'No description provided')
+    return {
+        'project': {'key': project_key},
+        'summary': f"Test Case Container: {description}" if is_zephyr_api_integration else description,
+        'description': format_issue_description(test_case),
+        'issuetype': {'name': 'Story' if is_zephyr_api_integration else 'Task'}
+    }
+
+def describe_jira_error(response) -> str:
+    try:
+        body = response.json()
+    except ValueError:
+        return f"HTTP {response.status_code}: {response.text[:200]}"
+    messages = list(body.get('errorMessages') or [])
+    messages.extend(f"{field}: {message}" for field, message in (body.get('errors') or {}).items())
+    return f"HTTP {response.status_code}: {'; '.join(messages) or response.reason}"
+
+def create_issue_batch(session, jira_server: str, field_list: list) -> list:
+    """Creates up to 50 issues with one bulk-create call.
+
+    Returns one (issue key, error message) pair per input, in input order. Jira lists the
+    created issues in order and reports each failure with the index of the failed element,
+    so a batch can partially succeed.
+    """
+    url = f"{jira_server.rstrip('/')}/rest/api/2/issue/bulk"
+    try:
+        response = request_with_retries(session, 'POST', url, endpoint='jira POST /issue/bulk', data=json.dumps({'issueUpdates': [{'fields': fields} for fields in field_list]}))
+    except requests.exceptions.RequestException as e:
+        return [(None, str(e))] * len(field_list)
+    try:
+        body = response.json()
+    except ValueError:
+        body = {}
+    created = iter(body.get('issues') or [])
+    failures = {}
+    for error in body.get('errors') or []:
+        element_errors = error.get('elementErrors') or {}
+        messages = list(element_errors.get('errorMessages') or [])
+        messages.extend(f"{field}: {message}" for field, message in (element_errors.get('errors') or {}).items())
+        failures[error.get('failedElementNumber')] = f"HTTP {error.get('status', response.status_code)}: {'; '.join(messages) or 'Unknown error'}"
+    if not body.get('issues') and not failures:
+        return [(None, describe_jira_error(response))] * len(field_list)
+    results = []
+    for index in range(len(field_list)):
+        if index in failures:
+            results.append((None, failures[index]))
+            continue
+        issue = next(created, None)
+        results.append((issue['key'], None) if issue else (None, describe_jira_error(response)))
+    return results
+
+def bulk_create_issues(session, jira_server: str, field_list: list, executor, on_batch=None) -> list:
+    """Creates the issues in batches of JIRA_BULK_BATCH_SIZE, submitted concurrently through the
+    executor. Returns one (issue key, error message) pair per input, in input order.
+
+    on_batch(start, results) is called from the worker as each batch finishes, so the keys can
+    be recorded before the rest of the export completes.
+    """
+    def create_batch(start):
+        results = create_issue_batch(session, jira_server, field_list[start:start + JIRA_BULK_BATCH_SIZE])
+        if on_batch is not None:
+            on_batch(start, results)
+        return results
+
+    futures = [executor.submit(create_batch, start) for start in range(0, len(field_list), JIRA_BULK_BATCH_SIZE)]
+    results = []
+    for future in futures:
+        results.extend(future.result())
+    return results
+
+def is_labels_error(error: str) -> bool:
+    """True for Jira's 'labels' field error, as when the project's create screen has no Labels field."""
+    return bool(error) and 'labels: ' in error
 
+def update_issue(session, jira_server: str, issue_key: str, fields: dict):
+    """Updates an issue's summary and description in place. Returns an error message, or None."""
+    url = f"{jira_server.rstrip('/')}/rest/api/2/issue/{issue_key}"
+    payload = {'fields': {'summary': fields['summary'], 'description': fields['description']}}
+    try:
+        response = request_with_retries(session, 'PUT', url, endpoint='jira PUT /issue', data=json.dumps(payload))
+    except requests.exceptions.RequestException as e:
+        return str(e)
+    return None if response.ok else describe_jira_error(response)
+
+def jql_string(value: str) -> str:
+    """Quotes a value for a JQL query, escaping backslashes and double quotes."""
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def find_issues_by_label(session, jira_server: str, project_key: str, labels: list) -> dict:
+    """Returns {label: issue key} for the project's issues that carry any of the labels."""
+    found = {}
+    for start in range(0, len(labels), JIRA_BULK_BATCH_SIZE):
+        chunk = labels[start:start + JIRA_BULK_BATCH_SIZE]
+        params = {'jql': f'project = {jql_string(project_key)} AND labels in ({", ".join(jql_string(label) for label in chunk)})', 'fields': 'labels', 'maxResults': 2 * len(chunk)}
         try:
-            if is_zephyr_api_integration:
-                if not zephyr_api_token:
-                    error_message = "Error: Zephyr Scale API integration requires a Zephyr Scale API Token."
-                    print(f"  - {error_message}")
-                    confirmations.append(error_message)
-                    continue
+            response = request_with_retries(session, 'GET', f"{jira_server.rstrip('/')}/rest/api/2/search", endpoint='jira GET /search', params=params)
+        except requests.exceptions.RequestException as e:
+            print(f"--- JIRA INTEGRATION: Could not look up interrupted creates: {e} ---")
+            continue
+        if not response.ok:
+            print(f"--- JIRA INTEGRATION: Could not look up interrupted creates: {describe_jira_error(response)} ---")
+            continue
+        wanted = set(chunk)
+        for issue in response.json().get('issues') or []:
+            for label in (issue.get('fields') or {}).get('labels') or []:
+                if label in wanted:
+                    found.setdefault(label, issue['key'])
+    return found
 
-                # 1. Create a Jira issue (e.g., a Story) to link the Zephyr Test Case to
-                jira_issue_dict = {
-                    'project': {'key': project_key},
-                    'summary': f"Test Case Container: {test_case.get('description', 'No description provided')}",
-                    'description': description_content, # Full details in Jira description
-                    'issuetype': {'name': 'Story'} # Use 'Story' as the container issue type
-                }
-                print(f"--- DEBUG: Creating Jira container issue (Story) for Zephyr: {jira_issue_dict['summary']}")
-                new_jira_issue = jira.create_issue(fields=jira_issue_dict)
-                jira_issue_key = new_jira_issue.key
-                confirmations.append(f"Successfully created Jira container issue: {jira_issue_key}")
-
-                # 2. Create the Zephyr Scale Test Case and link it to the Jira issue
-                print(f"--- DEBUG: Attempting to create Zephyr Scale Test Case for Jira issue {jira_issue_key} ---")
-                zephyr_test_case_key = create_zephyr_test_case(
-                    jira_server=jira_server,
-                    zephyr_api_token=zephyr_api_token,
-                    project_key=project_key,
-                    jira_issue_key=jira_issue_key,
-                    test_case_data=test_case
-                )
-                if zephyr_test_case_key:
-                    confirmations.append(f"Successfully created Zephyr Scale Test Case: {zephyr_test_case_key} linked to {jira_issue_key}")
-                else:
-                    confirmations.append(f"Failed to create Zephyr Scale Test Case for {jira_issue_key}")
+def issue_fingerprint(fields: dict) -> str:
+    """A hash of everything an export writes for a test case; it changes whenever the case is edited."""
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode('utf-8')).hexdigest()[:32]
 
-            else:
-                # Standard Jira issue creation (Task)
-                issue_dict = {
-                    'project': {'key': project_key},
-                    'summary': test_case.get('description', 'No description provided'),
-                    'description': description_content,
-                    'issuetype': {'name': 'Task'}
-                }
-                print(f"--- DEBUG: Creating standard Jira issue with issuetype: {issue_dict['issuetype']['name']}")
-                new_issue = jira.create_issue(fields=issue_dict)
-                confirmations.append(f"Successfully created issue: {new_issue.key}")
+def legacy_sync_refs(test_cases: list, fingerprints: list) -> list:
+    """The keys of cases stored without a case_uid: the test_case_id, or the fingerprint when the
+    ID is missing or shared (so such a case is matched only while it is unchanged)."""
+    id_counts = {}
+    for tc in test_cases:
+        test_case_id = str(tc.get('test_case_id') or '').strip()
+        id_counts[test_case_id] = id_counts.get(test_case_id, 0) + 1
+    refs = []
+    seen = {}
+    for tc, fingerprint in zip(test_cases, fingerprints):
+        test_case_id = str(tc.get('test_case_id') or '').strip()
+        if test_case_id and id_counts[test_case_id] == 1:
+            refs.append(f"id:{test_case_id}")
+            continue
+        seen[fingerprint] = seen.get(fingerprint, 0) + 1
+        refs.append(f"fp:{fingerprint}:{seen[fingerprint]}")
+    return refs
+
+def sync_refs(test_cases: list, fingerprints: list) -> list:
+    """The key each case is matched under across exports: the case_uid the result store assigned,
+    which edits keep, or for cases stored without one, its legacy ref."""
+    legacy = legacy_sync_refs(test_cases, fingerprints)
+    return [f"uid:{tc['case_uid']}" if tc.get('case_uid') else ref for tc, ref in zip(test_cases, legacy)]
 
-        except Exception as e:
-            error_message = f"Error creating issue for '{test_case.get('description', 'Unknown')[:30]}...'. Jira/Zephyr API Error: {e}"
-            print(f"  - {error_message}")
-            confirmations.append(error_message)
+class AlmSync:
+    """The Jira (and Zephyr Scale) keys that earlier exports of a stored result created in one project.
+
+    With it, an export creates only the test cases that were never exported, updates the ones
+    edited since, and skips the rest. Keys are saved batch by batch, so an export retried after
+    a partial failure picks up where it stopped. Created issues also carry a label derived from
+    the result and the test case (an idempotency key): if an export dies after Jira created a
+    batch but before its keys were saved, the next export finds those issues by label instead
+    of creating them again.
+    """
 
+    def __init__(self, store, result_id: str, jira_server: str, project_key: str, is_zephyr_api_integration: bool = False, fresh: bool = False):
+        """With fresh=True the earlier keys are ignored: every case is created again, and later syncs follow the new issues."""
+        self.store = store
+        self.result_id = result_id
+        self.target = f"{jira_server.rstrip('/')}|{project_key}|{'zephyr' if is_zephyr_api_integration else 'jira'}"
+        self.links = {} if fresh else store.alm_links(result_id, self.target)
+
+    def label(self, ref: str) -> str:
+        return JIRA_SYNC_LABEL_PREFIX + hashlib.sha256(f"{self.result_id}:{ref}".encode('utf-8')).hexdigest()[:20]
+
+    def save(self, links: dict):
+        self.store.save_alm_links(self.result_id, self.target, links)
+
+@span('jira')
+def create_jira_issues(jira_server: str, jira_email: str, jira_token: str, project_key: str, test_cases: list, is_zephyr_api_integration: bool = False, zephyr_api_token: str = None, sync: AlmSync = None):
+    """
+    Connects to Jira and creates issues. If is_zephyr_api_integration is True,
+    it creates a Jira 'Story' and then a linked Zephyr Scale Test Case.
+
+    Issues are created through Jira's bulk-create endpoint, JIRA_BULK_BATCH_SIZE at a time, with
+    up to JIRA_EXPORT_CONCURRENCY batches (or Zephyr Scale calls) in flight. Confirmations are
+    returned in the order of test_cases, as the one-issue-at-a-time export returned them.
+    With a sync, issues from earlier exports of the same result are updated or skipped instead.
+    """
+    with alm_clients.lease(jira_server, jira_email, jira_token) as client:
+        if project_key in client['projects']:
+            print(f"--- JIRA INTEGRATION: Reusing the pooled connection to {jira_server}. ---")
+        else:
+            try:
+                print(f"--- JIRA INTEGRATION: Connecting to {jira_server}... ---")
+                response = request_with_retries(client['session'], 'GET', f"{jira_server.rstrip('/')}/rest/api/2/project/{project_key}", endpoint='jira GET /project')
+                if not response.ok:
+                    raise Exception(describe_jira_error(response))
+                client['projects'].add(project_key)
+                print("--- JIRA INTEGRATION: Connection successful. ---")
+            except Exception as e:
+                error_message = f"Error connecting to Jira or finding project '{project_key}'. Please check your Server URL, Email, API Token, and Project Key. Error: {e}"
+                print(f"--- JIRA INTEGRATION: {error_message} ---")
+                return [error_message]
+        return export_issues(client['session'], jira_server, project_key, test_cases, is_zephyr_api_integration, zephyr_api_token, sync)
+
+def plan_sync(session, jira_server: str, project_key: str, test_cases: list, field_list: list, sync: AlmSync) -> list:
+    """Returns, per test case, its ref, fingerprint and the link stored by earlier exports ({} if
+    none). Creates that were sent but never confirmed are looked up by their label first."""
+    fingerprints = [issue_fingerprint(fields) for fields in field_list]
+    refs = sync_refs(test_cases, fingerprints)
+    plan = []
+    for ref, legacy_ref, fingerprint in zip(refs, legacy_sync_refs(test_cases, fingerprints), fingerprints):
+        # Links saved before cases had a case_uid are adopted, and saved under the new ref from now on
+        link_ref = ref if ref in sync.links or legacy_ref not in sync.links else legacy_ref
+        plan.append({'ref': ref, 'link_ref': link_ref, 'fingerprint': fingerprint, 'link': dict(sync.links.get(link_ref) or {})})
+    unconfirmed = [item for item in plan if item['link'] and not item['link'].get('issue_key')]
+    if unconfirmed and JIRA_SYNC_LABEL_PREFIX and (jira_server.rstrip('/'), project_key) not in projects_without_labels:
+        found = find_issues_by_label(session, jira_server, project_key, [sync.label(item['link_ref']) for item in unconfirmed])
+        recovered = {}
+        for item in unconfirmed:
+            issue_key = found.get(sync.label(item['link_ref']))
+            if issue_key:
+                item['link']['issue_key'] = issue_key
+                recovered[item['ref']] = item['link']
+        sync.save(recovered)
+        print(f"--- JIRA INTEGRATION: Recovered {len(recovered)} of {len(unconfirmed)} issues from an interrupted export. ---")
+    return plan
+
+def export_issues(session, jira_server: str, project_key: str, test_cases: list, is_zephyr_api_integration: bool, zephyr_api_token: str, sync: AlmSync = None):
+    """Creates (or, with a sync, updates or skips) the issues and Zephyr Scale test cases once the
+    project has been found."""
+    if is_zephyr_api_integration and not zephyr_api_token:
+        error_message = "Error: Zephyr Scale API integration requires a Zephyr Scale API Token."
+        print(f"  - {error_message}")
+        return [error_message] * len(test_cases)
+
+    def error_for(test_case, error):
+        error_message = f"Error creating issue for '{test_case.get('description', 'Unknown')[:30]}...'. Jira/Zephyr API Error: {error}"
+        print(f"  - {error_message}")
+        return error_message
+
+    started = time.perf_counter()
+    field_list = [build_issue_fields(test_case, project_key, is_zephyr_api_integration) for test_case in test_cases]
+    if sync is None:
+        plan = [{'ref': None, 'fingerprint': None, 'link': {}} for _ in test_cases]
+    else:
+        plan = plan_sync(session, jira_server, project_key, test_cases, field_list, sync)
+    to_create = [index for index, item in enumerate(plan) if not item['link'].get('issue_key')]
+    to_update = [index for index, item in enumerate(plan) if item['link'].get('issue_key') and item['link']['fingerprint'] != item['fingerprint']]
+
+    with contextlib.ExitStack() as stack:
+        # The Zephyr Scale lease is taken first so it is released only after the executor has finished
+        zephyr_session = stack.enter_context(alm_clients.lease(ZEPHYR_API_BASE_URL, api_key=zephyr_api_token))['session'] if is_zephyr_api_integration else None
+        executor = stack.enter_context(concurrent.futures.ThreadPoolExecutor(max_workers=JIRA_EXPORT_CONCURRENCY))
+
+        project = (jira_server.rstrip('/'), project_key)
+        labelled = sync is not None and bool(JIRA_SYNC_LABEL_PREFIX) and project not in projects_without_labels
+        if sync is not None:
+            # Record the creates before sending them, so an interrupted export looks them up next time
+            sync.save({plan[index]['ref']: {'fingerprint': plan[index]['fingerprint']} for index in to_create})
+
+        def create(indices, labels):
+            """Bulk-creates the issues of the given test cases; returns {index: (issue key, error)}."""
+            on_batch = None
+            if sync is not None:
+                def on_batch(start, batch_results):
+                    sync.save({plan[indices[start + offset]]['ref']: {'fingerprint': plan[indices[start + offset]]['fingerprint'], 'issue_key': issue_key}
+                               for offset, (issue_key, _) in enumerate(batch_results) if issue_key})
+            create_fields = [dict(field_list[index], labels=[sync.label(plan[index]['ref'])]) if labels else field_list[index] for index in indices]
+            return dict(zip(indices, bulk_create_issues(session, jira_server, create_fields, executor, on_batch)))
+
+        print(f"--- JIRA INTEGRATION: Creating {len(to_create)} issues in batches of {JIRA_BULK_BATCH_SIZE}"
+              + (f", updating {len(to_update)}, skipping {len(test_cases) - len(to_create) - len(to_update)} unchanged" if sync is not None else "") + "... ---")
+        results = create(to_create, labelled)
+        if labelled:
+            rejected = [index for index in to_create if is_labels_error(results[index][1])]
+            if rejected:
+                # Without labels, creates an interrupted export sent but never recorded cannot be recovered
+                print(f"--- JIRA INTEGRATION: Project {project_key} does not accept labels on create; creating {len(rejected)} issues without sync labels. ---")
+                projects_without_labels.add(project)
+                results.update(create(rejected, False))
+        update_futures = {index: executor.submit(update_issue, session, jira_server, plan[index]['link']['issue_key'], field_list[index]) for index in to_update}
+        for index, item in enumerate(plan):
+            if index in update_futures:
+                error = update_futures[index].result()
+                results[index] = (None if error else item['link']['issue_key'], error)
+            elif index not in results:
+                results[index] = (item['link']['issue_key'], None)
+
+        zephyr_futures = {}
+        if is_zephyr_api_integration:
+            # Zephyr Scale has no bulk endpoint; link a test case to each container issue, a few at a time
+            for index, item in enumerate(plan):
+                issue_key = results[index][0]
+                zephyr_key = item['link'].get('zephyr_key')
+                if not issue_key:
+                    continue
+                if not zephyr_key:
+                    zephyr_futures[index] = executor.submit(
+                        create_zephyr_test_case, jira_server=jira_server, zephyr_api_token=zephyr_api_token, project_key=project_key,
+                        jira_issue_key=issue_key, test_case_data=test_cases[index], session=zephyr_session
+                    )
+                elif index in update_futures:
+                    zephyr_futures[index] = executor.submit(update_zephyr_test_case, zephyr_api_token, zephyr_key, test_cases[index], zephyr_session)
+
+        confirmations = []
+        synced = {}
+        counts = {'created': 0, 'updated': 0, 'unchanged': 0, 'failed': 0}
+        for index, (test_case, item) in enumerate(zip(test_cases, plan)):
+            issue_key, error = results[index]
+            if error:
+                counts['failed'] += 1
+                confirmations.append(error_for(test_case, error))
+                continue
+            if index in update_futures:
+                action = 'updated'
+            elif item['link'].get('issue_key'):
+                action = 'unchanged'
+            else:
+                action = 'created'
+            counts[action] += 1
+            link = {'fingerprint': item['fingerprint'], 'issue_key': issue_key, 'zephyr_key': item['link'].get('zephyr_key')}
+            if not is_zephyr_api_integration:
+                confirmations.append(f"Unchanged since the last export, skipped issue: {issue_key}" if action == 'unchanged' else f"Successfully {action} issue: {issue_key}")
+            elif index not in zephyr_futures:
+                confirmations.append(f"Unchanged since the last export, skipped Jira container issue: {issue_key} and Zephyr Scale Test Case: {link['zephyr_key']}")
+            else:
+                confirmations.append(f"Unchanged since the last export, kept Jira container issue: {issue_key}" if action == 'unchanged' else f"Successfully {action} Jira container issue: {issue_key}")
+                zephyr_action = 'updated' if link['zephyr_key'] else 'created'
+                zephyr_test_case_key = None
+                try:
+                    zephyr_test_case_key = zephyr_futures[index].result()
+                    if zephyr_test_case_key:
+                        confirmations.append(f"Successfully {zephyr_action} Zephyr Scale Test Case: {zephyr_test_case_key} linked to {issue_key}")
+                    else:
+                        confirmations.append(f"Failed to create Zephyr Scale Test Case for {issue_key}")
+                except Exception as e:
+                    confirmations.append(error_for(test_case, e))
+                if zephyr_test_case_key:
+                    link['zephyr_key'] = zephyr_test_case_key
+                elif action == 'updated':
+                    # Keep the old fingerprint, so the next sync updates the Zephyr Scale test case again
+                    link['fingerprint'] = item['link']['fingerprint']
+            if sync is not None:
+                synced[item['ref']] = link
+    if sync is not None:
+        sync.save(synced)
+    elapsed = time.perf_counter() - started
+    written = counts['created'] + counts['updated']
+    print(f"--- JIRA INTEGRATION: {counts['created']} created, {counts['updated']} updated, {counts['unchanged']} unchanged, {counts['failed']} failed "
+          f"of {len(test_cases)} in {elapsed:.2f}s ({written / elapsed if elapsed else 0:.1f} issues/s). ---")
     return confirmations
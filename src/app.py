@@ -3,13 +3,12 @@ import os
 import json
 import re
 import io
-import csv
 import concurrent.futures
+import contextvars
+import copy
 import time # Added for retry mechanism
-from flask import Flask, request, jsonify, render_template, send_file, session
+from flask import Flask, Response, request, jsonify, render_template, send_file, session, stream_with_context, g
 from dotenv import load_dotenv
-from openpyxl import Workbook
-from fpdf import FPDF
 
 import firebase_admin
 from firebase_admin import credentials, firestore
@@ -18,15 +17,31 @@ from firebase_admin import credentials, firestore
 load_dotenv()
 
 # Corrected: Use absolute imports as 'src' is on the path
-from document_parser import parse_document
+from document_parser import iter_document_chunks, fingerprint_chunk, start_pdf_extraction_pool
+# Start the PDF extraction workers (and their fork server) now rather than on the first upload
+start_pdf_extraction_pool()
 # Corrected: Import the new simplified function
-from test_generator import generate_test_cases_from_chunk, edit_test_cases_with_ai, detect_ambiguity
-from alm_integrator import create_jira_issues # Keep this import
+from test_generator import generate_test_cases_from_chunk, edit_test_cases_with_ai, detect_ambiguity, merge_ambiguity_reports
+from alm_integrator import create_jira_issues, alm_stats, AlmSync # Keep this import
 from quality_guardian import run_quality_checks # Re-enable quality checks
+from llm_scheduler import llm_scheduler, request_scope
+from job_queue import JobQueue, DEFAULT_JOB_DB_PATH
+from requirement_filter import is_requirement_chunk
+from dedup import create_deduplicator
+from document_store import create_document_store
+from result_store import create_result_store, ResultVersionConflict
+from exporters import EXPORTERS, EXPORT_HEADERS
+from firebase_integrator import FirestoreWriter
+from metrics import span, trace_scope, current_trace, register_gauge, TimedIterator, render as render_metrics
+from uploads import SpoolingRequest, UploadLease, upload_source, upload_admission, remove_spooled_files, UPLOAD_MAX_BYTES
+import test_generator
 
 # Initialize the Flask application
 app = Flask(__name__, template_folder='../templates', static_folder='../static')
 app.secret_key = os.urandom(24)
+# Large uploads are spooled to disk, and anything over the limit is refused before it is read
+app.request_class = SpoolingRequest
+app.config['MAX_CONTENT_LENGTH'] = UPLOAD_MAX_BYTES
 
 # Initialize Firebase
 try:
@@ -55,109 +70,37 @@ except Exception as e:
     print(f"Error initializing Firebase: {e}")
     db = None
 
-document_cache = {}
+# Suites are saved to Firestore in the background, sharded across documents
+firestore_writer = FirestoreWriter(db) if db else None
+
+# Per-user 'extracted_text' and 'test_cases' (last generated suite); bounded, optionally shared
+document_store = create_document_store()
+# Generated suites (versioned on every edit) and ambiguity reports, referenced by result ID
+result_store = create_result_store()
 
 # --- Helper Functions for File Generation (Accepting headers) ---
 
-def format_rtm_for_export(rtm):
-    if not rtm: return 'N/A'
-    if isinstance(rtm, str): return rtm
-    if isinstance(rtm, dict): return rtm.get('rule_id', json.dumps(rtm))
-    if isinstance(rtm, list): return ', '.join([format_rtm_for_export(item) for item in rtm])
-    return str(rtm)
+def export_response(chunks, filename, mimetype, size=None, stage='export'):
+    """Streams an export's chunks as a download.
 
-def create_csv(test_cases, headers):
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(headers)
-    for tc in test_cases:
-        row = []
-        for header in headers:
-            if header == 'steps':
-                row.append("\n".join(tc.get('steps', [])))
-            elif header == 'rtm_compliance_mapping':
-                row.append(format_rtm_for_export(tc.get('rtm_compliance_mapping')))
-            else:
-                row.append(tc.get(header, 'N/A'))
-        writer.writerow(row)
-    return io.BytesIO(output.getvalue().encode('utf-8'))
+    The first chunk is rendered before the response starts, so a failing export still gets a
+    JSON error instead of a truncated file. Rendering time is recorded as a `stage` span.
+    """
+    chunks = TimedIterator(chunks, stage)
+    first_chunk = next(chunks, b'')
 
-def create_xlsx(test_cases, headers):
-    workbook = Workbook()
-    sheet = workbook.active
-    sheet.title = "Test Cases"
-    sheet.append(headers)
-    for tc in test_cases:
-        row = []
-        for header in headers:
-            if header == 'steps':
-                row.append("\n".join(tc.get('steps', [])))
-            elif header == 'rtm_compliance_mapping':
-                row.append(format_rtm_for_export(tc.get('rtm_compliance_mapping')))
-            else:
-                row.append(tc.get(header, 'N/A'))
-        sheet.append(row)
-    output = io.BytesIO()
-    workbook.save(output)
-    output.seek(0)
-    return output
-
-def create_pdf(test_cases, headers):
-    pdf = FPDF(orientation='L')
-    pdf.add_page()
-    pdf.set_font("Arial", size=8)
-    col_widths = [20, 25, 50, 20, 20, 50, 50, 50] # Adjusted widths
-    for i, header in enumerate(headers):
-        pdf.cell(col_widths[i], 10, header.replace('_', ' ').title(), 1)
-    pdf.ln()
-    for tc in test_cases:
-        row = []
-        for header in headers:
-            if header == 'steps':
-                row.append("\n".join(tc.get('steps', [])))
-            elif header == 'rtm_compliance_mapping':
-                row.append(format_rtm_for_export(tc.get('rtm_compliance_mapping')))
-            else:
-                row.append(str(tc.get(header, 'N/A')))
-        
-        y_before = pdf.get_y()
-        max_height = 0
-        for i, item in enumerate(row):
-            pdf.set_font("Arial", size=8)
-            # Sanitize text for PDF generation
-            sanitized_item = item.encode('latin-1', 'replace').decode('latin-1')
-            num_lines = len(pdf.multi_cell(col_widths[i], 5, sanitized_item, split_only=True))
-            cell_height = num_lines * 5
-            if cell_height > max_height:
-                max_height = cell_height
-
-        pdf.set_y(y_before)
-        for i, item in enumerate(row):
-            # Sanitize text for PDF generation
-            sanitized_item = item.encode('latin-1', 'replace').decode('latin-1')
-            pdf.multi_cell(col_widths[i], max_height, sanitized_item, border=1, align='L')
-            if i < len(row) - 1:
-                pdf.set_y(y_before)
-                pdf.set_x(pdf.get_x() + col_widths[i])
-        pdf.ln(max_height)
-
-    output = io.BytesIO(pdf.output(dest='S').encode('latin-1'))
-    return output
-
-def create_txt(test_cases, headers):
-    output = io.StringIO()
-    for tc in test_cases:
-        for header in headers:
-            if header == 'steps':
-                steps = "\n".join([f"  {i+1}. {s}" for i, s in enumerate(tc.get('steps', []))])
-                output.write(f"Steps:\n{steps}\n")
-            elif header == 'rtm_compliance_mapping':
-                rtm = format_rtm_for_export(tc.get('rtm_compliance_mapping'))
-                output.write(f"RTM Compliance Mapping: {rtm}\n")
-            else:
-                output.write(f"{header.replace('_', ' ').title()}: {tc.get(header, 'N/A')}\n")
-        output.write("-" * 30 + "\n")
-    return io.BytesIO(output.getvalue().encode('utf-8'))
+    def body():
+        try:
+            yield first_chunk
+            yield from chunks
+        finally:
+            chunks.close()
+
+    # content_type is sent as given; mimetype would get a second charset appended
+    response = Response(body(), content_type=mimetype, headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+    if size is not None:
+        response.content_length = size
+    return response
 
 # --- New Helper Functions for Ambiguity Report Download ---
 def create_ambiguity_report_txt(report):
@@ -172,16 +115,31 @@ def create_ambiguity_report_txt(report):
     return io.BytesIO(output.getvalue().encode('utf-8'))
 
 # New helper function for the fully parallel pipeline
-def generate_and_check(chunk):
-    """A single task that generates test cases from a chunk and runs quality checks."""
+def generate_and_check(chunk, deduplicator=None):
+    """A single task that generates test cases from a chunk and runs quality checks.
+
+    With a deduplicator (shared by every chunk of one upload), near-duplicates of cases already
+    generated from other chunks are dropped before they are quality checked.
+    """
     retries = 3
     delay = 2 # seconds
+    test_cases = None
     for i in range(retries):
         try:
-            test_cases = generate_test_cases_from_chunk(chunk)
+            # Generation and dedup run once; a retry only repeats the quality checks, since the
+            # cases are already indexed and would otherwise all be dropped as duplicates of themselves
+            if test_cases is None:
+                test_cases = generate_test_cases_from_chunk(chunk)
+                if deduplicator is not None:
+                    with span('dedup'):
+                        test_cases = deduplicator.remove_duplicates(test_cases)
             if not test_cases:
                 return [] # Return empty list if generation fails
             checked_test_cases = run_quality_checks(test_cases) # Re-enable quality checks
+            # Tag each case with its source chunk so a revised upload can reuse it if the chunk is unchanged
+            chunk_fingerprint = fingerprint_chunk(chunk)
+            for tc in checked_test_cases:
+                tc['chunk_fingerprint'] = chunk_fingerprint
             return checked_test_cases
         except Exception as e:
             print(f"Attempt {i+1}/{retries} failed for chunk. Error: {e}")
@@ -192,25 +150,55 @@ def generate_and_check(chunk):
                 print(f"All {retries} attempts failed for chunk. Skipping this chunk.")
                 return [] # Return empty if all retries fail
 
+def group_by_chunk_fingerprint(test_cases):
+    groups = {}
+    for tc in test_cases or []:
+        if tc.get('chunk_fingerprint'):
+            groups.setdefault(tc['chunk_fingerprint'], []).append(tc)
+    return groups
+
+def load_previous_suite(user_id):
+    """Returns the user's last generated suite grouped by chunk fingerprint (memory first, then Firestore)."""
+    test_cases = document_store.get(user_id, 'test_cases')
+    if test_cases is None and firestore_writer:
+        try:
+            test_cases = firestore_writer.load_latest(user_id)
+        except Exception as e:
+            print(f"DEBUG: Could not load previous suite from Firebase: {e}")
+    return group_by_chunk_fingerprint(test_cases)
+
+def find_reusable_chunks(text_chunks, previous_suite):
+    """Maps the index of each unchanged chunk to copies of the test cases generated for it last time."""
+    carried_over = {}
+    seen_fingerprints = set()
+    for index, chunk in enumerate(text_chunks):
+        chunk_fingerprint = fingerprint_chunk(chunk)
+        # A repeated chunk reuses its cases only once; the previous suite grouped all copies together
+        if chunk_fingerprint in previous_suite and chunk_fingerprint not in seen_fingerprints:
+            carried_over[index] = copy.deepcopy(previous_suite[chunk_fingerprint])
+        seen_fingerprints.add(chunk_fingerprint)
+    return carried_over
+
+@span('firebase')
 def save_test_cases_to_firebase(user_id, test_cases):
+    """Queues the suite for a background save to Firestore.
+
+    Returns (confirmations, save status); the status (None if nothing was queued) carries a
+    status_url to poll for progress and failures.
+    """
     print(f"DEBUG: Entering save_test_cases_to_firebase for user_id: {user_id}, with {len(test_cases)} test cases.")
-    if not db:
+    if not firestore_writer:
         print("DEBUG: Firebase db object is None. Cannot save test cases.")
-        return ["Firebase not initialized. Cannot save test cases."]
-    
-    confirmations = []
+        return ["Firebase not initialized. Cannot save test cases."], None
+
     try:
-        doc_ref = db.collection('users').document(user_id).collection('test_case_history').document()
-        doc_ref.set({
-            'timestamp': firestore.SERVER_TIMESTAMP,
-            'test_cases': test_cases
-        })
-        confirmations.append(f"Test cases saved to Firebase with ID: {doc_ref.id}")
-        print(f"DEBUG: Successfully saved to Firebase: {doc_ref.id}")
+        save = firestore_writer.submit(user_id, test_cases, {'chunk_fingerprints': sorted(group_by_chunk_fingerprint(test_cases))})
     except Exception as e:
-        confirmations.append(f"Error saving to Firebase: {e}")
         print(f"DEBUG: Error saving to Firebase: {e}")
-    return confirmations
+        return [f"Error saving to Firebase: {e}"], None
+    save['status_url'] = f"/firebase_saves/{save['save_id']}"
+    print(f"DEBUG: Queued Firebase save: {save['save_id']}")
+    return [f"Saving test cases to Firebase in the background with ID: {save['save_id']}"], save
 
 @app.route('/')
 def index():
@@ -218,161 +206,530 @@ def index():
         session['user_id'] = os.urandom(16).hex()
     return render_template('index.html')
 
-@app.route('/generate_and_analyze', methods=['POST'])
-def handle_generate_and_analyze():
-    if 'user_id' not in session: return jsonify({'error': 'Session expired'}), 400
-    if 'requirement_file' not in request.files: return jsonify({'error': 'No file part'}), 400
-    file = request.files['requirement_file']
-    if file.filename == '': return jsonify({'error': 'No selected file'}), 400
-    
-    raw_save_to_firebase_value = request.form.get('save_to_firebase')
-    print(f"DEBUG: Raw save_to_firebase value from request.form: {raw_save_to_firebase_value}")
-    # Correctly interpret 'on' from checkbox as True, and None (if unchecked) as False
-    save_to_firebase = bool(raw_save_to_firebase_value)
-    print(f"DEBUG: save_to_firebase flag after conversion: {save_to_firebase}")
-    firebase_confirmations = []
-
-    try:
-        file_content = file.read()
-        text_chunks = parse_document(file.filename, file_content)
-        
-        extracted_text = "\n\n".join(text_chunks)
-        document_cache[session['user_id']] = extracted_text
-
-        # --- New: Ambiguity Detection ---
-        print("--- Detecting requirement ambiguity... ---")
-        ambiguity_report = detect_ambiguity(extracted_text)
-        session['ambiguity_report'] = ambiguity_report # Store in session for download
+def read_jira_auto_export_config(form):
+    """Collects the upload form's Jira auto-export settings, or None if auto-export is off."""
+    if not form.get('jira_auto_export'):
+        return None
+    jira_config = {
+        'jira_server': form.get('jira_server'),
+        'jira_email': form.get('jira_email'),
+        'jira_token': form.get('jira_token'),
+        'project_key': form.get('jira_project_key'),
+        'is_zephyr_api_integration': form.get('is_zephyr_api_integration') == 'true', # Get Zephyr API integration flag
+        'zephyr_api_token': form.get('zephyr_api_token') # Get Zephyr API Token
+    }
+    zephyr_api_token = jira_config['zephyr_api_token']
+    print(f"--- DEBUG: Jira Auto-Export Request ---\n  Server: {jira_config['jira_server']}\n  Email: {jira_config['jira_email']}\n  Project Key: {jira_config['project_key']}\n  Is Zephyr API Integration: {jira_config['is_zephyr_api_integration']}\n  Zephyr API Token: {'*' * len(zephyr_api_token) if zephyr_api_token else 'N/A'}")
+    return jira_config
+
+def generation_events(user_id, text_chunks, save_to_firebase, jira_config, previous_suite=None):
+    """Runs the full generation pipeline, yielding an event dict as soon as each stage finishes.
+
+    `text_chunks` may be a lazy iterator (a PDF is chunked while later pages are still being
+    extracted); each chunk's tasks are submitted as soon as it arrives. Ambiguity detection runs
+    per chunk in the same pool as generation, so it overlaps with it and never sends the whole
+    document in one prompt. Chunks whose fingerprint appears in `previous_suite` are unchanged
+    since the user's last suite, so their previous test cases are reused instead of regenerated.
+    Chunks the requirement pre-filter rejects (contents pages, revision tables, boilerplate) are
+    completed with no test cases and never sent to Gemini. Test cases that near-duplicate one
+    from another chunk are dropped before quality checks.
+
+    Event types: 'started'; 'chunk_complete' (one per chunk, carrying that chunk's checked test
+    cases and progress counters); 'parsing_complete' (extracted text and chunk count, once the
+    document is fully chunked); 'ambiguity_report' (once every chunk has been analyzed); then
+    either 'complete' or 'error'.
+    """
+    previous_suite = previous_suite or {}
+    yield {'event': 'started'}
+
+    all_test_cases = []
+    chunk_texts = []
+    chunk_ambiguity_reports = []
+    seen_fingerprints = set()
+    state = {'completed_chunks': 0, 'total_chunks': None, 'reused_chunks': 0, 'skipped_chunks': 0, 'ambiguity_report': None}
+    deduplicator = create_deduplicator()
+
+    def chunk_complete_event(test_cases, carried_over=False, skipped=False):
+        state['completed_chunks'] += 1
+        all_test_cases.extend(test_cases)
+        event = {
+            'event': 'chunk_complete',
+            'test_cases': test_cases,
+            'completed_chunks': state['completed_chunks'],
+            'total_chunks': state['total_chunks'], # None until parsing has finished
+            'total_test_cases': len(all_test_cases)
+        }
+        if carried_over:
+            event['carried_over'] = True
+        if skipped:
+            event['skipped'] = True
+        return event
+
+    def ambiguity_event():
+        # --- New: Ambiguity Detection (map-reduced over chunks) ---
+        ambiguity_report = merge_ambiguity_reports(chunk_ambiguity_reports)
+        state['ambiguity_report'] = ambiguity_report # Stored with the suite in finalize_generation
         print(f"--- Ambiguity detection complete. Found {len(ambiguity_report)} potential issues. ---")
-        
-        print(f"--- Found {len(text_chunks)} chunks. Processing in parallel... ---")
-
-        all_test_cases = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-            future_to_chunk = {executor.submit(generate_and_check, chunk): chunk for chunk in text_chunks}
-            for future in concurrent.futures.as_completed(future_to_chunk):
+        return {'event': 'ambiguity_report', 'ambiguity_report': ambiguity_report}
+
+    # Every Gemini call made for this upload shares one fair queue in the process-wide scheduler
+    with request_scope(f"{user_id}:{os.urandom(4).hex()}"):
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+        generation_futures = set()
+        ambiguity_futures = {}
+
+        def finished_events(futures):
+            for future in futures:
+                if future in ambiguity_futures:
+                    try:
+                        chunk_ambiguity_reports[ambiguity_futures.pop(future)] = future.result()
+                    except Exception as exc:
+                        print(f"An ambiguity detection task failed with an exception: {exc}")
+                    if state['total_chunks'] is not None and not ambiguity_futures:
+                        yield ambiguity_event()
+                    continue
+
+                generation_futures.discard(future)
                 try:
-                    checked_test_cases = future.result()
-                    if checked_test_cases:
-                        all_test_cases.extend(checked_test_cases)
+                    checked_test_cases = future.result() or []
                 except Exception as exc:
                     print(f"A chunk processing task failed with an exception: {exc}")
+                    checked_test_cases = []
+                yield chunk_complete_event(checked_test_cases)
 
-        if not all_test_cases:
-            return jsonify({'error': 'The AI did not generate any valid test cases.'}), 500
-
-        print("--- All processing complete. ---")
-
-        if save_to_firebase:
-            print("DEBUG: Calling save_test_cases_to_firebase from handle_generate_and_analyze.")
-            firebase_confirmations = save_test_cases_to_firebase(session['user_id'], all_test_cases)
-
-        # --- New: Dashboard Stats ---
-        total_generated = len(all_test_cases)
-        valid_cases = sum(1 for tc in all_test_cases if tc.get('quality_assessment', {}).get('passed', True))
-        dashboard_stats = {
+        try:
+            for index, chunk in enumerate(text_chunks):
+                chunk_texts.append(chunk)
+                chunk_ambiguity_reports.append(None)
+                if not is_requirement_chunk(chunk):
+                    state['skipped_chunks'] += 1
+                    yield chunk_complete_event([], skipped=True)
+                    continue
+                chunk_fingerprint = fingerprint_chunk(chunk)
+                # A repeated chunk reuses its cases only once; the previous suite grouped all copies together
+                if chunk_fingerprint in previous_suite and chunk_fingerprint not in seen_fingerprints:
+                    state['reused_chunks'] += 1
+                    carried_test_cases = copy.deepcopy(previous_suite[chunk_fingerprint])
+                    if deduplicator is not None:
+                        carried_test_cases = deduplicator.remove_duplicates(carried_test_cases)
+                    yield chunk_complete_event(carried_test_cases, carried_over=True)
+                else:
+                    # Copy the context so worker threads keep this request's scheduler queue
+                    generation_futures.add(executor.submit(contextvars.copy_context().run, generate_and_check, chunk, deduplicator))
+                seen_fingerprints.add(chunk_fingerprint)
+                # Unchanged chunks are still analyzed; the response cache answers those without an LLM call
+                ambiguity_futures[executor.submit(contextvars.copy_context().run, detect_ambiguity, chunk)] = index
+
+                # Report whatever finished while we were waiting for this chunk
+                yield from finished_events([f for f in list(generation_futures) + list(ambiguity_futures) if f.done()])
+
+            state['total_chunks'] = len(chunk_texts)
+            extracted_text = "\n\n".join(chunk_texts)
+            document_store.put(user_id, 'extracted_text', extracted_text)
+            print(f"--- Found {state['total_chunks']} chunks ({state['reused_chunks']} unchanged, {state['skipped_chunks']} without requirements). Waiting for generation and ambiguity detection... ---")
+            yield {
+                'event': 'parsing_complete',
+                'extracted_text': extracted_text,
+                'total_chunks': state['total_chunks'],
+                'reused_chunks': state['reused_chunks'],
+                'skipped_chunks': state['skipped_chunks'],
+                'completed_chunks': state['completed_chunks']
+            }
+            if not ambiguity_futures and state['ambiguity_report'] is None:
+                yield ambiguity_event()
+
+            yield from finished_events(concurrent.futures.as_completed(list(generation_futures) + list(ambiguity_futures)))
+        finally:
+            # If the client went away mid-stream, don't spend quota on chunks nobody will see
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    if not all_test_cases:
+        yield {'event': 'error', 'error': 'The AI did not generate any valid test cases.'}
+        return
+
+    print("--- All processing complete. ---")
+
+    complete_event = {
+        'event': 'complete',
+        'incremental': {
+            'reused_chunks': state['reused_chunks'],
+            'regenerated_chunks': state['total_chunks'] - state['reused_chunks'] - state['skipped_chunks']
+        },
+        'prefilter': {'skipped_chunks': state['skipped_chunks'], 'total_chunks': state['total_chunks']}
+    }
+    if deduplicator is not None:
+        deduplicator.attach_merges(all_test_cases)
+        complete_event['dedup'] = deduplicator.stats()
+        print(f"--- Dedup: removed {complete_event['dedup']['duplicates_removed']} near-duplicate test cases. ---")
+    complete_event.update(finalize_generation(user_id, all_test_cases, save_to_firebase, jira_config, state['ambiguity_report']))
+    yield complete_event
+
+def finalize_generation(user_id, all_test_cases, save_to_firebase, jira_config, ambiguity_report=None):
+    """Runs the post-generation steps (result store, Firebase save, dashboard stats, Jira auto-export)."""
+    # Remember the suite so the next upload of a revised document can reuse unchanged chunks
+    document_store.put(user_id, 'test_cases', all_test_cases)
+    # Downloads, edits and exports refer to the suite by this ID instead of posting it back
+    with span('store'):
+        stored = result_store.create(user_id, all_test_cases, ambiguity_report)
+
+    firebase_confirmations, firebase_save = [], None
+    if save_to_firebase:
+        print("DEBUG: Calling save_test_cases_to_firebase from generation pipeline.")
+        firebase_confirmations, firebase_save = save_test_cases_to_firebase(user_id, all_test_cases)
+
+    # --- New: Dashboard Stats ---
+    total_generated = len(all_test_cases)
+    valid_cases = sum(1 for tc in all_test_cases if tc.get('quality_assessment', {}).get('passed', True))
+    result = {
+        'result_id': stored['result_id'],
+        'result_version': stored['version'],
+        'dashboard_stats': {
             'total_generated': total_generated,
             'valid_cases': valid_cases
         }
+    }
+    if firebase_confirmations:
+        result['firebase_confirmations'] = firebase_confirmations
+    if firebase_save:
+        result['firebase_save'] = firebase_save
+
+    # --- Automatic Jira Export ---
+    if jira_config is not None:
+        if jira_config['jira_server'] and jira_config['jira_email'] and jira_config['jira_token'] and jira_config['project_key']:
+            try:
+                print("--- Attempting automatic Jira export... ---")
+                # Record the keys, so a later manual export of this result updates these issues
+                sync = AlmSync(result_store, stored['result_id'], jira_config['jira_server'], jira_config['project_key'], jira_config['is_zephyr_api_integration'])
+                jira_confirmations = create_jira_issues(test_cases=all_test_cases, sync=sync, **jira_config)
+                if jira_confirmations:
+                    result['jira_confirmations'] = jira_confirmations
+            except Exception as e:
+                print(f"Error during automatic Jira export: {e}")
+                result['jira_error'] = str(e)
+        else:
+            result['jira_error'] = "One or more Jira configuration fields were missing."
+
+    return result
+
+# --- Background Jobs ---
+
+def finalize_job(user_id, all_test_cases, ambiguity_report, options, secrets):
+    jira_config = (secrets or {}).get('jira_config')
+    result = finalize_generation(user_id, all_test_cases, options.get('save_to_firebase'), jira_config, ambiguity_report)
+    if options.get('jira_auto_export') and jira_config is None:
+        # Credentials are never persisted, so a job resumed after a restart cannot export on its own
+        result['jira_error'] = "Jira credentials were lost when the server restarted. Please export manually."
+    trace = current_trace.get()
+    if options.get('timings') and trace is not None:
+        # A job resumed after a restart only covers the chunks this process ran
+        result['timings'] = trace.summary()
+    return result
+
+job_queue = JobQueue(
+    path=os.getenv('JOB_DB_PATH', DEFAULT_JOB_DB_PATH),
+    process_chunk=generate_and_check,
+    analyze_chunk=detect_ambiguity,
+    merge_reports=merge_ambiguity_reports,
+    finalize=finalize_job,
+    create_deduplicator=create_deduplicator,
+    num_workers=int(os.getenv('JOB_WORKERS', '2'))
+)
+
+def timings_requested():
+    """?timings=true (or a 'timings' form field) adds a per-stage timing breakdown to the result."""
+    return (request.args.get('timings') or request.form.get('timings') or '').lower() in ('1', 'true', 'yes', 'on')
+
+def prepare_generation_request():
+    """Validates the upload. Returns (pipeline_kwargs, None) or (None, error_response).
+
+    The document is chunked lazily: `text_chunks` is an iterator consumed by the pipeline.
+    """
+    if 'user_id' not in session: return None, (jsonify({'error': 'Session expired'}), 400)
+    # Admission is decided from Content-Length alone, before request.files reads the body
+    upload_size = request.content_length or UPLOAD_MAX_BYTES
+    if upload_size > UPLOAD_MAX_BYTES:
+        return None, (jsonify({'error': f'File is too large. The limit is {UPLOAD_MAX_BYTES // (1024 * 1024)} MB.'}), 413)
+    if not upload_admission.reserve(upload_size):
+        return None, (jsonify({'error': 'The server is busy processing other uploads. Please try again shortly.'}), 503, {'Retry-After': '30'})
+    g.upload_lease = UploadLease(upload_admission, upload_size) # Closed in release_upload when the request ends
+    if 'requirement_file' not in request.files: return None, (jsonify({'error': 'No file part'}), 400)
+    file = request.files['requirement_file']
+    if file.filename == '': return None, (jsonify({'error': 'No selected file'}), 400)
 
-        response_data = {
-            'extracted_text': extracted_text, 
-            'test_cases': all_test_cases,
-            'ambiguity_report': ambiguity_report, # Keep for potential future use, but UI will use download
-            'dashboard_stats': dashboard_stats
-        }
-        if firebase_confirmations:
-            response_data['firebase_confirmations'] = firebase_confirmations
-        
-        # --- Automatic Jira Export ---
-        jira_confirmations = None
-        jira_error = None
-        if request.form.get('jira_auto_export'):
-            jira_server = request.form.get('jira_server')
-            jira_email = request.form.get('jira_email')
-            jira_token = request.form.get('jira_token')
-            jira_project_key = request.form.get('jira_project_key')
-            is_zephyr_api_integration = request.form.get('is_zephyr_api_integration') == 'true' # Get Zephyr API integration flag
-            zephyr_api_token = request.form.get('zephyr_api_token') # Get Zephyr API Token
-
-            print(f"--- DEBUG: Jira Auto-Export Request ---\n  Server: {jira_server}\n  Email: {jira_email}\n  Project Key: {jira_project_key}\n  Is Zephyr API Integration: {is_zephyr_api_integration}\n  Zephyr API Token: {'*' * len(zephyr_api_token) if zephyr_api_token else 'N/A'}")
-
-            if jira_server and jira_email and jira_token and jira_project_key:
-                try:
-                    print("--- Attempting automatic Jira export... ---")
-                    jira_confirmations = create_jira_issues(
-                        jira_server=jira_server,
-                        jira_email=jira_email,
-                        jira_token=jira_token,
-                        project_key=jira_project_key,
-                        test_cases=all_test_cases,
-                        is_zephyr_api_integration=is_zephyr_api_integration, # Pass the Zephyr API integration flag
-                        zephyr_api_token=zephyr_api_token # Pass the Zephyr API Token
-                    )
-                except Exception as e:
-                    print(f"Error during automatic Jira export: {e}")
-                    jira_error = str(e)
-            else:
-                jira_error = "One or more Jira configuration fields were missing."
+    raw_save_to_firebase_value = request.form.get('save_to_firebase')
+    print(f"DEBUG: Raw save_to_firebase value from request.form: {raw_save_to_firebase_value}")
+    # Correctly interpret 'on' from checkbox as True, and None (if unchecked) as False
+    save_to_firebase = bool(raw_save_to_firebase_value)
+    print(f"DEBUG: save_to_firebase flag after conversion: {save_to_firebase}")
 
-        if jira_confirmations:
-            response_data['jira_confirmations'] = jira_confirmations
-        if jira_error:
-            response_data['jira_error'] = jira_error
+    # A path for spooled uploads, so parsers read the temp file instead of a copy in memory
+    source = upload_source(file)
+    text_chunks = (chunk['text'] for chunk in iter_document_chunks(file.filename, source))
+
+    # Diff against the previous suite unless the user asked for a full regeneration
+    previous_suite = {} if request.form.get('force_regenerate') else load_previous_suite(session['user_id'])
+
+    return {
+        'user_id': session['user_id'],
+        'text_chunks': text_chunks,
+        'save_to_firebase': save_to_firebase,
+        'jira_config': read_jira_auto_export_config(request.form),
+        'previous_suite': previous_suite
+    }, None
+
+@app.teardown_request
+def release_upload(exc):
+    # Streamed generations take their lease out of g and close it when the response is closed
+    lease = g.pop('upload_lease', None)
+    if lease is not None:
+        lease.close()
+    remove_spooled_files(request.spooled_paths)
+
+@app.errorhandler(413)
+def handle_upload_too_large(e):
+    return jsonify({'error': f'File is too large. The limit is {UPLOAD_MAX_BYTES // (1024 * 1024)} MB.'}), 413
 
+@app.route('/generate_and_analyze', methods=['POST'])
+def handle_generate_and_analyze():
+    try:
+        pipeline_kwargs, error_response = prepare_generation_request()
+        if error_response: return error_response
+
+        # ?async=true queues a durable background job instead of holding this connection open
+        if request.args.get('async', '').lower() in ('1', 'true', 'yes'):
+            jira_config = pipeline_kwargs['jira_config']
+            # Jobs persist every chunk up front, so the document is fully parsed here
+            text_chunks = list(pipeline_kwargs['text_chunks'])
+            extracted_text = "\n\n".join(text_chunks)
+            document_store.put(pipeline_kwargs['user_id'], 'extracted_text', extracted_text)
+            job_id = job_queue.submit(
+                user_id=pipeline_kwargs['user_id'],
+                text_chunks=text_chunks,
+                extracted_text=extracted_text,
+                options={'save_to_firebase': pipeline_kwargs['save_to_firebase'], 'jira_auto_export': jira_config is not None, 'timings': timings_requested()},
+                secrets={'jira_config': jira_config} if jira_config else None,
+                carried_over=find_reusable_chunks(text_chunks, pipeline_kwargs['previous_suite']),
+                skipped={index for index, chunk in enumerate(text_chunks) if not is_requirement_chunk(chunk)}
+            )
+            return jsonify({'job_id': job_id, 'status_url': f'/jobs/{job_id}', 'result_url': f'/jobs/{job_id}/result'}), 202
+
+        response_data = {'test_cases': []}
+        with trace_scope() as trace:
+            for event in generation_events(**pipeline_kwargs):
+                if event['event'] == 'parsing_complete':
+                    response_data['extracted_text'] = event['extracted_text']
+                elif event['event'] == 'ambiguity_report':
+                    response_data['ambiguity_report'] = event['ambiguity_report'] # Also downloadable by result_id
+                elif event['event'] == 'chunk_complete':
+                    response_data['test_cases'].extend(event['test_cases'])
+                elif event['event'] == 'error':
+                    return jsonify({'error': event['error']}), 500
+                elif event['event'] == 'complete':
+                    response_data.update({key: value for key, value in event.items() if key != 'event'})
+
+        if timings_requested():
+            response_data['timings'] = trace.summary()
         return jsonify(response_data)
 
+    except Exception as e:
+        print(f"Error during generation: {e}")
+        return jsonify({'error': str(e)}), 500
 
+@app.route('/generate_and_analyze_stream', methods=['POST'])
+def handle_generate_and_analyze_stream():
+    """Same pipeline as /generate_and_analyze, streamed as newline-delimited JSON events."""
+    try:
+        pipeline_kwargs, error_response = prepare_generation_request()
+        if error_response: return error_response
     except Exception as e:
         print(f"Error during generation: {e}")
         return jsonify({'error': str(e)}), 500
 
+    # Flask tears the request down before the stream runs, so the upload stays reserved and
+    # spooled until the response itself is closed
+    lease = g.pop('upload_lease')
+    lease.adopt_spooled_files(request)
+    timings = timings_requested()
+
+    def stream():
+        try:
+            with trace_scope() as trace:
+                for event in generation_events(**pipeline_kwargs):
+                    if timings and event['event'] == 'complete':
+                        event['timings'] = trace.summary()
+                    yield json.dumps(event) + "\n"
+        except Exception as e:
+            print(f"Error during streamed generation: {e}")
+            yield json.dumps({'event': 'error', 'error': str(e)}) + "\n"
+
+    # X-Accel-Buffering stops reverse proxies from holding events back until the end
+    response = Response(stream_with_context(stream()), mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no', 'Cache-Control': 'no-cache'})
+    response.call_on_close(lease.close)
+    return response
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def handle_job_status(job_id):
+    status = job_queue.get_status(job_id)
+    if not status or status.pop('user_id') != session.get('user_id'):
+        return jsonify({'error': 'Job not found.'}), 404
+    return jsonify(status)
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def handle_job_result(job_id):
+    status = job_queue.get_status(job_id)
+    if not status or status['user_id'] != session.get('user_id'):
+        return jsonify({'error': 'Job not found.'}), 404
+    if status['status'] == 'failed':
+        return jsonify({'error': status['error'] or 'Job failed.'}), 500
+    result = job_queue.get_result(job_id)
+    if result is None:
+        return jsonify({'error': 'Job is not complete yet.', 'status': status['status']}), 409
+    return jsonify(result)
+
+@app.route('/firebase_saves/<save_id>', methods=['GET'])
+def handle_firebase_save_status(save_id):
+    """Reports a background Firestore save: queued, writing (with shards written so far), complete or failed."""
+    try:
+        status = firestore_writer.status(session.get('user_id'), save_id) if firestore_writer else None
+    except Exception as e: return jsonify({'error': str(e)}), 500
+    if status is None:
+        return jsonify({'error': 'Save not found.'}), 404
+    return jsonify(status)
+
+def read_version(value):
+    """Parses an optional ?version= value. Raises ValueError for anything but a positive integer."""
+    if value in (None, ''):
+        return None
+    version = int(value)
+    if version < 1:
+        raise ValueError(f"Invalid version: {value}")
+    return version
+
+def load_requested_test_cases(data):
+    """Returns (test_cases, stored_result, error_response) for a request body or query string.
+
+    Requests name a stored suite with `result_id` (and optionally `version`); older clients that
+    post the `test_cases` array themselves are still accepted, with stored_result None.
+    """
+    result_id = data.get('result_id')
+    if not result_id:
+        return data.get('test_cases'), None, None
+    try:
+        version = read_version(data.get('version'))
+    except (TypeError, ValueError):
+        return None, None, (jsonify({'error': 'The version must be a positive integer.'}), 400)
+    result = result_store.get(result_id, session.get('user_id'), version)
+    if result is None:
+        return None, None, (jsonify({'error': 'Result not found. It may have expired; please generate the test cases again.'}), 404)
+    return result['test_cases'], result, None
+
+@app.route('/results/<result_id>', methods=['GET'])
+def handle_get_result(result_id):
+    """Returns a stored suite (the latest version unless ?version= is given) and its version history."""
+    test_cases, result, error_response = load_requested_test_cases({'result_id': result_id, 'version': request.args.get('version')})
+    if error_response: return error_response
+    result['versions'] = result_store.versions(result_id, session.get('user_id'))
+    return jsonify(result)
+
 @app.route('/edit_test_cases', methods=['POST'])
 def handle_edit_test_cases():
-    data = request.get_json()
+    data = request.get_json() or {}
     user_prompt = data.get('prompt')
-    test_cases = data.get('test_cases')
+    test_cases, result, error_response = load_requested_test_cases(data)
+    if error_response: return error_response
 
     print(f"DEBUG: handle_edit_test_cases - Received prompt: {user_prompt}")
-    print(f"DEBUG: handle_edit_test_cases - Received {len(test_cases)} test cases.")
+    print(f"DEBUG: handle_edit_test_cases - Received {len(test_cases or [])} test cases (result: {result['result_id'] if result else 'posted by client'}).")
 
     if not user_prompt or not test_cases:
         print("DEBUG: handle_edit_test_cases - Missing prompt or test cases.")
         return jsonify({'error': 'A prompt and a list of test cases are required.'}), 400
+    if result is not None and result['version'] != result['latest_version']:
+        # Refuse before spending any Gemini calls on an edit that could not be stored
+        error = ResultVersionConflict(result['latest_version'])
+        return jsonify({'error': str(error), 'latest_version': error.latest_version}), 409
 
     try:
-        updated_test_cases = edit_test_cases_with_ai(user_prompt, test_cases)
+        with request_scope(f"{session.get('user_id', 'anonymous')}:edit"):
+            updated_test_cases = edit_test_cases_with_ai(user_prompt, test_cases)
         print(f"DEBUG: handle_edit_test_cases - Returned {len(updated_test_cases)} updated test cases.")
         # Check if the test cases actually changed
         if updated_test_cases == test_cases:
             print("DEBUG: handle_edit_test_cases - WARNING: edit_test_cases_with_ai returned identical test cases.")
 
-        return jsonify({'test_cases': updated_test_cases})
+        response_data = {'test_cases': updated_test_cases}
+        if result is not None:
+            version = result_store.add_version(result['result_id'], session.get('user_id'), updated_test_cases, base_version=result['version'], note=user_prompt[:200])
+            response_data.update({'result_id': result['result_id'], 'result_version': version})
+        return jsonify(response_data)
+    except ResultVersionConflict as e:
+        return jsonify({'error': str(e), 'latest_version': e.latest_version}), 409
     except Exception as e:
         print(f"DEBUG: Error during test case editing: {e}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/download', methods=['POST'])
+@app.route('/download', methods=['GET', 'POST'])
 def handle_download():
-    HEADERS = ['test_case_id', 'requirement_id', 'description', 'test_type', 'priority', 'rtm_compliance_mapping', 'steps', 'expected_result']
+    """Renders the suite as a file. GET ?result_id=&version= serves a stored suite, with ETags.
+
+    Exports are streamed in chunks as they are rendered. Rendered files are cached per result
+    version, and the ETag depends only on the result ID, version and format, so If-None-Match
+    is answered with a 304 before anything is loaded. POSTing the test_cases array (the old
+    interface) renders it without caching.
+    """
     format = request.args.get('format', 'txt')
-    data = request.get_json()
-    test_cases = data.get('test_cases', [])
+    if format not in EXPORTERS: return jsonify({'error': 'Invalid format'}), 400
+    exporter, mimetype = EXPORTERS[format]
+    data = request.args.to_dict()
+    if request.method == 'POST':
+        data.update(request.get_json(silent=True) or {})
+
+    if not data.get('result_id'):
+        test_cases = data.get('test_cases', [])
+        if not test_cases: return jsonify({'error': 'No test cases to download'}), 400
+        try:
+            return export_response(exporter(test_cases, EXPORT_HEADERS), f'test-cases.{format}', mimetype, stage=f'export.{format}')
+        except Exception as e: return jsonify({'error': str(e)}), 500
 
-    if not test_cases: return jsonify({'error': 'No test cases to download'}), 400
-    file_generators = {'csv': create_csv, 'xlsx': create_xlsx, 'pdf': create_pdf, 'txt': create_txt}
-    generator = file_generators.get(format)
-    if not generator: return jsonify({'error': 'Invalid format'}), 400
+    user_id = session.get('user_id')
+    result_id = data['result_id']
     try:
-        file_buffer = generator(test_cases, HEADERS)
-        return send_file(file_buffer, as_attachment=True, download_name=f'test-cases.{format}', mimetype=f'application/{format}')
+        requested_version = read_version(data.get('version'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'The version must be a positive integer.'}), 400
+    version = result_store.resolve_version(result_id, user_id, requested_version)
+    if version is None:
+        return jsonify({'error': 'Result not found. It may have expired; please generate the test cases again.'}), 404
+
+    etag = result_store.export_etag(result_id, version, format)
+    # A pinned version never changes; "latest" moves on every edit, so it must be revalidated
+    cache_control = 'private, max-age=31536000, immutable' if requested_version else 'private, no-cache'
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={'ETag': f'"{etag}"', 'Cache-Control': cache_control})
+
+    try:
+        cached = result_store.open_export(result_id, version, format)
+        if cached is not None:
+            (size, chunks), stage = cached, 'export.cached'
+        else:
+            result = result_store.get(result_id, user_id, version)
+            if result is None or not result['test_cases']: return jsonify({'error': 'No test cases to download'}), 400
+            # Rendered chunks go to the client and the export cache as they are produced
+            size, chunks, stage = None, result_store.cache_export(result_id, version, format, exporter(result['test_cases'], EXPORT_HEADERS)), f'export.{format}'
+        response = export_response(chunks, f'test-cases-v{version}.{format}', mimetype, size, stage)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control
+        return response
     except Exception as e: return jsonify({'error': str(e)}), 500
 
 @app.route('/download_ambiguity_report', methods=['GET'])
 def handle_download_ambiguity_report():
     format = request.args.get('format', 'txt')
-    report = session.get('ambiguity_report')
-    if not report: return jsonify({'error': 'No ambiguity report found in session.'}), 400
+    user_id = session.get('user_id')
+    # Without ?result_id=, serve the report of the user's most recent result
+    result_id = request.args.get('result_id') or result_store.latest_result_id(user_id)
+    report = result_store.get_ambiguity_report(result_id, user_id) if result_id else None
+    if not report: return jsonify({'error': 'No ambiguity report found.'}), 400
 
     file_generators = {'txt': create_ambiguity_report_txt}
     generator = file_generators.get(format)
@@ -385,10 +742,12 @@ def handle_download_ambiguity_report():
 
 @app.route('/export_to_jira', methods=['POST'])
 def handle_export_to_jira():
-    data = request.get_json()
+    data = request.get_json() or {}
+    test_cases, result, error_response = load_requested_test_cases(data)
+    if error_response: return error_response
     
     save_to_firebase = data.get('save_to_firebase')
-    firebase_confirmations = []
+    firebase_confirmations, firebase_save = [], None
 
     print(f"DEBUG: handle_export_to_jira - save_to_firebase flag: {save_to_firebase}")
 
@@ -399,26 +758,61 @@ def handle_export_to_jira():
 
         print(f"--- DEBUG: Manual Jira Export Request ---\n  Is Zephyr API Integration: {is_zephyr_api_integration}\n  Zephyr API Token: {'*' * len(zephyr_api_token) if zephyr_api_token else 'N/A'}")
 
+        # A stored result is synced by default: issues from its earlier exports are updated or
+        # skipped instead of duplicated. "sync": false creates a fresh set (and syncs to that).
+        sync = None
+        if result is not None and data.get('server') and data.get('project_key'):
+            sync = AlmSync(result_store, result['result_id'], data.get('server'), data.get('project_key'), is_zephyr_api_integration, fresh=data.get('sync') is False)
+
         confirmations = create_jira_issues(
             jira_server=data.get('server'),
             jira_email=data.get('email'),
             jira_token=data.get('token'),
             project_key=data.get('project_key'),
-            test_cases=data.get('test_cases'),
+            test_cases=test_cases,
             is_zephyr_api_integration=is_zephyr_api_integration, # Pass the Zephyr API integration flag
-            zephyr_api_token=zephyr_api_token # Pass the Zephyr API Token
+            zephyr_api_token=zephyr_api_token, # Pass the Zephyr API Token
+            sync=sync
         )
         
         if save_to_firebase:
             print("DEBUG: Calling save_test_cases_to_firebase from handle_export_to_jira.")
-            firebase_confirmations = save_test_cases_to_firebase(session['user_id'], data.get('test_cases'))
+            firebase_confirmations, firebase_save = save_test_cases_to_firebase(session['user_id'], test_cases)
 
         response_data = {'confirmations': confirmations}
         if firebase_confirmations:
             response_data['firebase_confirmations'] = firebase_confirmations
+        if firebase_save:
+            response_data['firebase_save'] = firebase_save
 
         return jsonify(response_data)
     except Exception as e: return jsonify({'error': str(e)}), 500
 
+@app.route('/llm_stats', methods=['GET'])
+def handle_llm_stats():
+    """Reports the shared Gemini scheduler's queue depth and wait times, plus response cache counters
+    and ALM (Jira/Zephyr Scale) client pool and endpoint latencies."""
+    cache = test_generator.response_cache
+    return jsonify({
+        'scheduler': llm_scheduler.stats(),
+        'response_cache': cache.stats() if cache is not None else None,
+        'uploads': upload_admission.stats(),
+        'parsing': test_generator.parse_metrics.stats(),
+        'document_store': document_store.stats(),
+        'result_store': result_store.stats(),
+        'alm': alm_stats(),
+        'firestore': firestore_writer.stats() if firestore_writer else None
+    })
+
+@app.route('/metrics', methods=['GET'])
+def handle_metrics():
+    """Per-stage latency histograms, Gemini token and cost counters and live gauges, in the
+    Prometheus text format."""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+register_gauge('tcgen_llm_in_flight', 'Gemini calls currently running.', lambda: llm_scheduler.stats()['in_flight'])
+register_gauge('tcgen_llm_queue_depth', 'Gemini calls waiting for the scheduler.', lambda: llm_scheduler.stats()['queue_depth'])
+register_gauge('tcgen_firestore_saves_in_progress', 'Background Firestore saves queued or writing.', lambda: firestore_writer.stats()['in_progress'] if firestore_writer else 0)
+
 # The if __name__ == '__main__' block is now removed from this file.
 # The application should only be run via run.py
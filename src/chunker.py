@@ -0,0 +1,191 @@
+import os
+import re
+import bisect
+
+# Defaults roughly match the old 12,000-character limit (about 4 characters per token)
+MAX_CHUNK_TOKENS = int(os.getenv('CHUNK_MAX_TOKENS', '3000'))
+CHUNK_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS', '0'))
+CHARS_PER_TOKEN = 4
+# A chunk is only cut early at a stronger boundary if it is at least this full
+MIN_FILL_RATIO = 0.5
+
+# Boundary strengths: how good a place the start of a segment is for starting a new chunk
+NO_BOUNDARY = 0
+SENTENCE_BOUNDARY = 1
+PARAGRAPH_BOUNDARY = 2
+REQUIREMENT_BOUNDARY = 3
+HEADING_BOUNDARY = 4
+
+HEADING_PATTERN = re.compile(
+    r"^\s*(?:#{1,6}\s+\S"                               # Markdown headings
+    r"|(?:\d+\.){1,4}\d*\s+[A-Z]"                       # Numbered sections: 3.1 Login, 4.2.1 Audit
+    r"|(?i:chapter|section|appendix)\s+[\dA-Z]"        # Chapter 2, Section A
+    r"|[A-Z][A-Z0-9 ,&/\-]{3,80}$)"                     # ALL-CAPS TITLE LINES
+)
+REQUIREMENT_PATTERN = re.compile(r"^\s*\[?(?:REQ|FR|NFR|SR|UR|BR|SYS|SRS)[-_ .]?\d+", re.IGNORECASE)
+LIST_ITEM_PATTERN = re.compile(r"^\s*(?:[-*•]|\d+[.)]|[a-z][.)]|\([a-z0-9]+\))\s+")
+SENTENCE_END_PATTERN = re.compile(r"(?<=[.!?;])\s+")
+LINE_PATTERN = re.compile(r"[^\n]*\n|[^\n]+")
+
+def approximate_tokens(char_count: int) -> int:
+    return (char_count + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def _classify_line(line: str) -> int:
+    """Returns the boundary strength of a new segment starting at this line, or None to continue the current one."""
+    if not line.strip():
+        return None # Blank lines end a paragraph; the next non-blank line starts one
+    if REQUIREMENT_PATTERN.match(line):
+        return REQUIREMENT_BOUNDARY
+    # Heading checks exclude the ALL-CAPS rule for long lines and lines ending like sentences
+    if HEADING_PATTERN.match(line) and len(line) < 120 and not line.rstrip().endswith(('.', ',', ';')):
+        return HEADING_BOUNDARY
+    if LIST_ITEM_PATTERN.match(line):
+        return PARAGRAPH_BOUNDARY
+    return None
+
+def _segment(text: str, max_chars: int) -> list:
+    """Splits text into (start, end, boundary) segments of at most max_chars characters each.
+
+    Segments follow paragraphs, headings, requirement IDs and list items. Oversized segments
+    are split at sentence ends, then at whitespace, then hard at max_chars.
+    """
+    segments = []
+    seg_start = None
+    seg_boundary = PARAGRAPH_BOUNDARY
+    after_blank = False
+
+    for match in LINE_PATTERN.finditer(text):
+        line = match.group()
+        if not line.strip():
+            after_blank = True
+            continue
+        boundary = _classify_line(line)
+        if boundary is None and after_blank:
+            boundary = PARAGRAPH_BOUNDARY
+        after_blank = False
+        if seg_start is None:
+            seg_start, seg_boundary = match.start(), boundary or PARAGRAPH_BOUNDARY
+        elif boundary is not None:
+            _append_segment(segments, text, seg_start, match.start(), seg_boundary, max_chars)
+            seg_start, seg_boundary = match.start(), boundary
+    if seg_start is not None:
+        _append_segment(segments, text, seg_start, len(text), seg_boundary, max_chars)
+    return segments
+
+def _append_segment(segments: list, text: str, start: int, end: int, boundary: int, max_chars: int):
+    if end - start <= max_chars:
+        segments.append((start, end, boundary))
+        return
+    # Too big: cut at the last sentence end (or failing that, whitespace) that fits
+    while end - start > max_chars:
+        limit = start + max_chars
+        cut = None
+        for sentence_match in SENTENCE_END_PATTERN.finditer(text, start + max_chars // 4, limit):
+            cut = sentence_match.end()
+        piece_boundary = SENTENCE_BOUNDARY
+        if cut is None:
+            cut = text.rfind(' ', start + 1, limit) + 1 or limit
+            piece_boundary = NO_BOUNDARY
+        segments.append((start, cut, boundary))
+        start, boundary = cut, piece_boundary
+    if start < end:
+        segments.append((start, end, boundary))
+
+def chunk_text(text: str, max_tokens: int = None, overlap_tokens: int = None, page_starts: list = None) -> list:
+    """Splits text into chunks of at most max_tokens (approximate) tokens.
+
+    Chunks prefer to end where the next segment starts a heading, then a requirement ID, then a
+    paragraph or list item, as long as the chunk is at least half full. Consecutive chunks share
+    about overlap_tokens tokens of trailing context. Each chunk is a dict with 'text',
+    'start_offset'/'end_offset' into `text` and, if `page_starts` (the offset at which each page
+    begins) is given, the 1-based 'pages' it spans. Runs in time linear in len(text).
+    """
+    max_tokens = max_tokens or MAX_CHUNK_TOKENS
+    overlap_tokens = CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+    overlap_tokens = min(overlap_tokens, max_tokens // 2) # Guarantees every chunk makes progress
+    max_chars = max_tokens * CHARS_PER_TOKEN
+
+    segments = _segment(text, max_chars)
+    if not segments:
+        return []
+    # Prefix sums of segment token counts make "tokens in segments[i:j]" an O(1) lookup
+    token_prefix = [0]
+    for start, end, _ in segments:
+        token_prefix.append(token_prefix[-1] + approximate_tokens(end - start))
+
+    chunks = []
+    n = len(segments)
+    i = 0
+    while i < n:
+        # Grow the chunk as far as the budget allows
+        j = i + 1
+        while j < n and token_prefix[j + 1] - token_prefix[i] <= max_tokens:
+            j += 1
+        # Then move the cut back to the strongest boundary that still leaves the chunk half full
+        if j < n:
+            best, best_boundary = j, segments[j][2]
+            min_tokens = max_tokens * MIN_FILL_RATIO
+            k = j - 1
+            while k > i and token_prefix[k] - token_prefix[i] >= min_tokens:
+                if segments[k][2] > best_boundary:
+                    best, best_boundary = k, segments[k][2]
+                k -= 1
+            j = best
+
+        start_offset, end_offset = segments[i][0], segments[j - 1][1]
+        chunk = {'text': text[start_offset:end_offset], 'start_offset': start_offset, 'end_offset': end_offset}
+        if page_starts:
+            first_page = bisect.bisect_right(page_starts, start_offset)
+            last_page = bisect.bisect_right(page_starts, max(start_offset, end_offset - 1))
+            chunk['pages'] = list(range(max(first_page, 1), max(last_page, 1) + 1))
+        chunks.append(chunk)
+
+        if j >= n:
+            break
+        # Step back over trailing segments to carry overlap into the next chunk
+        next_start = j
+        while next_start - 1 > i and token_prefix[j] - token_prefix[next_start - 1] <= overlap_tokens:
+            next_start -= 1
+        i = next_start
+
+    return chunks
+
+def chunk_stream(pieces, max_tokens: int = None, pieces_are_pages: bool = False):
+    """Chunks text that arrives in pieces (pages, paragraphs, ...), yielding chunks as they fill.
+
+    Text is buffered until it holds about two chunks' worth, chunked, and every chunk except
+    the last is yielded; the last is kept and re-chunked with the following pieces, since it
+    may continue there. Offsets are relative to the concatenated pieces. If pieces_are_pages,
+    each piece starts a new page and chunks carry 'pages'.
+    """
+    max_tokens = max_tokens or MAX_CHUNK_TOKENS
+    flush_chars = 2 * max_tokens * CHARS_PER_TOKEN
+    page_starts = []
+    buffer_parts = []
+    buffer_length = 0
+    buffer_offset = 0 # Offset at which the buffered text starts
+
+    def chunk_buffer(text):
+        # Earlier pages get negative relative offsets, which keeps page numbers absolute
+        relative_page_starts = [start - buffer_offset for start in page_starts] if pieces_are_pages else None
+        for chunk in chunk_text(text, max_tokens=max_tokens, page_starts=relative_page_starts):
+            chunk['start_offset'] += buffer_offset
+            chunk['end_offset'] += buffer_offset
+            yield chunk
+
+    for piece in pieces:
+        if pieces_are_pages:
+            page_starts.append(buffer_offset + buffer_length)
+        buffer_parts.append(piece)
+        buffer_length += len(piece)
+        if buffer_length < flush_chars:
+            continue
+        text = "".join(buffer_parts)
+        chunks = list(chunk_buffer(text))
+        yield from chunks[:-1]
+        keep_from = chunks[-1]['start_offset'] - buffer_offset if chunks else 0
+        buffer_parts = [text[keep_from:]]
+        buffer_length = len(buffer_parts[0])
+        buffer_offset += keep_from
+
+    yield from chunk_buffer("".join(buffer_parts))
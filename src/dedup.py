@@ -0,0 +1,130 @@
+import os
+import re
+import random
+import threading
+
+# Test cases whose description, steps and expected result overlap at least this much are duplicates
+DEDUP_ENABLED = os.getenv('DEDUP_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+DEDUP_SIMILARITY = float(os.getenv('DEDUP_SIMILARITY', '0.8'))
+
+# MinHash signature of NUM_BANDS * ROWS_PER_BAND values. Two cases land in the same LSH bucket
+# with probability 1 - (1 - J^ROWS_PER_BAND)^NUM_BANDS for Jaccard similarity J: about 98% at
+# J=0.8 and 2% at J=0.3, so candidates are confirmed with an exact Jaccard check.
+NUM_BANDS = 8
+ROWS_PER_BAND = 4
+SHINGLE_SIZE = 3 # Words per shingle
+
+# Each signature value is the minimum of the shingle hashes XORed with a random 64-bit mask. XOR
+# with a fixed mask permutes the hash space, and is several times cheaper in pure Python than
+# the usual (a * h + b) mod p permutation, which needs big-integer arithmetic.
+_HASH_MASK = (1 << 64) - 1
+_rng = random.Random(1729)
+_XOR_MASKS = [_rng.getrandbits(64) for _ in range(NUM_BANDS * ROWS_PER_BAND)]
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+def shingles(test_case: dict) -> frozenset:
+    """Word trigrams of a test case's description, steps and expected result, lowercased."""
+    parts = [str(test_case.get('description', ''))]
+    parts.extend(str(step) for step in test_case.get('steps') or [])
+    parts.append(str(test_case.get('expected_result', '')))
+    words = _WORD_PATTERN.findall(" ".join(parts).lower())
+    if len(words) < SHINGLE_SIZE:
+        return frozenset([" ".join(words)]) if words else frozenset()
+    return frozenset(" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1))
+
+def minhash_signature(shingle_set: frozenset) -> tuple:
+    hashes = [hash(shingle) & _HASH_MASK for shingle in shingle_set]
+    return tuple(min(map(mask.__xor__, hashes)) for mask in _XOR_MASKS)
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class TestCaseDeduplicator:
+    """Finds near-duplicate test cases across the chunks of one generation with MinHash LSH.
+
+    Each kept case is indexed under one bucket per signature band; a new case is only compared
+    with the kept cases it shares a bucket with, so the cost per case stays flat as the suite
+    grows. The first case seen wins; later duplicates are dropped and their IDs are remembered
+    until attach_merges() records them on the finished suite. Thread-safe, so chunk tasks can
+    share one instance.
+    """
+
+    def __init__(self, similarity: float = None):
+        self.similarity = DEDUP_SIMILARITY if similarity is None else similarity
+        self._lock = threading.Lock()
+        self._buckets = [{} for _ in range(NUM_BANDS)] # band -> {band values: [kept case index]}
+        self._kept = [] # (test case, shingle set)
+        self._merges = {} # kept case's shingle set -> IDs of the duplicates dropped in its favour
+        self._checked = 0
+        self._removed = 0
+        self._comparisons = 0
+
+    def _find_duplicate(self, shingle_set: frozenset, band_keys: list):
+        seen = set()
+        for band, key in enumerate(band_keys):
+            for kept_index in self._buckets[band].get(key, ()):
+                if kept_index in seen:
+                    continue
+                seen.add(kept_index)
+                self._comparisons += 1
+                if jaccard(shingle_set, self._kept[kept_index][1]) >= self.similarity:
+                    return self._kept[kept_index][1]
+        return None
+
+    def add(self, test_case: dict) -> bool:
+        """Indexes a test case. Returns False (and remembers the merge) if it duplicates a kept case."""
+        shingle_set = shingles(test_case)
+        signature = minhash_signature(shingle_set) if shingle_set else ()
+        band_keys = [signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND] for band in range(NUM_BANDS)] if signature else []
+        with self._lock:
+            self._checked += 1
+            duplicate_of = self._find_duplicate(shingle_set, band_keys) if band_keys else None
+            if duplicate_of is not None:
+                self._removed += 1
+                merged_ids = self._merges.setdefault(duplicate_of, [])
+                if test_case.get('test_case_id'):
+                    merged_ids.append(test_case['test_case_id'])
+                return False
+            kept_index = len(self._kept)
+            self._kept.append((test_case, shingle_set))
+            for band, key in enumerate(band_keys):
+                self._buckets[band].setdefault(key, []).append(kept_index)
+            return True
+
+    def remove_duplicates(self, test_cases: list) -> list:
+        """Returns the test cases that are not near-duplicates of any case already kept."""
+        return [tc for tc in test_cases if self.add(tc)]
+
+    def attach_merges(self, test_cases: list) -> list:
+        """Adds the IDs of the duplicates dropped in favour of each case to its 'merged_test_case_ids'.
+
+        Called once on the finished suite, so cases that were already streamed or persisted are not
+        changed while other chunks are still being deduplicated. Kept cases are found by their
+        shingles, which also holds for cases that were reloaded from JSON.
+        """
+        with self._lock:
+            merges = {key: list(ids) for key, ids in self._merges.items() if ids}
+        if not merges:
+            return test_cases
+        for tc in test_cases:
+            merged_ids = merges.get(shingles(tc))
+            if merged_ids:
+                existing = tc.get('merged_test_case_ids') or []
+                tc['merged_test_case_ids'] = existing + [test_case_id for test_case_id in merged_ids if test_case_id not in existing]
+        return test_cases
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'checked_test_cases': self._checked,
+                'duplicates_removed': self._removed,
+                'similarity_threshold': self.similarity,
+                'candidate_comparisons': self._comparisons
+            }
+
+def create_deduplicator():
+    """Returns a deduplicator for one generation run, or None if deduplication is disabled."""
+    return TestCaseDeduplicator() if DEDUP_ENABLED else None
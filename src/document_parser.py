@@ -1,88 +1,348 @@
-
 import os
+import time
+import hashlib
+import tempfile
+import threading
+import multiprocessing
+import mmap
+import zipfile
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from contextlib import contextmanager
 from pypdf import PdfReader
-from docx import Document
 import xml.etree.ElementTree as ET
 import markdown
 
-MAX_CHUNK_SIZE = 12000 # Define a max size for text chunks
+from chunker import chunk_text, chunk_stream
+from metrics import TimedIterator
+
+PDF_EXTRACT_WORKERS = int(os.getenv('PDF_EXTRACT_WORKERS', str(min(os.cpu_count() or 1, 4))))
+PDF_PAGES_PER_TASK = int(os.getenv('PDF_PAGES_PER_TASK', '8'))
+PDF_SLOW_PAGE_SECONDS = float(os.getenv('PDF_SLOW_PAGE_SECONDS', '2.0'))
+# A page range (or page count) not extracted within this long fails the upload and restarts the pool
+PDF_TASK_TIMEOUT_SECONDS = float(os.getenv('PDF_TASK_TIMEOUT_SECONDS', '120'))
+# Worker processes are replaced after this many tasks, so memory pypdf leaves behind is returned
+PDF_MAX_TASKS_PER_WORKER = int(os.getenv('PDF_MAX_TASKS_PER_WORKER', '50'))
+
+# WordprocessingML tags read by the streaming DOCX parser
+W_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+W_BODY = W_NAMESPACE + 'body'
+W_PARAGRAPH = W_NAMESPACE + 'p'
+W_TABLE = W_NAMESPACE + 'tbl'
+W_TABLE_ROW = W_NAMESPACE + 'tr'
+W_TABLE_CELL = W_NAMESPACE + 'tc'
+W_TEXT = W_NAMESPACE + 't'
+W_TAB = W_NAMESPACE + 'tab'
+W_BR = W_NAMESPACE + 'br'
+W_CR = W_NAMESPACE + 'cr'
+
+pdf_pool = None
+pdf_pool_lock = threading.Lock()
+
+def create_pdf_pool():
+    # Workers are forked from a fork server (a fresh, single-threaded process), never from the
+    # threaded app process, so they can be replaced at any time. Nothing is preloaded: each worker
+    # takes this process's sys.path and imports this module itself. It also re-imports the entry
+    # script as __mp_main__, so that script's startup must sit under `if __name__ == '__main__'`
+    # (see run.py).
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload([])
+    return concurrent.futures.ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS, mp_context=context,
+                                                  max_tasks_per_child=PDF_MAX_TASKS_PER_WORKER or None)
+
+def start_pdf_extraction_pool():
+    """Starts the worker processes used for PDF text extraction.
+
+    Without a pool (or with PDF_EXTRACT_WORKERS=0) pages are extracted in the calling thread.
+    """
+    global pdf_pool
+    # Workers re-import the entry script, which must not start pools of its own
+    if PDF_EXTRACT_WORKERS <= 0 or multiprocessing.parent_process() is not None:
+        return
+    with pdf_pool_lock:
+        if pdf_pool is not None:
+            return
+        pdf_pool = create_pdf_pool()
+    pdf_pool.submit(int).result() # Starts the fork server now rather than on the first upload
+    print(f"--- PDF extraction pool started with {PDF_EXTRACT_WORKERS} worker processes. ---")
+
+def restart_pdf_pool(failed_pool):
+    """Replaces a broken or hung pool, unless another thread already has, and stops its workers."""
+    global pdf_pool
+    with pdf_pool_lock:
+        if pdf_pool is not failed_pool:
+            return
+        pdf_pool = create_pdf_pool()
+    print("--- PDF extraction: worker pool failed; started a new one. ---")
+    # A hung worker never finishes its task, so it is stopped rather than waited for
+    for process in list((getattr(failed_pool, '_processes', None) or {}).values()):
+        process.terminate()
+    failed_pool.shutdown(wait=False, cancel_futures=True)
 
 def smart_chunk_text(text):
-    """Splits text into chunks of a maximum size, respecting sentence boundaries."""
-    chunks = []
-    current_chunk = ""
-    # Split by sentences to avoid breaking in the middle of a thought
-    for sentence in text.split('. '):
-        if len(current_chunk) + len(sentence) < MAX_CHUNK_SIZE:
-            current_chunk += sentence + ". "
-        else:
-            # Add the completed chunk to the list
-            chunks.append(current_chunk)
-            # Start a new chunk
-            current_chunk = sentence + ". "
-    # Add the last remaining chunk
-    if current_chunk:
-        chunks.append(current_chunk)
-    return chunks
+    """Splits text into token-bounded chunks, preferring section and requirement boundaries."""
+    return [chunk['text'] for chunk in chunk_text(text)]
 
-def parse_pdf(file_content):
+def fingerprint_chunk(chunk):
+    """Returns a content fingerprint for a chunk that ignores whitespace-only edits."""
+    return hashlib.sha256(" ".join(chunk.split()).encode('utf-8')).hexdigest()
+
+# Parsers accept a document "source": either the file's bytes or the path of an upload spooled to disk
+@contextmanager
+def open_source(source):
+    """Opens a source as a binary file object without copying a spooled upload into memory."""
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            yield f
+    else:
+        yield BytesIO(source)
+
+def read_source_text(source):
+    """Decodes a source as UTF-8; spooled uploads are decoded straight from a memory map."""
+    if not isinstance(source, str):
+        return source.decode('utf-8')
+    with open(source, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ""
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return str(mapped, 'utf-8')
+
+def count_pdf_pages(pdf_path):
+    """Runs inside a pool worker process, so the parent never loads the PDF itself."""
+    return len(PdfReader(pdf_path).pages)
+
+def extract_pdf_page_range(pdf_path, start, end=None):
+    """Extracts pages [start, end) of a PDF (to the last page without an end), timing each page.
+    Runs inside a pool worker process, or inline without a pool."""
+    reader = PdfReader(pdf_path)
+    end = len(reader.pages) if end is None else end
+    results = []
+    for page_index in range(start, end):
+        page_started = time.perf_counter()
+        text = reader.pages[page_index].extract_text() or ""
+        results.append((text, time.perf_counter() - page_started))
+    return results
+
+def pool_result(pool, future, description):
+    """Waits for a pool task; a task that hangs past PDF_TASK_TIMEOUT_SECONDS, or a pool that
+    broke (a worker killed by the OOM killer or a crash), restarts the pool."""
     try:
-        from io import BytesIO
-        pdf_file = BytesIO(file_content)
-        reader = PdfReader(pdf_file)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() or ""
-        return smart_chunk_text(text)
-    except Exception as e:
-        return [f"Error parsing PDF: {e}"]
+        return future.result(timeout=PDF_TASK_TIMEOUT_SECONDS)
+    except concurrent.futures.TimeoutError:
+        restart_pdf_pool(pool)
+        raise TimeoutError(f"Extracting {description} took longer than {PDF_TASK_TIMEOUT_SECONDS:.0f}s.")
+    except BrokenProcessPool:
+        restart_pdf_pool(pool)
+        raise
 
-def parse_docx(file_content):
+def iter_pdf_page_batches(pdf_path):
+    """Yields the [(text, seconds), ...] of each page range in order.
+
+    Ranges are extracted in parallel by the process pool. If the pool breaks, it is replaced and
+    the remaining ranges are extracted inline, so one crashed worker costs speed, not the upload.
+    """
+    pool = pdf_pool
+    if pool is None:
+        yield extract_pdf_page_range(pdf_path, 0)
+        return
+    futures = []
+    done = 0 # Ranges already yielded
     try:
-        from io import BytesIO
-        doc_file = BytesIO(file_content)
-        doc = Document(doc_file)
-        text = "\n".join([para.text for para in doc.paragraphs])
-        return smart_chunk_text(text)
-    except Exception as e:
-        return [f"Error parsing DOCX: {e}"]
+        num_pages = pool_result(pool, pool.submit(count_pdf_pages, pdf_path), "the page count")
+        ranges = [(start, min(start + PDF_PAGES_PER_TASK, num_pages)) for start in range(0, num_pages, PDF_PAGES_PER_TASK)]
+        if len(ranges) <= 1:
+            yield extract_pdf_page_range(pdf_path, 0, num_pages)
+            return
+        futures = [pool.submit(extract_pdf_page_range, pdf_path, start, end) for start, end in ranges]
+        for (start, end), future in zip(ranges, futures):
+            batch = pool_result(pool, future, f"pages {start + 1}-{end}")
+            done += 1
+            yield batch
+    except BrokenProcessPool:
+        print("--- PDF extraction: worker pool broke; extracting the rest of this PDF inline. ---")
+        if not futures:
+            yield extract_pdf_page_range(pdf_path, 0)
+            return
+        for start, end in ranges[done:]:
+            yield extract_pdf_page_range(pdf_path, start, end)
+    finally:
+        for future in futures:
+            future.cancel()
 
-def parse_xml(file_content):
+def iter_pdf_pages(source):
+    """Yields (page_number, text, seconds) in page order.
+
+    Page ranges are extracted in parallel by the process pool, so later pages are being parsed
+    while earlier ones are consumed, and pypdf never holds this process's GIL.
+    """
+    # Workers read the PDF from a file instead of each receiving a pickled copy of the bytes
+    if isinstance(source, str):
+        pdf_path, owns_file = source, False
+    else:
+        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as pdf_file:
+            pdf_file.write(source)
+            pdf_path, owns_file = pdf_file.name, True
+    started = time.perf_counter()
+    timings = []
     try:
-        root = ET.fromstring(file_content)
-        text = ' '.join(elem.text for elem in root.iter() if elem.text)
-        return smart_chunk_text(text)
-    except Exception as e:
-        return [f"Error parsing XML: {e}"]
+        for batch in iter_pdf_page_batches(pdf_path):
+            for text, seconds in batch:
+                timings.append(seconds)
+                if seconds > PDF_SLOW_PAGE_SECONDS:
+                    print(f"--- PDF extraction: page {len(timings)} took {seconds:.2f}s ---")
+                yield len(timings), text, seconds
+    finally:
+        if owns_file:
+            os.remove(pdf_path)
+    if timings:
+        slowest = max(range(len(timings)), key=timings.__getitem__)
+        print(f"--- PDF extraction: {len(timings)} pages in {time.perf_counter() - started:.2f}s "
+              f"(page CPU {sum(timings):.2f}s, slowest page {slowest + 1} at {timings[slowest]:.2f}s) ---")
 
-def parse_markdown(file_content):
+def iter_pdf_text(source):
+    """Yields each page's text, followed by a newline."""
+    for _, page_text, _ in iter_pdf_pages(source):
+        yield page_text + "\n"
+
+def _docx_paragraph_text(paragraph):
+    parts = []
+    for node in paragraph.iter():
+        if node.tag == W_TEXT:
+            parts.append(node.text or "")
+        elif node.tag == W_TAB:
+            parts.append("\t")
+        elif node.tag in (W_BR, W_CR):
+            parts.append("\n")
+    return "".join(parts)
+
+def iter_docx_text(source):
+    """Streams paragraphs and table rows from word/document.xml without building python-docx's object model.
+
+    Each body paragraph is yielded as a line. Table rows (which python-docx's
+    `doc.paragraphs` skipped) become one line of ' | '-separated cell text; the rows of a table
+    nested in a cell become part of that cell's text. Parsed elements are cleared as soon as they
+    have been read, so memory stays flat on very large documents.
+    """
+    with open_source(source) as f, zipfile.ZipFile(f) as archive, archive.open('word/document.xml') as document_xml:
+        body = None
+        tables = [] # (row_cells, cell_paragraphs) of each open table, innermost last
+        for event, elem in ET.iterparse(document_xml, events=('start', 'end')):
+            if event == 'start':
+                if elem.tag == W_BODY:
+                    body = elem
+                elif elem.tag == W_TABLE:
+                    tables.append(([], []))
+                continue
+
+            if elem.tag == W_PARAGRAPH:
+                text = _docx_paragraph_text(elem)
+                if tables:
+                    tables[-1][1].append(text)
+                else:
+                    yield text + "\n"
+            elif elem.tag == W_TABLE_CELL:
+                row_cells, cell_paragraphs = tables[-1]
+                row_cells.append(" ".join(p.strip() for p in cell_paragraphs if p.strip()))
+                cell_paragraphs.clear()
+            elif elem.tag == W_TABLE_ROW:
+                row_cells = tables[-1][0]
+                if any(row_cells):
+                    if len(tables) > 1:
+                        tables[-2][1].append(" | ".join(row_cells))
+                    else:
+                        yield " | ".join(row_cells) + "\n"
+                row_cells.clear()
+            elif elem.tag == W_TABLE:
+                tables.pop()
+            else:
+                continue
+
+            elem.clear()
+            # Drop finished top-level blocks from the body so the tree never grows
+            if not tables and body is not None:
+                del body[:]
+
+def iter_xml_text(source):
+    """Streams the text of every XML element, clearing elements once they have been read.
+
+    Text is taken when an element closes, so a parent's own text comes after its children's.
+    """
+    root = None
+    with open_source(source) as f:
+        for event, elem in ET.iterparse(f, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                continue
+            if elem.text and elem.text.strip():
+                yield elem.text + " "
+            elem.clear()
+            if elem is not root:
+                del root[:] # Completed children are never needed again; keep the root's own text
+
+def iter_markdown_text(source):
+    yield markdown.markdown(read_source_text(source))
+
+def iter_plain_text(source):
+    yield read_source_text(source)
+
+# extension -> (label for error messages, text streamer, whether each streamed piece is a page)
+STREAMERS = {
+    '.pdf': ('PDF', iter_pdf_text, True),
+    '.docx': ('DOCX', iter_docx_text, False),
+    '.xml': ('XML', iter_xml_text, False),
+    '.md': ('Markdown', iter_markdown_text, False),
+    '.markdown': ('Markdown', iter_markdown_text, False),
+    '.txt': ('TXT', iter_plain_text, False),
+}
+
+def _iter_chunks(label, streamer, pieces_are_pages, source):
+    # Extraction and chunking interleave lazily, so each is timed across the whole stream
+    parsing = chunking = None
     try:
-        text = markdown.markdown(file_content.decode('utf-8'))
-        return smart_chunk_text(text)
+        parsing = TimedIterator(streamer(source), 'parse')
+        chunking = TimedIterator(chunk_stream(parsing, pieces_are_pages=pieces_are_pages), 'chunk', exclude=parsing)
+        yield from chunking
     except Exception as e:
-        return [f"Error parsing Markdown: {e}"]
+        yield {'text': f"Error parsing {label}: {e}", 'start_offset': 0, 'end_offset': 0}
+    finally:
+        if chunking is not None:
+            chunking.finish()
+        elif parsing is not None:
+            parsing.finish()
+
+def parse_pdf(file_content):
+    return [chunk['text'] for chunk in _iter_chunks(*STREAMERS['.pdf'], file_content)]
+
+def parse_docx(file_content):
+    return [chunk['text'] for chunk in _iter_chunks(*STREAMERS['.docx'], file_content)]
+
+def parse_xml(file_content):
+    return [chunk['text'] for chunk in _iter_chunks(*STREAMERS['.xml'], file_content)]
+
+def parse_markdown(file_content):
+    return [chunk['text'] for chunk in _iter_chunks(*STREAMERS['.md'], file_content)]
 
 def parse_txt(file_content):
-    try:
-        text = file_content.decode('utf-8')
-        return smart_chunk_text(text)
-    except Exception as e:
-        return [f"Error parsing TXT: {e}"]
+    return [chunk['text'] for chunk in _iter_chunks(*STREAMERS['.txt'], file_content)]
 
 
-def parse_document(file_name, file_content):
-    """Parses the content of an uploaded file and splits it into smart chunks."""
+def iter_document_chunks(file_name, source):
+    """Yields chunk dicts for an uploaded file as soon as enough of it has been extracted to fill them.
+
+    `source` is the file's bytes or the path of an upload spooled to disk.
+    """
     file_ext = os.path.splitext(file_name)[1].lower()
+    if file_ext not in STREAMERS:
+        yield {'text': "Unsupported file type. Please upload a PDF, DOCX, XML, MD, or TXT file.", 'start_offset': 0, 'end_offset': 0}
+        return
+    yield from _iter_chunks(*STREAMERS[file_ext], source)
 
-    if file_ext == '.pdf':
-        return parse_pdf(file_content)
-    elif file_ext == '.docx':
-        return parse_docx(file_content)
-    elif file_ext == '.xml':
-        return parse_xml(file_content)
-    elif file_ext in ['.md', '.markdown']:
-        return parse_markdown(file_content)
-    elif file_ext == '.txt':
-        return parse_txt(file_content)
-    else:
-        return ["Unsupported file type. Please upload a PDF, DOCX, XML, MD, or TXT file."]
+def parse_document_chunks(file_name, file_content):
+    """Parses an uploaded file into chunk dicts with 'text', source offsets and (for PDFs) 'pages'."""
+    return list(iter_document_chunks(file_name, file_content))
+
+def parse_document(file_name, file_content):
+    """Parses the content of an uploaded file and splits it into smart chunks."""
+    return [chunk['text'] for chunk in parse_document_chunks(file_name, file_content)]
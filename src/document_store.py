@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+DEFAULT_DOCUMENT_STORE_PATH = os.path.join(os.path.dirname(__file__), '..', 'config', 'documents.sqlite3')
+DEFAULT_MAX_BYTES = 128 * 1024 * 1024 # 128 MB of extracted documents and suites
+DEFAULT_TTL_SECONDS = 24 * 60 * 60 # One day
+
+class DocumentStore:
+    """Per-user working set (extracted text, last suite) with a size budget.
+
+    Values are stored as JSON, so every get() returns a fresh copy and the byte size of each
+    entry is known exactly. Entries older than ttl_seconds expire; when the total exceeds
+    max_bytes the least recently used entries are evicted. Backends implement _read, _write,
+    _remove and _usage.
+    """
+
+    backend = None
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str, field: str, default=None):
+        """Returns the stored value for the user's field, or default on a miss or an expired entry."""
+        with self._lock:
+            value = self._read(user_id, field, time.time())
+            if value is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+        return json.loads(value)
+
+    def put(self, user_id: str, field: str, value):
+        """Stores a JSON-serializable value, evicting expired and least-recently-used entries as needed."""
+        serialized = json.dumps(value)
+        size = len(serialized.encode('utf-8'))
+        with self._lock:
+            if self.max_bytes and size > self.max_bytes:
+                # Never let one document evict everyone else's; drop the stale copy instead
+                self.rejected += 1
+                self._remove(user_id, field)
+                return
+            self._write(user_id, field, serialized, size, time.time())
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, total_bytes = self._usage()
+        lookups = self.hits + self.misses
+        return {
+            'backend': self.backend,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / lookups) if lookups else 0.0,
+            'evictions': self.evictions,
+            'rejected_oversized': self.rejected,
+            'entries': entries,
+            'bytes': total_bytes,
+            'max_bytes': self.max_bytes
+        }
+
+
+class MemoryDocumentStore(DocumentStore):
+    """Keeps entries in this process, in least-recently-used order."""
+
+    backend = 'memory'
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        super().__init__(max_bytes, ttl_seconds)
+        self._entries = OrderedDict() # (user_id, field) -> (serialized value, size, created_at)
+        self._total_bytes = 0
+
+    def _read(self, user_id, field, now):
+        key = (user_id, field)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self.ttl_seconds and now - entry[2] > self.ttl_seconds:
+            self._remove(user_id, field)
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _write(self, user_id, field, serialized, size, now):
+        self._remove(user_id, field)
+        self._entries[(user_id, field)] = (serialized, size, now)
+        self._total_bytes += size
+        if self.ttl_seconds:
+            for key in [key for key, entry in self._entries.items() if now - entry[2] > self.ttl_seconds]:
+                self._remove(*key)
+                self.evictions += 1
+        while self.max_bytes and self._total_bytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            self._remove(*key)
+            self.evictions += 1
+
+    def _remove(self, user_id, field):
+        entry = self._entries.pop((user_id, field), None)
+        if entry is not None:
+            self._total_bytes -= entry[1]
+
+    def _usage(self):
+        return len(self._entries), self._total_bytes
+
+
+class SQLiteDocumentStore(DocumentStore):
+    """Keeps entries in a SQLite file, so every server process on the host sees the same documents."""
+
+    backend = 'sqlite'
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES, ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        super().__init__(max_bytes, ttl_seconds)
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " user_id TEXT NOT NULL,"
+            " field TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL,"
+            " PRIMARY KEY (user_id, field))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_last_access ON documents (last_access)")
+        self._conn.commit()
+
+    def _read(self, user_id, field, now):
+        row = self._conn.execute("SELECT value, created_at FROM documents WHERE user_id = ? AND field = ?", (user_id, field)).fetchone()
+        if row is None:
+            return None
+        value, created_at = row
+        if self.ttl_seconds and now - created_at > self.ttl_seconds:
+            self._remove(user_id, field)
+            self.evictions += 1
+            return None
+        self._conn.execute("UPDATE documents SET last_access = ? WHERE user_id = ? AND field = ?", (now, user_id, field))
+        self._conn.commit()
+        return value
+
+    def _write(self, user_id, field, serialized, size, now):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO documents (user_id, field, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+            (user_id, field, serialized, size, now, now)
+        )
+        if self.ttl_seconds:
+            cursor = self._conn.execute("DELETE FROM documents WHERE created_at < ?", (now - self.ttl_seconds,))
+            self.evictions += max(cursor.rowcount, 0)
+        if self.max_bytes:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM documents").fetchone()[0]
+            if total > self.max_bytes:
+                for lru_user_id, lru_field, lru_size in self._conn.execute(
+                    "SELECT user_id, field, size FROM documents ORDER BY last_access ASC"
+                ).fetchall():
+                    self._conn.execute("DELETE FROM documents WHERE user_id = ? AND field = ?", (lru_user_id, lru_field))
+                    self.evictions += 1
+                    total -= lru_size
+                    if total <= self.max_bytes:
+                        break
+        self._conn.commit()
+
+    def _remove(self, user_id, field):
+        self._conn.execute("DELETE FROM documents WHERE user_id = ? AND field = ?", (user_id, field))
+        self._conn.commit()
+
+    def _usage(self):
+        return self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM documents").fetchone()
+
+
+def create_document_store():
+    """Creates the document store from environment settings (DOCUMENT_STORE_BACKEND=memory or sqlite)."""
+    max_bytes = int(os.getenv('DOCUMENT_STORE_MAX_BYTES', DEFAULT_MAX_BYTES))
+    ttl_seconds = int(os.getenv('DOCUMENT_STORE_TTL_SECONDS', DEFAULT_TTL_SECONDS))
+    backend = os.getenv('DOCUMENT_STORE_BACKEND', 'memory').lower()
+    if backend == 'sqlite':
+        try:
+            store = SQLiteDocumentStore(os.getenv('DOCUMENT_STORE_PATH', DEFAULT_DOCUMENT_STORE_PATH), max_bytes, ttl_seconds)
+            print(f"--- Document store ready at {store.path} ---")
+            return store
+        except Exception as e:
+            print(f"Error initializing SQLite document store, falling back to memory: {e}")
+    return MemoryDocumentStore(max_bytes, ttl_seconds)
@@ -0,0 +1,115 @@
+import os
+import csv
+import json
+import tempfile
+from openpyxl import Workbook
+from pdf_export import iter_pdf_table
+
+# Columns of every test case export, in order
+EXPORT_HEADERS = ['test_case_id', 'requirement_id', 'description', 'test_type', 'priority', 'rtm_compliance_mapping', 'steps', 'expected_result']
+
+ROWS_PER_CHUNK = 500 # Test cases rendered into each streamed chunk of a text export
+FILE_BLOCK_SIZE = 256 * 1024 # Bytes per chunk when streaming a rendered file from disk
+
+def format_rtm_for_export(rtm):
+    if not rtm: return 'N/A'
+    if isinstance(rtm, str): return rtm
+    if isinstance(rtm, dict): return rtm.get('rule_id', json.dumps(rtm))
+    if isinstance(rtm, list): return ', '.join([format_rtm_for_export(item) for item in rtm])
+    return str(rtm)
+
+def export_row(tc, headers):
+    """The cell values of one test case, in header order."""
+    row = []
+    for header in headers:
+        if header == 'steps':
+            row.append("\n".join(tc.get('steps', [])))
+        elif header == 'rtm_compliance_mapping':
+            row.append(format_rtm_for_export(tc.get('rtm_compliance_mapping')))
+        else:
+            row.append(tc.get(header, 'N/A'))
+    return row
+
+
+class _PartsBuffer:
+    """A write() target that collects strings until they are taken as one encoded chunk."""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+    def take(self) -> bytes:
+        chunk = "".join(self.parts).encode('utf-8')
+        self.parts.clear()
+        return chunk
+
+def iter_csv(test_cases, headers=EXPORT_HEADERS):
+    """Yields the CSV export as UTF-8 chunks of ROWS_PER_CHUNK rows, so only one chunk is ever held."""
+    buffer = _PartsBuffer()
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+    for index, tc in enumerate(test_cases, 1):
+        writer.writerow(export_row(tc, headers))
+        if index % ROWS_PER_CHUNK == 0:
+            yield buffer.take()
+    if buffer.parts:
+        yield buffer.take()
+
+def iter_txt(test_cases, headers=EXPORT_HEADERS):
+    """Yields the plain-text export as UTF-8 chunks of ROWS_PER_CHUNK test cases."""
+    buffer = _PartsBuffer()
+    for index, tc in enumerate(test_cases, 1):
+        for header in headers:
+            if header == 'steps':
+                steps = "\n".join([f"  {i+1}. {s}" for i, s in enumerate(tc.get('steps', []))])
+                buffer.write(f"Steps:\n{steps}\n")
+            elif header == 'rtm_compliance_mapping':
+                rtm = format_rtm_for_export(tc.get('rtm_compliance_mapping'))
+                buffer.write(f"RTM Compliance Mapping: {rtm}\n")
+            else:
+                buffer.write(f"{header.replace('_', ' ').title()}: {tc.get(header, 'N/A')}\n")
+        buffer.write("-" * 30 + "\n")
+        if index % ROWS_PER_CHUNK == 0:
+            yield buffer.take()
+    if buffer.parts:
+        yield buffer.take()
+
+def iter_xlsx(test_cases, headers=EXPORT_HEADERS):
+    """Yields the XLSX export in FILE_BLOCK_SIZE blocks.
+
+    A write-only workbook serializes each row to a temporary file as it is appended instead of
+    keeping a cell object per value, and the finished workbook is zipped to disk and streamed
+    from there, so memory use does not grow with the suite.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Test Cases")
+    sheet.append(headers)
+    for tc in test_cases:
+        sheet.append(export_row(tc, headers))
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    try:
+        os.close(fd)
+        workbook.save(path)
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(FILE_BLOCK_SIZE)
+                if not block:
+                    break
+                yield block
+    finally:
+        os.remove(path)
+
+def iter_pdf(test_cases, headers=EXPORT_HEADERS):
+    """Yields the PDF export page by page (see pdf_export.iter_pdf_table)."""
+    titles = [header.replace('_', ' ').title() for header in headers]
+    return iter_pdf_table(titles, (export_row(tc, headers) for tc in test_cases))
+
+# Export format -> (chunk generator, Content-Type)
+EXPORTERS = {
+    'csv': (iter_csv, 'text/csv; charset=utf-8'),
+    'xlsx': (iter_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'txt': (iter_txt, 'text/plain; charset=utf-8'),
+    'pdf': (iter_pdf, 'application/pdf')
+}
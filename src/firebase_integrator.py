@@ -2,6 +2,22 @@ import firebase_admin
 from firebase_admin import credentials, firestore
 import os
 import json
+import time
+import threading
+import concurrent.futures
+from collections import OrderedDict
+
+from metrics import span
+
+# Firestore accepts at most 500 writes and 10 MiB per batched write, and 1 MiB per document
+FIRESTORE_BATCH_MAX_WRITES = max(1, min(500, int(os.getenv('FIRESTORE_BATCH_MAX_WRITES', '500'))))
+FIRESTORE_BATCH_MAX_BYTES = 9 * 1024 * 1024
+# Test cases are sharded across documents of about this size (JSON-encoded)
+FIRESTORE_SHARD_MAX_BYTES = min(900 * 1024, int(os.getenv('FIRESTORE_SHARD_MAX_BYTES', str(256 * 1024))))
+# Batches committed in parallel, across all background saves
+FIRESTORE_WRITE_CONCURRENCY = max(1, int(os.getenv('FIRESTORE_WRITE_CONCURRENCY', '4')))
+# Statuses of this many recent saves are kept in memory; older ones are read back from Firestore
+FIRESTORE_STATUS_KEEP = 1000
 
 db = None
 
@@ -28,23 +44,207 @@ def initialize_firebase():
         print("--- Firebase credentials (FIREBASE_CREDENTIALS_JSON) not found in environment. Skipping Firebase initialization. ---")
         db = None
 
+def estimate_size(data) -> int:
+    """Roughly the bytes a document takes in Firestore: its JSON encoding."""
+    return len(json.dumps(data, default=str))
+
+def commit_in_batches(client, writes: list, executor=None, on_commit=None) -> list:
+    """Sets each (document reference, data) pair, FIRESTORE_BATCH_MAX_WRITES writes (and at most
+    FIRESTORE_BATCH_MAX_BYTES) per batched write. With an executor the batches are committed in
+    parallel. on_commit(number of writes) is called as each batch commits.
+
+    Returns the error of each failed batch. A batch is atomic, so its writes all land or none do.
+    """
+    batches = []
+    current, current_bytes = [], 0
+    for doc_ref, data in writes:
+        size = estimate_size(data)
+        if current and (len(current) == FIRESTORE_BATCH_MAX_WRITES or current_bytes + size > FIRESTORE_BATCH_MAX_BYTES):
+            batches.append(current)
+            current, current_bytes = [], 0
+        current.append((doc_ref, data))
+        current_bytes += size
+    if current:
+        batches.append(current)
+
+    def commit(batch_writes):
+        batch = client.batch()
+        for doc_ref, data in batch_writes:
+            batch.set(doc_ref, data)
+        batch.commit()
+        if on_commit is not None:
+            on_commit(len(batch_writes))
+
+    errors = []
+    if executor is None:
+        for batch_writes in batches:
+            try:
+                commit(batch_writes)
+            except Exception as e:
+                errors.append(e)
+        return errors
+    for future in [executor.submit(commit, batch_writes) for batch_writes in batches]:
+        try:
+            future.result()
+        except Exception as e:
+            errors.append(e)
+    return errors
+
+def shard_test_cases(test_cases: list, max_bytes: int = FIRESTORE_SHARD_MAX_BYTES) -> list:
+    """Splits a suite into consecutive lists of about max_bytes each (a larger case gets a shard of its own)."""
+    shards = []
+    current, current_bytes = [], 0
+    for tc in test_cases:
+        size = estimate_size(tc)
+        if current and current_bytes + size > max_bytes:
+            shards.append(current)
+            current, current_bytes = [], 0
+        current.append(tc)
+        current_bytes += size
+    if current:
+        shards.append(current)
+    return shards
+
 def save_test_cases_to_firebase(test_cases: list, collection_name: str = "test_cases"):
     if db is None:
         print("--- Firebase not initialized. Cannot save test cases. ---")
         return ["Firebase not initialized. Cannot save test cases."]
 
     confirmations = []
-    try:
-        batch = db.batch()
-        for tc in test_cases:
-            # Firestore automatically generates document IDs if not provided
-            doc_ref = db.collection(collection_name).document()
-            batch.set(doc_ref, tc)
-        batch.commit()
+    # Firestore automatically generates document IDs if not provided
+    errors = commit_in_batches(db, [(db.collection(collection_name).document(), tc) for tc in test_cases])
+    if not errors:
         confirmations.append(f"Successfully saved {len(test_cases)} test cases to Firestore collection '{collection_name}'.")
         print(f"--- Successfully saved {len(test_cases)} test cases to Firestore. ---")
-    except Exception as e:
-        error_message = f"Error saving test cases to Firebase: {e}"
+    else:
+        error_message = f"Error saving test cases to Firebase: {errors[0]}"
         print(f"--- {error_message} ---")
         confirmations.append(error_message)
     return confirmations
+
+
+class FirestoreWriter:
+    """Saves generated suites to a user's test_case_history in the background.
+
+    A save is a parent document (status, counts, chunk fingerprints) with the test cases sharded
+    across documents of its 'shards' subcollection, so no suite hits the 1 MiB document limit.
+    Shards are committed in batched writes, several in parallel. The parent's status goes from
+    'writing' to 'complete' (or 'failed') once every shard is in, so readers never see a partial
+    suite. Progress is kept in memory for the status endpoint and mirrored on the parent.
+    """
+
+    def __init__(self, client, concurrency: int = FIRESTORE_WRITE_CONCURRENCY):
+        self.client = client
+        self._lock = threading.Lock()
+        self._statuses = OrderedDict() # save_id -> status dict, most recent last
+        self._saves = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix='firestore-save')
+        self._commits = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='firestore-commit')
+        self._completed = 0
+        self._failed = 0
+
+    def _history(self, user_id: str):
+        return self.client.collection('users').document(user_id).collection('test_case_history')
+
+    def submit(self, user_id: str, test_cases: list, fields: dict = None) -> dict:
+        """Queues a save and returns its initial status. fields are extra values for the parent document."""
+        parent = self._history(user_id).document()
+        status = {
+            'save_id': parent.id,
+            'user_id': user_id,
+            'status': 'queued',
+            'test_case_count': len(test_cases),
+            'shard_count': None,
+            'written_shards': 0,
+            'error': None
+        }
+        with self._lock:
+            self._statuses[parent.id] = status
+            while len(self._statuses) > FIRESTORE_STATUS_KEEP:
+                self._statuses.popitem(last=False)
+            initial = self._public(status)
+        self._saves.submit(self._save, parent, status, list(test_cases), dict(fields or {}))
+        return initial
+
+    @staticmethod
+    def _public(status: dict) -> dict:
+        return {key: value for key, value in status.items() if key != 'user_id'}
+
+    def _update(self, save: dict, **changes):
+        with self._lock:
+            save.update(changes)
+
+    def _advance(self, save: dict, written: int):
+        with self._lock:
+            save['written_shards'] += written
+
+    @span('firebase.write')
+    def _save(self, parent, status, test_cases, fields):
+        started = time.perf_counter()
+        shards = shard_test_cases(test_cases)
+        self._update(status, status='writing', shard_count=len(shards))
+        try:
+            parent.set(dict(fields, timestamp=firestore.SERVER_TIMESTAMP, status='writing', test_case_count=len(test_cases), shard_count=len(shards)))
+            shard_refs = parent.collection('shards')
+            writes = [(shard_refs.document(f"{index:05d}"), {'index': index, 'test_cases': shard}) for index, shard in enumerate(shards)]
+            errors = commit_in_batches(self.client, writes, self._commits, lambda count: self._advance(status, count))
+            if errors:
+                raise errors[0]
+            parent.update({'status': 'complete'})
+        except Exception as e:
+            print(f"--- FIRESTORE: Saving {status['save_id']} failed: {e} ---")
+            self._update(status, status='failed', error=str(e))
+            try:
+                parent.update({'status': 'failed', 'error': str(e)})
+            except Exception:
+                pass
+            with self._lock:
+                self._failed += 1
+            return
+        self._update(status, status='complete')
+        with self._lock:
+            self._completed += 1
+        print(f"--- FIRESTORE: Saved {len(test_cases)} test cases in {len(shards)} shards as {status['save_id']} in {time.perf_counter() - started:.2f}s. ---")
+
+    def status(self, user_id: str, save_id: str):
+        """Returns a save's progress, or None if it is unknown or not the user's."""
+        with self._lock:
+            status = self._statuses.get(save_id)
+            if status is not None:
+                return self._public(status) if status['user_id'] == user_id else None
+        # Saved by another server process, or before a restart: the parent document has the outcome
+        snapshot = self._history(user_id).document(save_id).get()
+        if not snapshot.exists:
+            return None
+        data = snapshot.to_dict()
+        shard_count = data.get('shard_count')
+        # Documents saved before sharding hold the whole suite and no status
+        return {
+            'save_id': save_id,
+            'status': data.get('status', 'complete'),
+            'test_case_count': data.get('test_case_count', len(data.get('test_cases') or [])),
+            'shard_count': shard_count,
+            'written_shards': shard_count if data.get('status', 'complete') == 'complete' else None,
+            'error': data.get('error')
+        }
+
+    def load_latest(self, user_id: str):
+        """Returns the test cases of the user's most recent complete save, or None."""
+        for doc in self._history(user_id).order_by('timestamp', direction=firestore.Query.DESCENDING).limit(5).stream():
+            data = doc.to_dict()
+            if 'test_cases' in data:
+                return data['test_cases']
+            if data.get('status') != 'complete':
+                continue
+            test_cases = []
+            for shard in doc.reference.collection('shards').order_by('index').stream():
+                test_cases.extend(shard.to_dict().get('test_cases') or [])
+            return test_cases
+        return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'in_progress': sum(1 for status in self._statuses.values() if status['status'] in ('queued', 'writing')),
+                'completed': self._completed,
+                'failed': self._failed
+            }
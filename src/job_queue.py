@@ -0,0 +1,256 @@
+import os
+import json
+import time
+import queue
+import sqlite3
+import threading
+import contextvars
+import concurrent.futures
+
+from llm_scheduler import request_scope
+from metrics import trace_scope
+
+DEFAULT_JOB_DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'config', 'jobs.sqlite3')
+
+# Job and chunk states
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETE = 'complete'
+FAILED = 'failed'
+SKIPPED = 'skipped' # Chunks with no requirements, never sent to the model
+
+class JobQueue:
+    """A durable, SQLite-backed queue that runs document generation jobs on local worker threads.
+
+    Each chunk's result is written as soon as it finishes, so a restarted process resumes a job
+    from its unfinished chunks instead of starting over. The pipeline steps are injected:
+
+    - process_chunk(chunk_text, deduplicator) -> list of checked test cases
+    - create_deduplicator() -> a deduplicator shared by one job's chunks (its merges are attached before finalize), or None
+    - analyze_chunk(chunk_text) -> that chunk's ambiguity report list
+    - merge_reports(list of chunk reports) -> the document's ambiguity report
+    - finalize(user_id, test_cases, ambiguity_report, options, secrets) -> dict merged into the job result
+    """
+
+    def __init__(self, path: str, process_chunk, analyze_chunk, merge_reports, finalize, create_deduplicator=None,
+                 num_workers: int = 2, chunk_workers: int = 8):
+        self.path = path
+        self.process_chunk = process_chunk
+        self.create_deduplicator = create_deduplicator
+        self.analyze_chunk = analyze_chunk
+        self.merge_reports = merge_reports
+        self.finalize = finalize
+        self.chunk_workers = chunk_workers
+        # Credentials (Jira tokens) are only ever held in memory, never written to the job database
+        self._secrets = {}
+        self._lock = threading.Lock()
+        self._pending = queue.Queue()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " user_id TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " total_chunks INTEGER NOT NULL,"
+            " extracted_text TEXT NOT NULL,"
+            " options TEXT NOT NULL,"
+            " ambiguity_report TEXT,"
+            " result TEXT,"
+            " error TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS job_chunks ("
+            " job_id TEXT NOT NULL,"
+            " chunk_index INTEGER NOT NULL,"
+            " chunk_text TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " test_cases TEXT,"
+            " ambiguity_report TEXT,"
+            " PRIMARY KEY (job_id, chunk_index));"
+        )
+        self._conn.commit()
+
+        self._resume_unfinished_jobs()
+        for i in range(num_workers):
+            threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True).start()
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            self._conn.commit()
+            return cursor.fetchall()
+
+    def _resume_unfinished_jobs(self):
+        rows = self._execute("SELECT job_id FROM jobs WHERE status IN (?, ?) ORDER BY created_at", (QUEUED, RUNNING))
+        for (job_id,) in rows:
+            self._execute("UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ?", (QUEUED, time.time(), job_id))
+            self._pending.put(job_id)
+        if rows:
+            print(f"--- Job queue: resuming {len(rows)} unfinished job(s). ---")
+
+    def submit(self, user_id: str, text_chunks: list, extracted_text: str, options: dict = None, secrets: dict = None,
+               carried_over: dict = None, skipped: set = None) -> str:
+        """Persists a new job with its chunks and queues it. Returns the job ID.
+
+        Chunks in `carried_over` (index -> test cases) are stored as already complete. Chunk
+        indexes in `skipped` are neither generated nor analyzed.
+        """
+        carried_over = carried_over or {}
+        skipped = skipped or set()
+        job_id = os.urandom(16).hex()
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, user_id, status, total_chunks, extracted_text, options, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, user_id, QUEUED, len(text_chunks), extracted_text, json.dumps(options or {}), now, now)
+            )
+            rows = []
+            for i, chunk in enumerate(text_chunks):
+                if i in skipped:
+                    rows.append((job_id, i, chunk, SKIPPED, '[]', '[]'))
+                elif i in carried_over:
+                    rows.append((job_id, i, chunk, COMPLETE, json.dumps(carried_over[i]), None))
+                else:
+                    rows.append((job_id, i, chunk, QUEUED, None, None))
+            self._conn.executemany(
+                "INSERT INTO job_chunks (job_id, chunk_index, chunk_text, status, test_cases, ambiguity_report) VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+        if secrets:
+            self._secrets[job_id] = secrets
+        self._pending.put(job_id)
+        print(f"--- Job queue: queued job {job_id} with {len(text_chunks)} chunks. ---")
+        return job_id
+
+    def _worker(self):
+        while True:
+            job_id = self._pending.get()
+            try:
+                # finalize can read the job's timing breakdown from the current trace
+                with trace_scope():
+                    self._run_job(job_id)
+            except Exception as e:
+                print(f"--- Job queue: job {job_id} failed: {e} ---")
+                self._execute("UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE job_id = ?", (FAILED, str(e), time.time(), job_id))
+            finally:
+                self._secrets.pop(job_id, None)
+
+    def _run_job(self, job_id: str):
+        rows = self._execute("SELECT user_id, options FROM jobs WHERE job_id = ?", (job_id,))
+        if not rows:
+            return
+        user_id, options = rows[0]
+        options = json.loads(options)
+        self._execute("UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ?", (RUNNING, time.time(), job_id))
+
+        chunk_rows = self._execute(
+            "SELECT chunk_index, chunk_text, status, ambiguity_report FROM job_chunks WHERE job_id = ? ORDER BY chunk_index", (job_id,)
+        )
+        deduplicator = self.create_deduplicator() if self.create_deduplicator else None
+        if deduplicator is not None:
+            # Cases already stored (carried over, or finished before a restart) are indexed so new ones can't duplicate them
+            for (test_cases_json,) in self._execute(
+                "SELECT test_cases FROM job_chunks WHERE job_id = ? AND status = ? ORDER BY chunk_index", (job_id, COMPLETE)
+            ):
+                for test_case in json.loads(test_cases_json or '[]'):
+                    deduplicator.add(test_case)
+        with request_scope(f"job:{job_id}"):
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.chunk_workers) as executor:
+                # Generation and ambiguity analysis of each chunk are separate tasks, interleaved so
+                # they overlap. Only the parts not already persisted are (re)submitted.
+                generation_futures = {}
+                ambiguity_futures = {}
+                for chunk_index, chunk_text, status, ambiguity_json in chunk_rows:
+                    if status not in (COMPLETE, SKIPPED):
+                        generation_futures[executor.submit(contextvars.copy_context().run, self.process_chunk, chunk_text, deduplicator)] = chunk_index
+                    if ambiguity_json is None:
+                        ambiguity_futures[executor.submit(contextvars.copy_context().run, self.analyze_chunk, chunk_text)] = chunk_index
+
+                for future in concurrent.futures.as_completed(list(generation_futures) + list(ambiguity_futures)):
+                    if future in ambiguity_futures:
+                        try:
+                            self._execute(
+                                "UPDATE job_chunks SET ambiguity_report = ? WHERE job_id = ? AND chunk_index = ?",
+                                (json.dumps(future.result() or []), job_id, ambiguity_futures[future])
+                            )
+                        except Exception as exc:
+                            print(f"An ambiguity detection task failed with an exception: {exc}")
+                        continue
+
+                    chunk_index = generation_futures[future]
+                    try:
+                        test_cases, status = future.result() or [], COMPLETE
+                    except Exception as exc:
+                        print(f"A chunk processing task failed with an exception: {exc}")
+                        test_cases, status = [], FAILED
+                    self._execute(
+                        "UPDATE job_chunks SET status = ?, test_cases = ? WHERE job_id = ? AND chunk_index = ?",
+                        (status, json.dumps(test_cases), job_id, chunk_index)
+                    )
+                    self._execute("UPDATE jobs SET updated_at = ? WHERE job_id = ?", (time.time(), job_id))
+
+        chunk_reports = [json.loads(report_json) for (report_json,) in self._execute(
+            "SELECT ambiguity_report FROM job_chunks WHERE job_id = ? AND ambiguity_report IS NOT NULL ORDER BY chunk_index", (job_id,)
+        )]
+        ambiguity_report = self.merge_reports(chunk_reports)
+        self._execute("UPDATE jobs SET ambiguity_report = ?, updated_at = ? WHERE job_id = ?", (json.dumps(ambiguity_report), time.time(), job_id))
+
+        all_test_cases = []
+        for (test_cases_json,) in self._execute("SELECT test_cases FROM job_chunks WHERE job_id = ? ORDER BY chunk_index", (job_id,)):
+            all_test_cases.extend(json.loads(test_cases_json or '[]'))
+        if not all_test_cases:
+            self._execute("UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE job_id = ?",
+                          (FAILED, 'The AI did not generate any valid test cases.', time.time(), job_id))
+            return
+
+        if deduplicator is not None:
+            deduplicator.attach_merges(all_test_cases)
+        result = self.finalize(user_id, all_test_cases, ambiguity_report, options, self._secrets.get(job_id))
+        if deduplicator is not None:
+            result['dedup'] = deduplicator.stats()
+        # The suite as finalized, with its dedup merges and the case_uids the result store assigned
+        result['test_cases'] = all_test_cases
+        self._execute("UPDATE jobs SET status = ?, result = ?, updated_at = ? WHERE job_id = ?", (COMPLETE, json.dumps(result), time.time(), job_id))
+        # The chunk rows' cases were only kept to resume the job; the finished suite replaces them
+        self._execute("UPDATE job_chunks SET test_cases = NULL WHERE job_id = ?", (job_id,))
+        print(f"--- Job queue: job {job_id} complete with {len(all_test_cases)} test cases. ---")
+
+    def get_status(self, job_id: str):
+        """Returns the job's progress as a dict, or None if the job does not exist."""
+        rows = self._execute("SELECT user_id, status, total_chunks, error, created_at, updated_at FROM jobs WHERE job_id = ?", (job_id,))
+        if not rows:
+            return None
+        user_id, status, total_chunks, error, created_at, updated_at = rows[0]
+        counts = dict(self._execute("SELECT status, COUNT(*) FROM job_chunks WHERE job_id = ? GROUP BY status", (job_id,)))
+        return {
+            'job_id': job_id,
+            'user_id': user_id,
+            'status': status,
+            'total_chunks': total_chunks,
+            'completed_chunks': counts.get(COMPLETE, 0),
+            'failed_chunks': counts.get(FAILED, 0),
+            'skipped_chunks': counts.get(SKIPPED, 0),
+            'error': error,
+            'created_at': created_at,
+            'updated_at': updated_at
+        }
+
+    def get_result(self, job_id: str):
+        """Returns the finished job's response payload, or None if it is not complete.
+
+        The test cases are the suite stored when the job completed, exactly as it was finalized.
+        """
+        rows = self._execute("SELECT status, extracted_text, ambiguity_report, result FROM jobs WHERE job_id = ?", (job_id,))
+        if not rows or rows[0][0] != COMPLETE:
+            return None
+        _, extracted_text, ambiguity_json, result_json = rows[0]
+        result = json.loads(result_json or '{}')
+        response_data = {
+            'extracted_text': extracted_text,
+            'test_cases': result.pop('test_cases', []),
+            'ambiguity_report': json.loads(ambiguity_json or '[]')
+        }
+        response_data.update(result)
+        return response_data
@@ -0,0 +1,183 @@
+import os
+import time
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+# Identifies which HTTP request an LLM call belongs to so queues drain fairly between uploads.
+# Worker threads inherit it when tasks are submitted through contextvars.copy_context().run.
+current_request_id = contextvars.ContextVar('current_request_id', default='default')
+
+CHARS_PER_TOKEN = 4 # Rough average for English prose; corrected afterwards from usage metadata
+
+@contextmanager
+def request_scope(request_id: str):
+    """Tags every LLM call made inside the block (and in tasks copied from its context) with request_id."""
+    token = current_request_id.set(request_id)
+    try:
+        yield
+    finally:
+        current_request_id.reset(token)
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Recognises quota errors from the Gemini SDK without importing google.api_core here."""
+    return type(error).__name__ in ('ResourceExhausted', 'TooManyRequests') or '429' in str(error)
+
+
+class TokenBucket:
+    """A refilling budget of `per_minute` units; a per_minute of 0 means unlimited."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        if self.capacity:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available (0 if available now)."""
+        if not self.capacity:
+            return 0.0
+        amount = min(amount, self.capacity) # Oversized calls wait for a full bucket instead of forever
+        deficit = amount - self.level
+        return deficit / self.rate if deficit > 0 else 0.0
+
+    def take(self, amount: float):
+        if self.capacity:
+            self.level -= min(amount, self.capacity)
+
+
+class LLMScheduler:
+    """Process-wide gate for Gemini calls.
+
+    Enforces a maximum number of in-flight calls plus requests-per-minute and tokens-per-minute
+    budgets. Waiting calls are queued per request and granted round-robin across requests, so
+    one large upload cannot starve the others.
+    """
+
+    def __init__(self, max_in_flight: int = 8, requests_per_minute: int = 60, tokens_per_minute: int = 0,
+                 rate_limit_cooldown: float = 10.0, max_rate_limit_retries: int = 3):
+        self.max_in_flight = max_in_flight
+        self.rate_limit_cooldown = rate_limit_cooldown
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self._request_bucket = TokenBucket(requests_per_minute)
+        self._token_bucket = TokenBucket(tokens_per_minute)
+        self._cond = threading.Condition()
+        self._queues = {} # request_id -> deque of waiting tickets
+        self._order = deque() # request_ids with waiting tickets, in round-robin order
+        self._in_flight = 0
+        self._cooldown_until = 0.0
+        # Counters exposed through stats()
+        self._granted = 0
+        self._rate_limited = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def _acquire(self, request_id: str, tokens: int) -> float:
+        ticket = object()
+        enqueued = time.monotonic()
+        with self._cond:
+            if request_id not in self._queues:
+                self._queues[request_id] = deque()
+                self._order.append(request_id)
+            self._queues[request_id].append(ticket)
+
+            while True:
+                now = time.monotonic()
+                self._request_bucket.refill(now)
+                self._token_bucket.refill(now)
+                head_request = self._order[0]
+                if self._queues[head_request][0] is ticket and self._in_flight < self.max_in_flight:
+                    wait = max(self._cooldown_until - now, self._request_bucket.wait_time(1), self._token_bucket.wait_time(tokens))
+                    if wait <= 0:
+                        break
+                    self._cond.wait(timeout=wait)
+                else:
+                    self._cond.wait(timeout=1.0)
+
+            # Grant: consume budgets and move this request to the back of the rotation
+            self._request_bucket.take(1)
+            self._token_bucket.take(tokens)
+            self._in_flight += 1
+            self._queues[request_id].popleft()
+            self._order.popleft()
+            if self._queues[request_id]:
+                self._order.append(request_id)
+            else:
+                del self._queues[request_id]
+
+            waited = time.monotonic() - enqueued
+            self._granted += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+            self._cond.notify_all()
+            return waited
+
+    def _release(self, token_adjustment: int = 0, rate_limited: bool = False):
+        with self._cond:
+            self._in_flight -= 1
+            if token_adjustment:
+                self._token_bucket.take(token_adjustment)
+            if rate_limited:
+                self._rate_limited += 1
+                self._cooldown_until = max(self._cooldown_until, time.monotonic() + self.rate_limit_cooldown)
+            self._cond.notify_all()
+
+    def run(self, fn, estimated_tokens: int = 0, request_id: str = None):
+        """Calls fn() once capacity is available and returns its result.
+
+        Rate-limit errors pause all callers for the cooldown and re-queue the call, up to
+        max_rate_limit_retries times. If the result carries Gemini `usage_metadata`, the token
+        budget is corrected from the estimate to the real count.
+        """
+        request_id = request_id or current_request_id.get()
+        for attempt in range(self.max_rate_limit_retries + 1):
+            self._acquire(request_id, estimated_tokens)
+            try:
+                result = fn()
+            except Exception as e:
+                rate_limited = is_rate_limit_error(e)
+                self._release(rate_limited=rate_limited)
+                if rate_limited and attempt < self.max_rate_limit_retries:
+                    print(f"  -> Gemini rate limit hit, re-queueing call (attempt {attempt + 1}/{self.max_rate_limit_retries}).")
+                    continue
+                raise
+            usage = getattr(result, 'usage_metadata', None)
+            actual_tokens = getattr(usage, 'total_token_count', 0) if usage is not None else 0
+            self._release(token_adjustment=(actual_tokens - estimated_tokens) if actual_tokens else 0)
+            return result
+
+    def stats(self) -> dict:
+        """Returns queue depth, in-flight count and wait times for monitoring."""
+        with self._cond:
+            return {
+                'in_flight': self._in_flight,
+                'max_in_flight': self.max_in_flight,
+                'queue_depth': sum(len(q) for q in self._queues.values()),
+                'queued_requests': {rid: len(q) for rid, q in self._queues.items()},
+                'calls_granted': self._granted,
+                'rate_limited_calls': self._rate_limited,
+                'avg_wait_seconds': (self._total_wait / self._granted) if self._granted else 0.0,
+                'max_wait_seconds': self._max_wait
+            }
+
+
+def create_llm_scheduler():
+    """Creates the scheduler from environment settings."""
+    return LLMScheduler(
+        max_in_flight=int(os.getenv('LLM_MAX_IN_FLIGHT', '8')),
+        requests_per_minute=int(os.getenv('LLM_REQUESTS_PER_MINUTE', '60')),
+        tokens_per_minute=int(os.getenv('LLM_TOKENS_PER_MINUTE', '0')),
+        rate_limit_cooldown=float(os.getenv('LLM_RATE_LIMIT_COOLDOWN_SECONDS', '10'))
+    )
+
+# The single scheduler shared by every request thread in this process
+llm_scheduler = create_llm_scheduler()
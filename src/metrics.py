@@ -0,0 +1,261 @@
+import os
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Gemini prices used to estimate spend from token counts; 0 leaves the cost metric at 0
+GEMINI_INPUT_USD_PER_MILLION_TOKENS = float(os.getenv('GEMINI_INPUT_USD_PER_MILLION_TOKENS', '0'))
+GEMINI_OUTPUT_USD_PER_MILLION_TOKENS = float(os.getenv('GEMINI_OUTPUT_USD_PER_MILLION_TOKENS', '0'))
+
+# Seconds; wide enough for both a quality check and a whole upload
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# The pipeline stage code is running in, so LLM calls are attributed to the stage that made them.
+# Like current_request_id, worker threads inherit it through contextvars.copy_context().run.
+current_stage = contextvars.ContextVar('current_stage', default='other')
+# The trace collecting the current request's (or job's) timing breakdown, if any
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing total per label combination."""
+
+    def __init__(self, name: str, help_text: str, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {} # label values -> total
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Observations counted into cumulative buckets per label combination, as Prometheus expects."""
+
+    def __init__(self, name: str, help_text: str, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {} # label values -> {'buckets': [count per bucket], 'sum': float, 'count': int}
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][index] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series['buckets']):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, [('le', _format_value(float(bound)))])} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, [('le', '+Inf')])} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(series['sum'])}")
+                lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {series['count']}")
+        return lines
+
+
+stage_seconds = Histogram('tcgen_stage_duration_seconds', 'Time spent in each pipeline stage; stage="total" is a whole upload or job.', ('stage',))
+llm_call_seconds = Histogram('tcgen_llm_call_duration_seconds', 'Duration of each Gemini call (queueing excluded), by the stage that made it.', ('stage',))
+llm_call_errors = Counter('tcgen_llm_call_errors_total', 'Gemini calls that raised, by the stage that made them.', ('stage',))
+llm_tokens = Counter('tcgen_llm_tokens_total', 'Gemini tokens from response usage metadata, by stage and type (prompt or output).', ('stage', 'type'))
+llm_cost = Counter('tcgen_llm_cost_usd_total', 'Estimated Gemini spend from token counts and the configured per-million-token prices.', ('stage',))
+
+# name -> (help, fn); fn() returns the current value when /metrics is scraped
+_gauges = {}
+
+def register_gauge(name: str, help_text: str, fn):
+    _gauges[name] = (help_text, fn)
+
+
+class Trace:
+    """One request's (or job's) timing breakdown: time and LLM usage per stage.
+
+    Stages that run in parallel workers are summed, so stage seconds can exceed total_seconds.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._stages = {} # stage -> {'count', 'seconds', 'max_seconds'}
+        self._llm = {} # stage -> {'calls', 'failed_calls', 'seconds', 'prompt_tokens', 'output_tokens', 'cost_usd'}
+
+    def add_span(self, stage: str, seconds: float):
+        with self._lock:
+            totals = self._stages.setdefault(stage, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            totals['count'] += 1
+            totals['seconds'] += seconds
+            totals['max_seconds'] = max(totals['max_seconds'], seconds)
+
+    def add_llm_call(self, stage: str, seconds: float, prompt_tokens: int = 0, output_tokens: int = 0, cost_usd: float = 0.0, failed: bool = False):
+        with self._lock:
+            totals = self._llm.setdefault(stage, {'calls': 0, 'failed_calls': 0, 'seconds': 0.0, 'prompt_tokens': 0, 'output_tokens': 0, 'cost_usd': 0.0})
+            totals['calls'] += 1
+            totals['failed_calls'] += int(failed)
+            totals['seconds'] += seconds
+            totals['prompt_tokens'] += prompt_tokens
+            totals['output_tokens'] += output_tokens
+            totals['cost_usd'] += cost_usd
+
+    def summary(self) -> dict:
+        with self._lock:
+            stages = {stage: dict(totals) for stage, totals in sorted(self._stages.items())}
+            by_stage = {stage: dict(totals) for stage, totals in sorted(self._llm.items())}
+        llm = {key: sum(totals[key] for totals in by_stage.values()) for key in ('calls', 'failed_calls', 'seconds', 'prompt_tokens', 'output_tokens', 'cost_usd')}
+        llm['by_stage'] = by_stage
+        return {'total_seconds': time.perf_counter() - self.started, 'stages': stages, 'llm': llm}
+
+@contextmanager
+def trace_scope():
+    """Collects a Trace for everything timed inside the block, including tasks copied from its context."""
+    trace = Trace()
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        current_trace.reset(token)
+        stage_seconds.observe(time.perf_counter() - trace.started, stage='total')
+
+def record_span(stage: str, seconds: float):
+    stage_seconds.observe(seconds, stage=stage)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add_span(stage, seconds)
+
+@contextmanager
+def span(stage: str):
+    """Times the block as one `stage` span. Also usable as a function decorator."""
+    token = current_stage.set(stage)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - started)
+        current_stage.reset(token)
+
+
+class TimedIterator:
+    """Wraps a lazy iterator, timing only the work of producing its items as one `stage` span.
+
+    `exclude` is another TimedIterator this one draws from (a parser feeding a chunker), whose
+    time is subtracted so the two stages are not counted twice. The span is recorded when the
+    iterator is exhausted, or when finish() or close() is called, whichever comes first.
+    """
+
+    def __init__(self, iterable, stage: str, exclude=None):
+        self._iterator = iter(iterable)
+        self.stage = stage
+        self.exclude = exclude
+        self.seconds = 0.0
+        self._finished = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            item = next(self._iterator)
+        except StopIteration:
+            self.seconds += time.perf_counter() - started
+            self.finish()
+            raise
+        self.seconds += time.perf_counter() - started
+        return item
+
+    def close(self):
+        close = getattr(self._iterator, 'close', None)
+        if close is not None:
+            close()
+        self.finish()
+
+    def finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        if self.exclude is not None:
+            self.exclude.finish()
+            self.seconds = max(0.0, self.seconds - self.exclude.seconds)
+        record_span(self.stage, self.seconds)
+
+
+def record_llm_call(seconds: float, usage=None, failed: bool = False):
+    """Records one Gemini call against the current stage. usage is the response's usage_metadata."""
+    stage = current_stage.get()
+    llm_call_seconds.observe(seconds, stage=stage)
+    prompt_tokens = output_tokens = 0
+    if failed:
+        llm_call_errors.inc(stage=stage)
+    elif usage is not None:
+        prompt_tokens = getattr(usage, 'prompt_token_count', 0) or 0
+        # Thinking tokens are billed as output
+        output_tokens = (getattr(usage, 'candidates_token_count', 0) or 0) + (getattr(usage, 'thoughts_token_count', 0) or 0)
+    cost_usd = (prompt_tokens * GEMINI_INPUT_USD_PER_MILLION_TOKENS + output_tokens * GEMINI_OUTPUT_USD_PER_MILLION_TOKENS) / 1e6
+    if prompt_tokens or output_tokens:
+        llm_tokens.inc(prompt_tokens, stage=stage, type='prompt')
+        llm_tokens.inc(output_tokens, stage=stage, type='output')
+        llm_cost.inc(cost_usd, stage=stage)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add_llm_call(stage, seconds, prompt_tokens, output_tokens, cost_usd, failed)
+
+def timed_llm_call(fn):
+    """Wraps a Gemini call so each attempt's duration and token usage are recorded."""
+    def call():
+        started = time.perf_counter()
+        try:
+            response = fn()
+        except Exception:
+            record_llm_call(time.perf_counter() - started, failed=True)
+            raise
+        record_llm_call(time.perf_counter() - started, getattr(response, 'usage_metadata', None))
+        return response
+    return call
+
+def render() -> str:
+    """Every metric in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for metric in (stage_seconds, llm_call_seconds, llm_call_errors, llm_tokens, llm_cost):
+        lines.extend(metric.render())
+    for name, (help_text, fn) in sorted(_gauges.items()):
+        try:
+            value = fn()
+        except Exception as e:
+            print(f"--- METRICS: Could not read {name}: {e} ---")
+            continue
+        lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {_format_value(value)}"])
+    return "\n".join(lines) + "\n"
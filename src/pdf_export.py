@@ -0,0 +1,301 @@
+import io
+import os
+import zlib
+import functools
+from fontTools.ttLib import TTFont
+from fontTools import subset
+
+DEFAULT_PDF_FONT_PATH = os.path.join(os.path.dirname(__file__), '..', 'static', 'fonts', 'DejaVuSans.ttf')
+PDF_FONT_PATH = os.getenv('PDF_FONT_PATH', DEFAULT_PDF_FONT_PATH)
+
+# A4 landscape, in points
+PAGE_WIDTH = 842
+PAGE_HEIGHT = 595
+MARGIN = 28
+FONT_SIZE = 8
+LEADING = 10 # Baseline-to-baseline distance of wrapped lines
+CELL_PADDING = 2
+# Relative column widths of the test case export's columns; scaled to the printable width
+COLUMN_WEIGHTS = [20, 25, 50, 20, 20, 50, 50, 50]
+WORD_CACHE_SIZE = 50000 # Distinct words whose width and glyph encoding are remembered per render
+
+# Object numbers of the document-level objects; page objects follow from FIRST_PAGE_OBJECT
+CATALOG, PAGES, FONT, CID_FONT, FONT_DESCRIPTOR, FONT_FILE, TO_UNICODE = range(1, 8)
+FIRST_PAGE_OBJECT = 8
+
+
+class FontMetrics:
+    """Glyph IDs and advance widths of a TrueType font, read once per process."""
+
+    def __init__(self, path: str):
+        self.path = path
+        font = TTFont(path, lazy=True)
+        scale = 1000 / font['head'].unitsPerEm
+        advances = font['hmtx'].metrics
+        glyph_ids = font.getReverseGlyphMap()
+        # char -> (glyph ID, width in 1/1000 em)
+        self.glyphs = {}
+        for codepoint, glyph_name in font.getBestCmap().items():
+            self.glyphs[chr(codepoint)] = (glyph_ids[glyph_name], round(advances[glyph_name][0] * scale))
+        self.notdef = (0, round(advances[font.getGlyphOrder()[0]][0] * scale))
+        head, hhea = font['head'], font['hhea']
+        self.bbox = [round(v * scale) for v in (head.xMin, head.yMin, head.xMax, head.yMax)]
+        self.ascent = round(hhea.ascent * scale)
+        self.descent = round(hhea.descent * scale)
+        os2 = font['OS/2'] if 'OS/2' in font else None
+        self.cap_height = round(getattr(os2, 'sCapHeight', 0) * scale) if os2 is not None and getattr(os2, 'sCapHeight', 0) else self.ascent
+        self.name = font['name'].getDebugName(6) or 'Font'
+        font.close()
+
+    def subset(self, glyph_ids) -> bytes:
+        """The font reduced to the given glyphs. Glyph IDs are kept, so the page text stays valid."""
+        font = TTFont(self.path)
+        options = subset.Options()
+        options.retain_gids = True
+        options.notdef_outline = True
+        options.hinting = False
+        options.layout_features = []
+        options.drop_tables += ['GSUB', 'GPOS', 'GDEF', 'kern', 'FFTM']
+        subsetter = subset.Subsetter(options)
+        subsetter.populate(gids=sorted(set(glyph_ids) | {0}))
+        subsetter.subset(font)
+        output = io.BytesIO()
+        font.save(output)
+        font.close()
+        return output.getvalue()
+
+@functools.lru_cache(maxsize=None)
+def load_font_metrics(path: str = None) -> FontMetrics:
+    return FontMetrics(path or PDF_FONT_PATH)
+
+
+class TextShaper:
+    """Measures, wraps and encodes text for one render.
+
+    Each distinct word is measured and encoded (as hex glyph IDs for an Identity-H font) once,
+    so wrapping a cell is a few dict lookups per word instead of a layout pass per character.
+    The glyphs used are collected for the font subset and the ToUnicode map.
+    """
+
+    def __init__(self, metrics: FontMetrics, font_size: float):
+        self.metrics = metrics
+        self.scale = font_size / 1000
+        self.used = {} # glyph ID -> the character it was first used for
+        self._words = {}
+        self.space_width, self.space_hex = self.word(' ')
+
+    def word(self, word: str):
+        cached = self._words.get(word)
+        if cached is not None:
+            return cached
+        glyphs = self.metrics.glyphs
+        notdef = self.metrics.notdef
+        width = 0
+        encoded = []
+        for char in word:
+            glyph_id, advance = glyphs.get(char, notdef)
+            width += advance
+            encoded.append(f"{glyph_id:04X}")
+            if glyph_id not in self.used:
+                self.used[glyph_id] = char
+        cached = (width * self.scale, "".join(encoded))
+        if len(self._words) >= WORD_CACHE_SIZE:
+            self._words.clear()
+        self._words[word] = cached
+        return cached
+
+    def _break_word(self, word: str, max_width: float) -> list:
+        """Splits a word wider than the column into pieces that fit."""
+        pieces = []
+        current = ''
+        for char in word:
+            if current and self.word(current + char)[0] > max_width:
+                pieces.append(self.word(current))
+                current = char
+            else:
+                current += char
+        pieces.append(self.word(current))
+        return pieces
+
+    def wrap(self, text: str, max_width: float) -> list:
+        """Greedily wraps text to max_width. Returns the lines as hex-encoded glyph strings."""
+        lines = []
+        for paragraph in text.split('\n'):
+            current = []
+            current_width = 0
+            for word in paragraph.split():
+                width, encoded = self.word(word)
+                if current and current_width + self.space_width + width <= max_width:
+                    current.append(encoded)
+                    current_width += self.space_width + width
+                    continue
+                if current:
+                    lines.append(self.space_hex.join(current))
+                if width <= max_width:
+                    current, current_width = [encoded], width
+                else:
+                    pieces = self._break_word(word, max_width)
+                    lines.extend(encoded for _, encoded in pieces[:-1])
+                    current, current_width = [pieces[-1][1]], pieces[-1][0]
+            lines.append(self.space_hex.join(current))
+        return lines
+
+
+class _PdfWriter:
+    """Tracks byte offsets of numbered objects as the document is written out in order."""
+
+    def __init__(self):
+        self.position = 0
+        self.offsets = {}
+
+    def obj(self, number: int, body: bytes) -> bytes:
+        self.offsets[number] = self.position
+        data = b"%d 0 obj\n" % number + body + b"\nendobj\n"
+        self.position += len(data)
+        return data
+
+    def stream(self, number: int, dictionary: str, data: bytes, compress: bool = True) -> bytes:
+        if compress:
+            data = zlib.compress(data, 6)
+            dictionary += " /Filter /FlateDecode"
+        return self.obj(number, f"<< {dictionary} /Length {len(data)} >>\nstream\n".encode('latin-1') + data + b"\nendstream")
+
+    def raw(self, data: bytes) -> bytes:
+        self.position += len(data)
+        return data
+
+def _to_unicode_cmap(used: dict) -> bytes:
+    lines = [
+        "/CIDInit /ProcSet findresource begin", "12 dict begin", "begincmap",
+        "/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def",
+        "/CMapName /Adobe-Identity-UCS def", "/CMapType 2 def",
+        "1 begincodespacerange", "<0000> <FFFF>", "endcodespacerange"
+    ]
+    entries = sorted(item for item in used.items() if item[0] != 0) # .notdef has no text
+    for start in range(0, len(entries), 100):
+        block = entries[start:start + 100]
+        lines.append(f"{len(block)} beginbfchar")
+        for glyph_id, char in block:
+            utf16 = char.encode('utf-16-be').hex().upper()
+            lines.append(f"<{glyph_id:04X}> <{utf16}>")
+        lines.append("endbfchar")
+    lines += ["endcmap", "CMapName currentdict /CMap defineresource pop", "end", "end"]
+    return "\n".join(lines).encode('ascii')
+
+def _cell_text(value) -> str:
+    return str(value).replace('\r', '').replace('\t', ' ')
+
+def iter_pdf_table(titles: list, rows, font_path: str = None):
+    """Yields a PDF table of the rows (lists of cell values), one page at a time.
+
+    Every cell is wrapped once, with widths from the font's own metrics, and rows taller than
+    the space left on a page continue on the next one (with the header row repeated). Text is
+    set in an embedded Unicode TrueType font, subset to the glyphs used, so requirement text in
+    any script the font covers is kept intact. Pages are compressed and written as soon as they
+    are full; only their offsets are kept, and the font and page tree come last.
+    """
+    metrics = load_font_metrics(font_path)
+    shaper = TextShaper(metrics, FONT_SIZE)
+    printable_width = PAGE_WIDTH - 2 * MARGIN
+    weights = (COLUMN_WEIGHTS + [30] * len(titles))[:len(titles)]
+    column_widths = [printable_width * weight / sum(weights) for weight in weights]
+    column_x = [MARGIN + sum(column_widths[:i]) for i in range(len(titles))]
+    text_widths = [width - 2 * CELL_PADDING for width in column_widths]
+    baseline_offset = CELL_PADDING + FONT_SIZE * metrics.ascent / 1000
+    page_bottom = MARGIN
+
+    header_lines = [shaper.wrap(title, text_widths[i]) for i, title in enumerate(titles)]
+    header_line_count = max(len(lines) for lines in header_lines)
+
+    writer = _PdfWriter()
+    yield writer.raw(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    page_objects = []
+    page = {'ops': [], 'y': 0, 'has_rows': False}
+
+    def draw_row(cell_lines, offset, count, fill=False):
+        height = count * LEADING + 2 * CELL_PADDING
+        top = page['y']
+        ops = page['ops']
+        if fill:
+            ops.append(f"0.9 g {MARGIN:.2f} {top - height:.2f} {printable_width:.2f} {height:.2f} re f 0 g")
+        ops.append("BT /F1 %d Tf" % FONT_SIZE)
+        for i, lines in enumerate(cell_lines):
+            y = top - baseline_offset
+            for line in lines[offset:offset + count]:
+                if line:
+                    ops.append(f"1 0 0 1 {column_x[i] + CELL_PADDING:.2f} {y:.2f} Tm <{line}> Tj")
+                y -= LEADING
+        ops.append("ET")
+        for i, width in enumerate(column_widths):
+            ops.append(f"{column_x[i]:.2f} {top - height:.2f} {width:.2f} {height:.2f} re")
+        ops.append("S")
+        page['y'] = top - height
+
+    def start_page():
+        page['ops'] = ["0.5 w"]
+        page['y'] = PAGE_HEIGHT - MARGIN
+        page['has_rows'] = False
+        draw_row(header_lines, 0, header_line_count, fill=True)
+
+    def finish_page():
+        content_number = FIRST_PAGE_OBJECT + 2 * len(page_objects)
+        page_number = content_number + 1
+        page_objects.append(page_number)
+        content = writer.stream(content_number, "", "\n".join(page['ops']).encode('latin-1'))
+        page_object = writer.obj(page_number, (
+            f"<< /Type /Page /Parent {PAGES} 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}]"
+            f" /Resources << /Font << /F1 {FONT} 0 R >> >> /Contents {content_number} 0 R >>"
+        ).encode('latin-1'))
+        return content + page_object
+
+    start_page()
+    full_page_lines = int((page['y'] - page_bottom - 2 * CELL_PADDING) // LEADING)
+    for row in rows:
+        cell_lines = [shaper.wrap(_cell_text(value), text_widths[i]) for i, value in enumerate(row)]
+        line_count = max(len(lines) for lines in cell_lines)
+        offset = 0
+        while offset < line_count:
+            capacity = int((page['y'] - page_bottom - 2 * CELL_PADDING) // LEADING)
+            remaining = line_count - offset
+            # Move a row that would fit on a fresh page instead of splitting it; split only taller rows
+            if capacity <= 0 or (capacity < remaining and page['has_rows'] and remaining <= full_page_lines):
+                yield finish_page()
+                start_page()
+                continue
+            count = min(capacity, remaining)
+            draw_row(cell_lines, offset, count)
+            page['has_rows'] = True
+            offset += count
+    yield finish_page()
+
+    # The font goes last: only now is it known which glyphs to embed
+    font_name = "AAAAAA+" + "".join(ch for ch in metrics.name if ch.isalnum() or ch == '-')
+    widths = " ".join(f"{glyph_id} [{metrics.glyphs.get(char, metrics.notdef)[1]}]" for glyph_id, char in sorted(shaper.used.items()))
+    yield writer.obj(FONT, (
+        f"<< /Type /Font /Subtype /Type0 /BaseFont /{font_name} /Encoding /Identity-H"
+        f" /DescendantFonts [{CID_FONT} 0 R] /ToUnicode {TO_UNICODE} 0 R >>"
+    ).encode('latin-1'))
+    yield writer.obj(CID_FONT, (
+        f"<< /Type /Font /Subtype /CIDFontType2 /BaseFont /{font_name}"
+        f" /CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >>"
+        f" /FontDescriptor {FONT_DESCRIPTOR} 0 R /DW {metrics.notdef[1]} /W [{widths}] /CIDToGIDMap /Identity >>"
+    ).encode('latin-1'))
+    yield writer.obj(FONT_DESCRIPTOR, (
+        f"<< /Type /FontDescriptor /FontName /{font_name} /Flags 32 /FontBBox [{' '.join(map(str, metrics.bbox))}]"
+        f" /ItalicAngle 0 /Ascent {metrics.ascent} /Descent {metrics.descent} /CapHeight {metrics.cap_height}"
+        f" /StemV 80 /FontFile2 {FONT_FILE} 0 R >>"
+    ).encode('latin-1'))
+    font_data = metrics.subset(shaper.used)
+    yield writer.stream(FONT_FILE, f"/Length1 {len(font_data)}", font_data)
+    yield writer.stream(TO_UNICODE, "", _to_unicode_cmap(shaper.used))
+
+    kids = " ".join(f"{number} 0 R" for number in page_objects)
+    yield writer.obj(PAGES, f"<< /Type /Pages /Kids [{kids}] /Count {len(page_objects)} >>".encode('latin-1'))
+    yield writer.obj(CATALOG, f"<< /Type /Catalog /Pages {PAGES} 0 R >>".encode('latin-1'))
+
+    object_count = FIRST_PAGE_OBJECT + 2 * len(page_objects)
+    xref_position = writer.position
+    xref = [f"xref\n0 {object_count}\n", "0000000000 65535 f \n"]
+    xref.extend(f"{writer.offsets[number]:010d} 00000 n \n" for number in range(1, object_count))
+    xref.append(f"trailer\n<< /Size {object_count} /Root {CATALOG} 0 R >>\nstartxref\n{xref_position}\n%%EOF\n")
+    yield writer.raw("".join(xref).encode('latin-1'))
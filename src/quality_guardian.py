@@ -1,9 +1,14 @@
 
+import os
 import json
 import re
 
 # Import the new, single gemini_model instance from test_generator
-from test_generator import gemini_model
+from test_generator import gemini_model, call_model
+from metrics import span
+
+# How many test cases share one LLM review call; 1 restores the per-case path
+QUALITY_BATCH_SIZE = int(os.getenv('QUALITY_BATCH_SIZE', '10'))
 
 # A set of all the keys we expect to be in a valid test case object
 EXPECTED_KEYS = {
@@ -17,6 +22,7 @@ EXPECTED_KEYS = {
     "rtm_compliance_mapping"
 }
 
+@span('quality.structure')
 def validate_structure(test_case: dict) -> tuple[bool, str]:
     """Checks if the test case dictionary has the correct structure and all required keys."""
     missing_keys = EXPECTED_KEYS - set(test_case.keys())
@@ -28,14 +34,28 @@ def validate_structure(test_case: dict) -> tuple[bool, str]:
 
     return True, "Structure is valid."
 
+def format_test_case_for_review(test_case: dict) -> str:
+    """Renders the fields a reviewer needs to judge a test case."""
+    steps = "\n".join(f"  {i+1}. {step}" for i, step in enumerate(test_case.get('steps', [])))
+    return (
+        f"Test Case ID: {test_case.get('test_case_id', 'N/A')}\n"
+        f"Description: {test_case.get('description', 'N/A')}\n"
+        f"Steps:\n{steps}\n"
+        f"Expected Result: {test_case.get('expected_result', 'N/A')}\n"
+        f"Compliance Rule Mapping: {test_case.get('rtm_compliance_mapping', 'N/A')}"
+    )
+
+@span('quality.plausibility')
 def critique_plausibility(test_case: dict) -> tuple[bool, str]:
     """Uses a live AI call to check if the test case is logically plausible."""
     if not gemini_model:
         return True, "Plausibility check skipped: Vertex AI model not initialized."
 
-    prompt = f"""As a QA Reviewer, analyze the following test case. Are the steps clear, logical, and easy to follow? Does the expected result directly test the objective in the description? Based on your analysis, is this a plausible and well-formed test case? Answer with only the word "Yes" or "No", followed by a brief one-sentence justification."""
+    prompt = f"""As a QA Reviewer, analyze the following test case. Are the steps clear, logical, and easy to follow? Does the expected result directly test the objective in the description? Based on your analysis, is this a plausible and well-formed test case? Answer with only the word "Yes" or "No", followed by a brief one-sentence justification.
+
+    {format_test_case_for_review(test_case)}"""
     try:
-        response = gemini_model.generate_content(prompt)
+        response = call_model(prompt)
         critique = response.text.strip()
         if critique.lower().startswith('yes'):
             return True, critique
@@ -45,6 +65,7 @@ def critique_plausibility(test_case: dict) -> tuple[bool, str]:
         print(f"  -> Plausibility check failed with error: {e}")
         return True, f"Plausibility check could not be performed due to an error: {e}" # Default to passing if the check fails
 
+@span('quality.rtm')
 def validate_rtm_link(test_case: dict) -> tuple[bool, str]:
     """Uses a live AI call to validate the link between the test case and the compliance rule."""
     if not gemini_model:
@@ -52,7 +73,7 @@ def validate_rtm_link(test_case: dict) -> tuple[bool, str]:
 
     prompt = f"""As a Compliance Auditor, analyze the following link between a test case and a compliance rule. Test Case Description: "{test_case.get('description')}". Compliance Rule Mapping: "{test_case.get('rtm_compliance_mapping')}". Is there a clear and logical connection between this test case and this compliance rule? Answer with only the word "Yes" or "No", followed by a brief one-sentence justification."""
     try:
-        response = gemini_model.generate_content(prompt)
+        response = call_model(prompt)
         validation_notes = response.text.strip()
         if validation_notes.lower().startswith('yes'):
             return True, validation_notes
@@ -62,8 +83,86 @@ def validate_rtm_link(test_case: dict) -> tuple[bool, str]:
         print(f"  -> RTM validation failed with error: {e}")
         return True, f"RTM validation could not be performed due to an error: {e}" # Default to passing if the check fails
 
-def run_quality_checks(test_cases: list) -> list:
-    """Runs all quality checks on a list of test cases and adds quality metadata."""
+def parse_batch_verdicts(text: str) -> dict:
+    """Parses the batched review JSON into {test_case_id: verdict}, dropping malformed entries."""
+    start_index = text.find('[')
+    end_index = text.rfind(']') + 1
+    if start_index == -1 or end_index == 0:
+        return {}
+    try:
+        items = json.loads(text[start_index:end_index])
+    except json.JSONDecodeError:
+        return {}
+
+    verdicts = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        tc_id = str(item.get('test_case_id', '')).strip()
+        plausibility = item.get('plausibility')
+        rtm = item.get('rtm')
+        if tc_id and isinstance(plausibility, str) and isinstance(rtm, str):
+            verdicts[tc_id] = {'plausibility': plausibility.strip(), 'rtm': rtm.strip()}
+    return verdicts
+
+@span('quality.review')
+def review_batch(test_cases: list) -> dict:
+    """Runs the plausibility and RTM checks for several test cases in a single AI call.
+
+    Returns {test_case_id: (plausibility_ok, plausibility_notes, rtm_ok, rtm_notes)} for every
+    case whose verdict could be parsed. Cases missing from the result need the per-case checks.
+    """
+    # Duplicate IDs make verdicts unattributable, so those cases are left for the per-case path
+    id_counts = {}
+    for tc in test_cases:
+        tc_id = str(tc.get('test_case_id', '')).strip()
+        id_counts[tc_id] = id_counts.get(tc_id, 0) + 1
+    reviewable = [tc for tc in test_cases if str(tc.get('test_case_id', '')).strip() and id_counts[str(tc.get('test_case_id', '')).strip()] == 1]
+    if not reviewable:
+        return {}
+
+    cases_text = "\n\n".join(format_test_case_for_review(tc) for tc in reviewable)
+    prompt = f"""You are both a QA Reviewer and a Compliance Auditor. For EACH test case below, answer two questions:
+    1. plausibility: Are the steps clear, logical, and easy to follow, and does the expected result directly test the objective in the description?
+    2. rtm: Is there a clear and logical connection between the test case description and its compliance rule mapping?
+
+    **Test Cases:**
+    {cases_text}
+
+    **FORMAT:**
+    Return a JSON array with exactly one object per test case, using its Test Case ID:
+    [
+        {{"test_case_id": "TC-001", "plausibility": "Yes - <one-sentence justification>", "rtm": "No - <one-sentence justification>"}}
+    ]
+
+    **INSTRUCTIONS:**
+    - Each answer MUST start with the word "Yes" or "No".
+    - Do NOT return any text outside the JSON array.
+    """
+    response = call_model(prompt)
+    verdicts = parse_batch_verdicts(response.text)
+
+    results = {}
+    for tc in reviewable:
+        tc_id = str(tc.get('test_case_id', '')).strip()
+        verdict = verdicts.get(tc_id)
+        if verdict:
+            results[tc_id] = (
+                verdict['plausibility'].lower().startswith('yes'), verdict['plausibility'],
+                verdict['rtm'].lower().startswith('yes'), verdict['rtm']
+            )
+    return results
+
+@span('quality')
+def run_quality_checks(test_cases: list, batch_size: int = None) -> list:
+    """Runs all quality checks on a list of test cases and adds quality metadata.
+
+    Plausibility and RTM checks are sent `batch_size` cases per AI call. Any case whose batched
+    verdict is missing or unparseable falls back to the individual checks.
+    """
+    batch_size = QUALITY_BATCH_SIZE if batch_size is None else batch_size
+
+    structurally_valid = []
     for tc in test_cases:
         tc['quality_assessment'] = {'passed': True, 'checks': []}
 
@@ -72,15 +171,44 @@ def run_quality_checks(test_cases: list) -> list:
         if not struct_ok:
             tc['quality_assessment']['passed'] = False
             continue # If structure is invalid, no point in running further checks
+        structurally_valid.append(tc)
+
+    # Verdicts are keyed by the case object: IDs such as TC-001 often repeat across chunks, and a
+    # later batch's verdict must not overwrite an earlier case's
+    batched_results = {}
+    if gemini_model and batch_size > 1:
+        for start in range(0, len(structurally_valid), batch_size):
+            batch = structurally_valid[start:start + batch_size]
+            try:
+                verdicts = review_batch(batch)
+            except Exception as e:
+                print(f"  -> Batched quality review failed, falling back to per-case checks: {e}")
+                continue
+            for tc in batch:
+                # review_batch leaves out IDs repeated within the batch, so a verdict's ID is unique here
+                result = verdicts.get(str(tc.get('test_case_id', '')).strip())
+                if result:
+                    batched_results[id(tc)] = result
+
+    fallback_count = 0
+    for tc in structurally_valid:
+        result = batched_results.get(id(tc))
+        if result:
+            plausibility_ok, plausibility_notes, rtm_ok, rtm_notes = result
+        else:
+            fallback_count += 1
+            plausibility_ok, plausibility_notes = critique_plausibility(tc)
+            rtm_ok, rtm_notes = validate_rtm_link(tc)
 
-        plausibility_ok, plausibility_notes = critique_plausibility(tc)
         tc['quality_assessment']['checks'].append({'check': 'Plausibility', 'passed': plausibility_ok, 'notes': plausibility_notes})
         if not plausibility_ok:
             tc['quality_assessment']['passed'] = False
 
-        rtm_ok, rtm_notes = validate_rtm_link(tc)
         tc['quality_assessment']['checks'].append({'check': 'RTM Validation', 'passed': rtm_ok, 'notes': rtm_notes})
         if not rtm_ok:
             tc['quality_assessment']['passed'] = False
 
+    if gemini_model and batch_size > 1 and fallback_count:
+        print(f"  -> {fallback_count}/{len(structurally_valid)} test cases used per-case quality checks.")
+
     return test_cases
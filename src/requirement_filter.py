@@ -0,0 +1,45 @@
+import os
+import re
+
+# Chunks scoring below this are not sent to Gemini (set REQUIREMENT_FILTER_ENABLED=false to send everything)
+REQUIREMENT_FILTER_ENABLED = os.getenv('REQUIREMENT_FILTER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+REQUIREMENT_MIN_SCORE = float(os.getenv('REQUIREMENT_MIN_SCORE', '2'))
+
+# Signals that a chunk states something testable
+REQUIREMENT_ID_PATTERN = re.compile(r"\b(?:REQ|FR|NFR|SR|UR|BR|SYS|SRS|US)[-_ .]?\d+", re.IGNORECASE)
+MODAL_PATTERN = re.compile(r"\b(?:shall|must|should|is required to|are required to|needs? to|will be able to)\b", re.IGNORECASE)
+USER_STORY_PATTERN = re.compile(r"\bas an? [^,.\n]{1,60},? I (?:want|need|can)\b", re.IGNORECASE)
+ACCEPTANCE_PATTERN = re.compile(r"\b(?:acceptance criteria|given\b.{1,200}?\bwhen\b.{1,200}?\bthen)\b", re.IGNORECASE | re.DOTALL)
+NUMBERED_CLAUSE_PATTERN = re.compile(r"^\s*(?:\d+\.){1,4}\d*\s+\S.*[a-z].*[.;:]\s*$", re.MULTILINE)
+
+# Signals that a chunk is front or back matter
+TOC_LINE_PATTERN = re.compile(r"^.{0,120}?(?:\.{4,}|\s{4,}|\t)\s*\d{1,4}\s*$", re.MULTILINE)
+BOILERPLATE_PATTERN = re.compile(
+    r"\b(?:table of contents|revision history|document history|change log|glossary|definitions and acronyms"
+    r"|copyright|all rights reserved|confidential|proprietary|disclaimer|trademark)\b", re.IGNORECASE)
+NON_BLANK_LINE_PATTERN = re.compile(r"^\s*\S", re.MULTILINE)
+
+def requirement_score(text: str) -> float:
+    """Scores how likely a chunk is to contain actionable requirements, from lexical signals only.
+
+    Requirement IDs, user stories and acceptance criteria count most, then modal verbs and
+    numbered clauses. Table-of-contents lines and boilerplate terms count against the chunk.
+    """
+    requirement_ids = len(REQUIREMENT_ID_PATTERN.findall(text))
+    modals = len(MODAL_PATTERN.findall(text))
+    stories = len(USER_STORY_PATTERN.findall(text)) + len(ACCEPTANCE_PATTERN.findall(text))
+    clauses = len(NUMBERED_CLAUSE_PATTERN.findall(text))
+    score = 3 * min(requirement_ids, 5) + 3 * min(stories, 5) + 2 * min(modals, 10) + 0.5 * min(clauses, 10)
+
+    lines = len(NON_BLANK_LINE_PATTERN.findall(text)) or 1
+    toc_ratio = len(TOC_LINE_PATTERN.findall(text)) / lines
+    boilerplate = len(BOILERPLATE_PATTERN.findall(text))
+    # A chunk that is mostly a table of contents mentions every requirement heading without stating any
+    score *= 1 - min(toc_ratio, 1)
+    return score - 0.5 * min(boilerplate, 4)
+
+def is_requirement_chunk(text: str) -> bool:
+    """Returns False for chunks (contents pages, revision tables, glossaries, legal notices) not worth an LLM call."""
+    if not REQUIREMENT_FILTER_ENABLED:
+        return True
+    return requirement_score(text) >= REQUIREMENT_MIN_SCORE
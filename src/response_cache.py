@@ -0,0 +1,133 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+# Default location sits next to serviceAccountKey.json so it survives container restarts
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(__file__), '..', 'config', 'llm_cache.sqlite3')
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024 # 256 MB of cached responses
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60 # One week
+
+class ResponseCache:
+    """A content-addressed, SQLite-backed cache for LLM responses with TTL and LRU eviction."""
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES, ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # One shared connection guarded by a lock; waitress serves requests from several threads
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """Builds a stable hash from the given parts (e.g. model name, prompt version, input text)."""
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(str(part).encode('utf-8'))
+            digest.update(b'\x00') # Separator so ('ab', 'c') and ('a', 'bc') hash differently
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        """Returns the cached value for key, or None on a miss or an expired entry."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, created_at = row
+            if self.ttl_seconds and now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self.misses += 1
+                self.evictions += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: str):
+        """Stores a value and evicts expired and least-recently-used entries to stay within max_bytes."""
+        now = time.time()
+        size = len(value.encode('utf-8'))
+        if self.max_bytes and size > self.max_bytes:
+            return # Never cache something that would evict the whole cache
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        if self.ttl_seconds:
+            cursor = self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+            self.evictions += max(cursor.rowcount, 0)
+        if not self.max_bytes:
+            return
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC").fetchall():
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.evictions += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        """Returns hit/miss counters and current size for monitoring."""
+        with self._lock:
+            entries, total_bytes = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': (self.hits / lookups) if lookups else 0.0,
+            'entries': entries,
+            'bytes': total_bytes,
+            'max_bytes': self.max_bytes
+        }
+
+
+def create_response_cache():
+    """Creates the process-wide cache from environment settings, or returns None if disabled."""
+    if os.getenv('LLM_CACHE_ENABLED', 'true').lower() in ('0', 'false', 'no'):
+        print("--- LLM response cache disabled via LLM_CACHE_ENABLED. ---")
+        return None
+    try:
+        cache = ResponseCache(
+            path=os.getenv('LLM_CACHE_PATH', DEFAULT_CACHE_PATH),
+            max_bytes=int(os.getenv('LLM_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)),
+            ttl_seconds=int(os.getenv('LLM_CACHE_TTL_SECONDS', DEFAULT_TTL_SECONDS))
+        )
+        print(f"--- LLM response cache ready at {cache.path} ---")
+        return cache
+    except Exception as e:
+        print(f"Error initializing LLM response cache, continuing without it: {e}")
+        return None
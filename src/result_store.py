@@ -0,0 +1,341 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+DEFAULT_RESULT_STORE_PATH = os.path.join(os.path.dirname(__file__), '..', 'config', 'results.sqlite3')
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60 # A week after the last edit
+DEFAULT_MAX_VERSIONS = 20 # Edit history kept per result
+# Bump when an export renderer changes, so cached files and browser ETags are invalidated
+EXPORT_FORMAT_VERSION = 3
+# Interrupted export renders leave parts behind; they are removed once they are this old
+ABANDONED_EXPORT_SECONDS = 60 * 60
+
+def assign_case_uids(test_cases: list) -> list:
+    """Gives every test case a stable 'case_uid' that edits keep, unlike the model's test_case_id
+    (often repeated across chunks) or its content. A missing or repeated case_uid gets a new one."""
+    seen = set()
+    for tc in test_cases:
+        case_uid = tc.get('case_uid')
+        if not isinstance(case_uid, str) or not case_uid or case_uid in seen:
+            case_uid = tc['case_uid'] = os.urandom(8).hex()
+        seen.add(case_uid)
+    return test_cases
+
+class ResultVersionConflict(Exception):
+    """Raised when an edit is based on a version that is no longer the latest."""
+
+    def __init__(self, latest_version):
+        super().__init__(f"The test cases were changed since version {latest_version - 1}; reload version {latest_version} and try again.")
+        self.latest_version = latest_version
+
+
+class ResultStore:
+    """Generated suites and ambiguity reports, stored server-side under a result ID.
+
+    The browser keeps only the result ID, so downloads, edits and Jira exports no longer post
+    the whole suite back. Every AI edit adds a version; old versions stay readable until they
+    fall out of the last max_versions. Rendered export files are cached per (result, version,
+    format) as a sequence of parts, so they are written and served chunk by chunk without ever
+    being held whole. The ETag is derived from the result, version and format alone, so a
+    revalidation is answered without loading or rendering anything. The Jira and Zephyr Scale
+    keys of exported test cases are kept per result, so re-exports sync instead of duplicating.
+    Results expire ttl_seconds after their last change (an export sync counts as one).
+    """
+
+    def __init__(self, path: str, ttl_seconds: int = DEFAULT_TTL_SECONDS, max_versions: int = DEFAULT_MAX_VERSIONS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_versions = max_versions
+        self.export_hits = 0
+        self.export_misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " result_id TEXT PRIMARY KEY,"
+            " user_id TEXT NOT NULL,"
+            " latest_version INTEGER NOT NULL,"
+            " ambiguity_report TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS result_versions ("
+            " result_id TEXT NOT NULL,"
+            " version INTEGER NOT NULL,"
+            " test_cases TEXT NOT NULL,"
+            " test_case_count INTEGER NOT NULL,"
+            " note TEXT,"
+            " created_at REAL NOT NULL,"
+            " PRIMARY KEY (result_id, version))"
+        )
+        # A finished render; its parts are stored under a per-render token, so two requests
+        # rendering the same export at once never interleave their parts
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS export_files ("
+            " result_id TEXT NOT NULL,"
+            " version INTEGER NOT NULL,"
+            " format TEXT NOT NULL,"
+            " render_id TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " parts INTEGER NOT NULL,"
+            " PRIMARY KEY (result_id, version, format))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS export_parts ("
+            " render_id TEXT NOT NULL,"
+            " seq INTEGER NOT NULL,"
+            " content BLOB NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " PRIMARY KEY (render_id, seq))"
+        )
+        # Jira/Zephyr Scale keys of a result's test cases from earlier exports, per Jira target, so a
+        # repeat export updates them instead of creating duplicates. A row without an issue_key is a
+        # create that was sent but not yet confirmed
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS alm_links ("
+            " result_id TEXT NOT NULL,"
+            " target TEXT NOT NULL,"
+            " ref TEXT NOT NULL,"
+            " fingerprint TEXT NOT NULL,"
+            " issue_key TEXT,"
+            " zephyr_key TEXT,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (result_id, target, ref))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_user ON results (user_id, updated_at)")
+        self._conn.commit()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+            self._conn.commit()
+            return rows
+
+    def create(self, user_id: str, test_cases: list, ambiguity_report: list = None) -> dict:
+        """Stores a newly generated suite as version 1 of a new result. Returns its result_id and version.
+
+        Each test case is given its case_uid in place, so the caller's suite carries it too.
+        """
+        assign_case_uids(test_cases)
+        result_id = os.urandom(12).hex()
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            self._conn.execute(
+                "INSERT INTO results (result_id, user_id, latest_version, ambiguity_report, created_at, updated_at) VALUES (?, ?, 1, ?, ?, ?)",
+                (result_id, user_id, json.dumps(ambiguity_report or []), now, now)
+            )
+            self._conn.execute(
+                "INSERT INTO result_versions (result_id, version, test_cases, test_case_count, note, created_at) VALUES (?, 1, ?, ?, ?, ?)",
+                (result_id, json.dumps(test_cases), len(test_cases), 'generated', now)
+            )
+            self._conn.commit()
+        return {'result_id': result_id, 'version': 1}
+
+    def resolve_version(self, result_id: str, user_id: str, version: int = None):
+        """Returns the stored version number a request refers to (the latest if version is None), or None."""
+        rows = self._execute(
+            "SELECT v.version FROM results r JOIN result_versions v"
+            " ON v.result_id = r.result_id AND v.version = COALESCE(?, r.latest_version)"
+            " WHERE r.result_id = ? AND r.user_id = ?",
+            (version, result_id, user_id)
+        )
+        return rows[0][0] if rows else None
+
+    def get(self, result_id: str, user_id: str, version: int = None):
+        """Returns the result's suite at a version (default: latest), or None if it is not the user's or has expired."""
+        rows = self._execute(
+            "SELECT r.latest_version, v.version, v.test_cases, r.ambiguity_report FROM results r JOIN result_versions v"
+            " ON v.result_id = r.result_id AND v.version = COALESCE(?, r.latest_version)"
+            " WHERE r.result_id = ? AND r.user_id = ?",
+            (version, result_id, user_id)
+        )
+        if not rows:
+            return None
+        latest_version, found_version, test_cases_json, ambiguity_json = rows[0]
+        return {
+            'result_id': result_id,
+            'version': found_version,
+            'latest_version': latest_version,
+            'test_cases': json.loads(test_cases_json),
+            'ambiguity_report': json.loads(ambiguity_json or '[]')
+        }
+
+    def get_ambiguity_report(self, result_id: str, user_id: str):
+        rows = self._execute("SELECT ambiguity_report FROM results WHERE result_id = ? AND user_id = ?", (result_id, user_id))
+        return json.loads(rows[0][0] or '[]') if rows else None
+
+    def latest_result_id(self, user_id: str):
+        """The user's most recently changed result, for clients that did not send a result ID."""
+        rows = self._execute("SELECT result_id FROM results WHERE user_id = ? ORDER BY updated_at DESC LIMIT 1", (user_id,))
+        return rows[0][0] if rows else None
+
+    def versions(self, result_id: str, user_id: str) -> list:
+        rows = self._execute(
+            "SELECT v.version, v.test_case_count, v.note, v.created_at FROM result_versions v"
+            " JOIN results r ON r.result_id = v.result_id WHERE v.result_id = ? AND r.user_id = ? ORDER BY v.version",
+            (result_id, user_id)
+        )
+        return [{'version': version, 'test_case_count': count, 'note': note, 'created_at': created_at} for version, count, note, created_at in rows]
+
+    def add_version(self, result_id: str, user_id: str, test_cases: list, base_version: int = None, note: str = None):
+        """Stores an edited suite as the result's next version and returns the new version number.
+
+        Returns None if the result is not the user's. Raises ResultVersionConflict if base_version
+        is given and another edit has landed since, so concurrent edits are never silently lost.
+        Cases added by the edit get a case_uid; edited cases keep theirs.
+        """
+        assign_case_uids(test_cases)
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute("SELECT latest_version FROM results WHERE result_id = ? AND user_id = ?", (result_id, user_id)).fetchall()
+            if not rows:
+                return None
+            latest_version = rows[0][0]
+            if base_version is not None and base_version != latest_version:
+                raise ResultVersionConflict(latest_version)
+            version = latest_version + 1
+            try:
+                self._conn.execute(
+                    "INSERT INTO result_versions (result_id, version, test_cases, test_case_count, note, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (result_id, version, json.dumps(test_cases), len(test_cases), note, now)
+                )
+            except sqlite3.IntegrityError:
+                # Another server process stored this version first
+                self._conn.rollback()
+                raise ResultVersionConflict(version)
+            self._conn.execute("UPDATE results SET latest_version = ?, updated_at = ? WHERE result_id = ?", (version, now, result_id))
+            if self.max_versions:
+                self._conn.execute("DELETE FROM result_versions WHERE result_id = ? AND version <= ?", (result_id, version - self.max_versions))
+                self._delete_exports("result_id = ? AND version <= ?", (result_id, version - self.max_versions))
+            self._conn.commit()
+        return version
+
+    def alm_links(self, result_id: str, target: str) -> dict:
+        """The keys stored by earlier exports of a result to a target, as {ref: {'fingerprint', 'issue_key', 'zephyr_key'}}."""
+        rows = self._execute("SELECT ref, fingerprint, issue_key, zephyr_key FROM alm_links WHERE result_id = ? AND target = ?", (result_id, target))
+        return {ref: {'fingerprint': fingerprint, 'issue_key': issue_key, 'zephyr_key': zephyr_key} for ref, fingerprint, issue_key, zephyr_key in rows}
+
+    def save_alm_links(self, result_id: str, target: str, links: dict):
+        """Stores {ref: link} for a result and target. A sync counts as a change, so it keeps the result from expiring."""
+        if not links:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO alm_links (result_id, target, ref, fingerprint, issue_key, zephyr_key, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(result_id, target, ref, link['fingerprint'], link.get('issue_key'), link.get('zephyr_key'), now) for ref, link in links.items()]
+            )
+            self._conn.execute("UPDATE results SET updated_at = ? WHERE result_id = ?", (now, result_id))
+            self._conn.commit()
+
+    def export_etag(self, result_id: str, version: int, format: str) -> str:
+        """A strong ETag for a rendered export. Versions are immutable, so no content hash is needed."""
+        return hashlib.sha256(f"{result_id}:{version}:{format}:{EXPORT_FORMAT_VERSION}".encode('utf-8')).hexdigest()[:32]
+
+    def open_export(self, result_id: str, version: int, format: str):
+        """Returns (size in bytes, chunk iterator) for a cached export, or None if it has not been rendered.
+
+        An export missing some of its parts is dropped and reported as not rendered, so the caller
+        renders it again instead of sending a Content-Length the parts cannot fill.
+        """
+        rows = self._execute("SELECT render_id, size, parts FROM export_files WHERE result_id = ? AND version = ? AND format = ?", (result_id, version, format))
+        if rows:
+            render_id, size, parts = rows[0]
+            stored = self._execute("SELECT COUNT(*) FROM export_parts WHERE render_id = ?", (render_id,))[0][0]
+            if stored != parts:
+                print(f"--- RESULT STORE: Cached {format} export of {result_id} v{version} has {stored} of {parts} parts; rendering it again. ---")
+                with self._lock:
+                    self._delete_exports("render_id = ?", (render_id,))
+                    self._conn.commit()
+                rows = []
+        with self._lock:
+            if rows:
+                self.export_hits += 1
+            else:
+                self.export_misses += 1
+        if not rows:
+            return None
+        return size, self._iter_parts(render_id, parts)
+
+    def _iter_parts(self, render_id, parts):
+        for seq in range(parts):
+            rows = self._execute("SELECT content FROM export_parts WHERE render_id = ? AND seq = ?", (render_id, seq))
+            if not rows:
+                # Pruned mid-download; failing the response lets the client see the file is incomplete
+                raise RuntimeError(f"Export part {seq} of {parts} is no longer stored.")
+            yield bytes(rows[0][0])
+
+    def cache_export(self, result_id: str, version: int, format: str, chunks):
+        """Passes an export's chunks through, storing each one as it goes by.
+
+        The export is only recorded once the last chunk has been stored, so a download the
+        client abandons half way is never served from the cache.
+        """
+        render_id = os.urandom(12).hex()
+        size = 0
+        seq = 0
+        for chunk in chunks:
+            self._execute("INSERT INTO export_parts (render_id, seq, content, created_at) VALUES (?, ?, ?, ?)", (render_id, seq, chunk, time.time()))
+            seq += 1
+            size += len(chunk)
+            yield chunk
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO export_files (result_id, version, format, render_id, size, parts) VALUES (?, ?, ?, ?, ?, ?)",
+                (result_id, version, format, render_id, size, seq)
+            )
+            if cursor.rowcount == 0:
+                # Another request finished rendering the same export first
+                self._conn.execute("DELETE FROM export_parts WHERE render_id = ?", (render_id,))
+            self._conn.commit()
+
+    def _delete_exports(self, where, params):
+        self._conn.execute(f"DELETE FROM export_parts WHERE render_id IN (SELECT render_id FROM export_files WHERE {where})", params)
+        self._conn.execute(f"DELETE FROM export_files WHERE {where}", params)
+
+    def _prune(self, now):
+        self._conn.execute(
+            "DELETE FROM export_parts WHERE created_at < ? AND render_id NOT IN (SELECT render_id FROM export_files)",
+            (now - ABANDONED_EXPORT_SECONDS,)
+        )
+        if not self.ttl_seconds:
+            return
+        expired = "SELECT result_id FROM results WHERE updated_at < ?"
+        cutoff = now - self.ttl_seconds
+        self._delete_exports(f"result_id IN ({expired})", (cutoff,))
+        self._conn.execute(f"DELETE FROM result_versions WHERE result_id IN ({expired})", (cutoff,))
+        self._conn.execute(f"DELETE FROM alm_links WHERE result_id IN ({expired})", (cutoff,))
+        self._conn.execute("DELETE FROM results WHERE updated_at < ?", (cutoff,))
+
+    def stats(self) -> dict:
+        results, versions, export_bytes, alm_links = self._execute(
+            "SELECT (SELECT COUNT(*) FROM results), (SELECT COUNT(*) FROM result_versions),"
+            " (SELECT COALESCE(SUM(size), 0) FROM export_files), (SELECT COUNT(*) FROM alm_links)"
+        )[0]
+        lookups = self.export_hits + self.export_misses
+        return {
+            'results': results,
+            'versions': versions,
+            'alm_links': alm_links,
+            'export_cache_bytes': export_bytes,
+            'export_cache_hits': self.export_hits,
+            'export_cache_misses': self.export_misses,
+            'export_cache_hit_rate': (self.export_hits / lookups) if lookups else 0.0
+        }
+
+def create_result_store():
+    """Creates the result store from environment settings."""
+    store = ResultStore(
+        os.getenv('RESULT_STORE_PATH', DEFAULT_RESULT_STORE_PATH),
+        ttl_seconds=int(os.getenv('RESULT_TTL_SECONDS', DEFAULT_TTL_SECONDS)),
+        max_versions=int(os.getenv('RESULT_MAX_VERSIONS', DEFAULT_MAX_VERSIONS))
+    )
+    print(f"--- Result store ready at {store.path} ---")
+    return store
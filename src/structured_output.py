@@ -0,0 +1,82 @@
+from test_case_model import TestCase
+
+# Response schemas for Gemini's structured output mode (response_mime_type='application/json').
+# The model's output is constrained to these shapes, so it can always be decoded with json.loads.
+TEST_CASE_SCHEMA = {
+    'type': 'array',
+    'items': {
+        'type': 'object',
+        'properties': {
+            'test_case_id': {'type': 'string'},
+            'requirement_id': {'type': 'string'},
+            'description': {'type': 'string'},
+            'test_type': {'type': 'string'},
+            'priority': {'type': 'string', 'enum': ['High', 'Medium', 'Low']},
+            'steps': {'type': 'array', 'items': {'type': 'string'}},
+            'expected_result': {'type': 'string'},
+            'rtm_compliance_mapping': {'type': 'string'},
+            'confidence_score': {'type': 'string'}
+        },
+        'required': ['test_case_id', 'requirement_id', 'description', 'test_type', 'priority', 'steps',
+                     'expected_result', 'rtm_compliance_mapping', 'confidence_score']
+    }
+}
+
+AMBIGUITY_SCHEMA = {
+    'type': 'array',
+    'items': {
+        'type': 'object',
+        'properties': {
+            'phrase': {'type': 'string'},
+            'issue': {'type': 'string'},
+            'suggestion': {'type': 'string'}
+        },
+        'required': ['phrase', 'issue', 'suggestion']
+    }
+}
+
+def _clean_string(value):
+    if value is None or isinstance(value, (dict, list)):
+        return None
+    return str(value).strip()
+
+def validate_test_cases(data) -> list:
+    """Maps decoded structured output onto the test case dict shape the text parser produces.
+
+    Raises ValueError if the output is not a list. Items that are not objects or have no
+    description are dropped, as the text parser drops blocks without a DESC line.
+    """
+    if not isinstance(data, list):
+        raise ValueError(f"Expected a JSON array of test cases, got {type(data).__name__}.")
+    test_cases = []
+    for item in data:
+        if not isinstance(item, dict) or not _clean_string(item.get('description')):
+            continue
+        steps = item.get('steps')
+        if isinstance(steps, str):
+            steps = [steps]
+        elif not isinstance(steps, list):
+            steps = []
+        test_cases.append(TestCase(
+            test_case_id=_clean_string(item.get('test_case_id')),
+            requirement_id=_clean_string(item.get('requirement_id')),
+            description=_clean_string(item.get('description')),
+            test_type=_clean_string(item.get('test_type')),
+            priority=_clean_string(item.get('priority')),
+            steps=[step for step in (_clean_string(s) for s in steps) if step],
+            expected_result=_clean_string(item.get('expected_result')),
+            rtm_compliance_mapping=_clean_string(item.get('rtm_compliance_mapping')),
+            confidence_score=_clean_string(item.get('confidence_score'))
+        ).to_dict())
+    return test_cases
+
+def validate_ambiguity_items(data) -> list:
+    """Keeps the {phrase, issue, suggestion} objects of a decoded ambiguity report. Raises ValueError if it is not a list."""
+    if not isinstance(data, list):
+        raise ValueError(f"Expected a JSON array of ambiguities, got {type(data).__name__}.")
+    items = []
+    for item in data:
+        if not isinstance(item, dict) or not _clean_string(item.get('phrase')):
+            continue
+        items.append({key: _clean_string(item.get(key)) or '' for key in ('phrase', 'issue', 'suggestion')})
+    return items
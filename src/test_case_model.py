@@ -0,0 +1,78 @@
+from dataclasses import dataclass
+
+TEST_CASE_START = "===TEST CASE START==="
+TEST_CASE_END = "===TEST CASE END==="
+
+# Line prefix in the AI's text format -> TestCase attribute (STEP lines are collected separately)
+FIELD_PREFIXES = {
+    'ID': 'test_case_id',
+    'REQ': 'requirement_id',
+    'DESC': 'description',
+    'TYPE': 'test_type',
+    'PRIORITY': 'priority',
+    'EXPECTED': 'expected_result',
+    'RTM': 'rtm_compliance_mapping',
+    'CONFIDENCE': 'confidence_score'
+}
+
+@dataclass(slots=True)
+class TestCase:
+    """A test case while a model response is being parsed.
+
+    Only the parsers use it: the rest of the app, including every store, works with the dicts
+    to_dict() returns. Fields that were never set are left out, so the dict has the same keys the
+    old dict-based parser produced.
+    """
+    test_case_id: str = None
+    requirement_id: str = None
+    description: str = None
+    test_type: str = None
+    priority: str = None
+    steps: list = None
+    expected_result: str = None
+    rtm_compliance_mapping: object = None # A string from the AI; older suites may hold a dict or list
+    confidence_score: str = None
+
+    def to_dict(self) -> dict:
+        data = {}
+        for name in TestCase.__slots__:
+            value = getattr(self, name)
+            if value is not None:
+                data[name] = value
+        return data
+
+def parse_test_cases(text: str) -> list:
+    """Parses the AI's `===TEST CASE START===` text format into TestCase objects in one pass over its lines.
+
+    Within a block, each `KEY: value` line sets a field (the first occurrence wins) and every
+    STEP line adds a step. Blocks without an END marker or a description are dropped.
+    """
+    test_cases = []
+    current = None
+    for raw_line in text.splitlines():
+        line = raw_line.strip()
+        if TEST_CASE_START in line:
+            # A new START abandons an unfinished block, as splitting on the marker used to
+            current = TestCase(steps=[])
+            continue
+        if current is None:
+            continue
+        finished = TEST_CASE_END in line
+        if finished:
+            line = line[:line.index(TEST_CASE_END)].strip()
+        key, separator, value = line.partition(':')
+        if separator:
+            if key == 'STEP':
+                current.steps.append(value.strip())
+            else:
+                field_name = FIELD_PREFIXES.get(key)
+                if field_name is not None and getattr(current, field_name) is None:
+                    setattr(current, field_name, value.strip())
+        if finished:
+            if current.description:
+                test_cases.append(current)
+            current = None
+    return test_cases
+
+def to_dicts(test_cases: list) -> list:
+    return [test_case.to_dict() for test_case in test_cases]
@@ -3,9 +3,43 @@ import os
 import json
 import re
 import time
+import threading
+import contextvars
+import concurrent.futures
 
 import google.generativeai as genai
 
+from response_cache import create_response_cache
+from llm_scheduler import llm_scheduler, estimate_tokens
+from metrics import span, timed_llm_call
+from test_case_model import parse_test_cases, to_dicts, TEST_CASE_START
+from structured_output import TEST_CASE_SCHEMA, AMBIGUITY_SCHEMA, validate_test_cases, validate_ambiguity_items
+
+MODEL_NAME = 'gemini-pro-latest'
+
+# Budgeted per call on top of the prompt until the response's usage metadata gives the real count
+EXPECTED_OUTPUT_TOKENS = int(os.getenv('LLM_EXPECTED_OUTPUT_TOKENS', '1024'))
+
+# Bump a prompt version whenever its template text changes so stale cached responses are not reused
+GENERATION_PROMPT_VERSION = 'generate-v1'
+EDIT_PROMPT_VERSION = 'edit-patch-v2'
+EDIT_SELECT_PROMPT_VERSION = 'edit-select-v1'
+AMBIGUITY_PROMPT_VERSION = 'ambiguity-v2'
+GENERATION_JSON_PROMPT_VERSION = 'generate-json-v1'
+AMBIGUITY_JSON_PROMPT_VERSION = 'ambiguity-json-v1'
+
+# Opt-in: have Gemini return JSON constrained by a response schema instead of free text
+STRUCTURED_OUTPUT = os.getenv('LLM_STRUCTURED_OUTPUT', 'false').lower() in ('1', 'true', 'yes')
+# Extra calls made for a response that cannot be parsed before giving up on it
+PARSE_RETRIES = int(os.getenv('LLM_PARSE_RETRIES', '1'))
+
+# AI editing: suites this small skip the selection call; selected cases are sent in parallel batches
+EDIT_SELECTION_MIN_CASES = int(os.getenv('EDIT_SELECTION_MIN_CASES', '10'))
+EDIT_BATCH_SIZE = int(os.getenv('EDIT_BATCH_SIZE', '25'))
+EDIT_MAX_PARALLEL_BATCHES = int(os.getenv('EDIT_MAX_PARALLEL_BATCHES', '4'))
+# Fields an edit patch may change
+EDITABLE_FIELDS = ('requirement_id', 'description', 'test_type', 'priority', 'steps', 'expected_result', 'rtm_compliance_mapping', 'confidence_score')
+
 # --- Client Initialization ---
 gemini_model = None
 try:
@@ -13,58 +47,144 @@ try:
     if not gemini_api_key:
         raise ValueError("GEMINI_API_KEY not found in .env file.")
     genai.configure(api_key=gemini_api_key)
-    gemini_model = genai.GenerativeModel('gemini-pro-latest')
+    gemini_model = genai.GenerativeModel(MODEL_NAME)
     print("--- Google AI (API Key) initialized successfully. ---")
 except Exception as e:
     print(f"FATAL ERROR initializing Google AI: {e}")
 
-def parse_ai_response_to_dicts(text: str) -> list:
-    """Parses the AI's custom text format into a list of test case dictionaries."""
-    test_cases = []
-    # Split the entire response into blocks for each test case
-    for block in text.split("===TEST CASE START==="):
-        if "===TEST CASE END===" not in block:
-            continue
+def call_model(prompt: str, response_schema: dict = None):
+    """Sends a prompt to Gemini through the shared, rate-limited scheduler.
 
-        test_case = {}
-        # Use regex to find each field, making it robust to missing fields
-        id_match = re.search(r"ID: (.*?)\n", block)
-        if id_match: test_case['test_case_id'] = id_match.group(1).strip()
+    With a response_schema, Gemini's structured output mode constrains the reply to JSON of that shape.
+    """
+    if response_schema is None:
+        generate = lambda: gemini_model.generate_content(prompt)
+    else:
+        generation_config = {'response_mime_type': 'application/json', 'response_schema': response_schema}
+        generate = lambda: gemini_model.generate_content(prompt, generation_config=generation_config)
+    return llm_scheduler.run(timed_llm_call(generate), estimated_tokens=estimate_tokens(prompt) + EXPECTED_OUTPUT_TOKENS)
 
-        req_match = re.search(r"REQ: (.*?)\n", block)
-        if req_match: test_case['requirement_id'] = req_match.group(1).strip()
 
-        desc_match = re.search(r"DESC: (.*?)\n", block)
-        if desc_match: test_case['description'] = desc_match.group(1).strip()
+class ParseMetrics:
+    """Counts model responses that could not be parsed, per call kind and output mode.
 
-        type_match = re.search(r"TYPE: (.*?)\n", block)
-        if type_match: test_case['test_type'] = type_match.group(1).strip()
+    Tokens spent on unparseable responses are 'wasted': they were paid for and then retried or dropped.
+    """
 
-        priority_match = re.search(r"PRIORITY: (.*?)\n", block)
-        if priority_match: test_case['priority'] = priority_match.group(1).strip()
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {} # (kind, mode) -> counters
+
+    def record(self, kind: str, mode: str, parsed: bool, retried: bool = False, tokens: int = 0):
+        with self._lock:
+            counts = self._counts.setdefault((kind, mode), {'responses': 0, 'parse_failures': 0, 'retries': 0, 'wasted_tokens': 0})
+            counts['responses'] += 1
+            if not parsed:
+                counts['parse_failures'] += 1
+                counts['wasted_tokens'] += tokens
+            if retried:
+                counts['retries'] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            report = {}
+            for (kind, mode), counts in sorted(self._counts.items()):
+                report[f"{kind}/{mode}"] = dict(
+                    counts,
+                    failure_rate=counts['parse_failures'] / counts['responses'],
+                    retry_rate=counts['retries'] / counts['responses']
+                )
+            return report
+
+parse_metrics = ParseMetrics()
+
+def response_tokens(response, prompt: str, text: str) -> int:
+    usage = getattr(response, 'usage_metadata', None)
+    total = getattr(usage, 'total_token_count', 0) if usage is not None else 0
+    return total or estimate_tokens(prompt) + estimate_tokens(text or '')
+
+# Persistent cache so re-uploaded specs and unchanged sections skip the LLM round-trip
+response_cache = create_response_cache()
+
+def generate_with_cache(prompt_version: str, cache_input: str, prompt: str, parse, kind: str = 'generation', response_schema: dict = None):
+    """Returns parse(response text), serving the text from the response cache when possible.
+
+    The cache key covers the model name, the prompt template version and the variable input.
+    A response is only stored once `parse` succeeds, so malformed outputs are retried next time.
+    `parse` signals an unusable response by raising ValueError (json.JSONDecodeError included);
+    the call is then repeated up to PARSE_RETRIES times, and each failure is counted in parse_metrics.
+    """
+    cache_key = None
+    if response_cache is not None:
+        cache_key = response_cache.make_key(MODEL_NAME, prompt_version, cache_input)
+        cached_text = response_cache.get(cache_key)
+        if cached_text is not None:
+            return parse(cached_text)
+
+    mode = 'text' if response_schema is None else 'structured'
+    for attempt in range(PARSE_RETRIES + 1):
+        response = call_model(prompt, response_schema)
+        text = response.text
+        retrying = attempt < PARSE_RETRIES
+        try:
+            result = parse(text)
+        except ValueError as e:
+            parse_metrics.record(kind, mode, parsed=False, retried=retrying, tokens=response_tokens(response, prompt, text))
+            if not retrying:
+                raise
+            print(f"    -> Could not parse the AI's {kind} response ({e}). Retrying ({attempt + 1}/{PARSE_RETRIES}).")
+            continue
+        parse_metrics.record(kind, mode, parsed=True)
+        if cache_key is not None:
+            response_cache.put(cache_key, text)
+        return result
 
-        steps = re.findall(r"STEP: (.*?)\n", block)
-        test_case['steps'] = [s.strip() for s in steps]
+def parse_ai_response_to_dicts(text: str) -> list:
+    """Parses the AI's custom text format into a list of test case dictionaries."""
+    return to_dicts(parse_test_cases(text))
 
-        expected_match = re.search(r"EXPECTED: (.*?)\n", block)
-        if expected_match: test_case['expected_result'] = expected_match.group(1).strip()
+def parse_generated_test_cases(text: str) -> list:
+    """Parses a text-format generation response, rejecting one that has test case blocks but no parseable case."""
+    test_cases = parse_ai_response_to_dicts(text)
+    if not test_cases and TEST_CASE_START in text:
+        raise ValueError("No complete test case could be parsed from the response.")
+    return test_cases
 
-        rtm_match = re.search(r"RTM: (.*?)\n", block)
-        if rtm_match: test_case['rtm_compliance_mapping'] = rtm_match.group(1).strip()
+def parse_structured_test_cases(text: str) -> list:
+    return validate_test_cases(json.loads(text))
 
-        confidence_match = re.search(r"CONFIDENCE: (.*?)\n", block)
-        if confidence_match: test_case['confidence_score'] = confidence_match.group(1).strip()
+def generate_structured_test_cases(text_chunk: str) -> list:
+    """Generates test cases in structured output mode: JSON constrained by TEST_CASE_SCHEMA."""
+    prompt = f"""Your task is to act as a senior QA engineer. Read the following chunk of a software requirement document. For each actionable requirement you find, generate one or more detailed test cases.
 
-        if test_case.get('description'):
-            test_cases.append(test_case)
-            
-    return test_cases
+    **Document Chunk:**
+    {text_chunk}
 
+    **INSTRUCTIONS:**
+    - Return a JSON array with one object per test case.
+    - `test_case_id`: a unique test case ID. `requirement_id`: the requirement ID.
+    - `description`: a clear, one-sentence description of the test objective.
+    - `test_type`: e.g., Positive, Negative, Functional, Boundary, Security, Regression. `priority`: High, Medium, or Low.
+    - `steps`: the test steps in order. `expected_result`: the expected result.
+    - `rtm_compliance_mapping`: traceability info, or N/A if not found. `confidence_score`: your confidence percentage, e.g., 95%.
+    - If no requirements are found, return an empty array `[]`.
+    """
+    return generate_with_cache(GENERATION_JSON_PROMPT_VERSION, text_chunk, prompt, parse_structured_test_cases,
+                               kind='generation', response_schema=TEST_CASE_SCHEMA)
+
+@span('generation')
 def generate_test_cases_from_chunk(text_chunk: str) -> list:
-    """Generates test cases using a simple, reliable text-based prompt."""
+    """Generates test cases using a simple, reliable text-based prompt (or structured output, if enabled)."""
     if not gemini_model:
         raise ConnectionError("Google AI model not initialized.")
 
+    if STRUCTURED_OUTPUT:
+        try:
+            return generate_structured_test_cases(text_chunk)
+        except Exception as e:
+            print(f"    -> An unexpected error occurred during structured generation: {e}")
+            return []
+
     prompt = f"""Your task is to act as a senior QA engineer. Read the following chunk of a software requirement document. For each actionable requirement you find, generate one or more detailed test cases using the exact format below.
 
     **Document Chunk:**
@@ -93,9 +213,8 @@ def generate_test_cases_from_chunk(text_chunk: str) -> list:
     """
 
     try:
-        response = gemini_model.generate_content(prompt)
         # Use the reliable text parser
-        parsed_test_cases = parse_ai_response_to_dicts(response.text)
+        parsed_test_cases = generate_with_cache(GENERATION_PROMPT_VERSION, text_chunk, prompt, parse_generated_test_cases)
         if parsed_test_cases:
             return parsed_test_cases
         else:
@@ -105,67 +224,247 @@ def generate_test_cases_from_chunk(text_chunk: str) -> list:
         print(f"    -> An unexpected error occurred during generation: {e}")
         return []
 
-def edit_test_cases_with_ai(user_prompt: str, test_cases: list) -> list:
-    """Uses the AI to edit a list of test cases using the same text-based format."""
-    if not gemini_model:
-        raise ConnectionError("Google AI model not initialized.")
-
-    # Convert the current test cases into the text format for the AI
-    test_cases_text = ""
+def format_test_case_text(tc: dict, ref: str = None) -> str:
+    """Renders a test case in the `===TEST CASE START===` text format, under `ref` in place of its ID if given."""
+    lines = ["===TEST CASE START==="]
+    lines.append(f"ID: {ref or tc.get('test_case_id', 'N/A')}")
+    lines.append(f"REQ: {tc.get('requirement_id', 'N/A')}")
+    lines.append(f"DESC: {tc.get('description', 'N/A')}")
+    lines.append(f"TYPE: {tc.get('test_type', 'N/A')}")
+    lines.append(f"PRIORITY: {tc.get('priority', 'N/A')}")
+    for step in tc.get('steps', []):
+        lines.append(f"STEP: {step}")
+    lines.append(f"EXPECTED: {tc.get('expected_result', 'N/A')}")
+    lines.append(f"RTM: {tc.get('rtm_compliance_mapping', 'N/A')}")
+    lines.append(f"CONFIDENCE: {tc.get('confidence_score', 'N/A')}")
+    lines.append("===TEST CASE END===")
+    return "\n".join(lines) + "\n"
+
+def assign_edit_refs(test_cases: list) -> list:
+    """Returns the key each case is edited under: its test_case_id, or '#<position>' when missing or shared."""
+    id_counts = {}
     for tc in test_cases:
-        test_cases_text += "===TEST CASE START===\n"
-        test_cases_text += f"ID: {tc.get('test_case_id', 'N/A')}\n"
-        test_cases_text += f"REQ: {tc.get('requirement_id', 'N/A')}\n"
-        test_cases_text += f"DESC: {tc.get('description', 'N/A')}\n"
-        test_cases_text += f"TYPE: {tc.get('test_type', 'N/A')}\n"
-        test_cases_text += f"PRIORITY: {tc.get('priority', 'N/A')}\n"
-        for step in tc.get('steps', []):
-            test_cases_text += f"STEP: {step}\n"
-        test_cases_text += f"EXPECTED: {tc.get('expected_result', 'N/A')}\n"
-        test_cases_text += f"RTM: {tc.get('rtm_compliance_mapping', 'N/A')}\n"
-        test_cases_text += f"CONFIDENCE: {tc.get('confidence_score', 'N/A')}\n"
-        test_cases_text += "===TEST CASE END===\n"
-
-    prompt = f"""Your task is to act as an intelligent test case editor. You will be given a user's instruction and a list of test cases in a specific text format. Your goal is to apply the user's instruction to the test cases and return the *entire, complete, and updated* list of test cases in the exact same text format.
+        test_case_id = str(tc.get('test_case_id') or '').strip()
+        id_counts[test_case_id] = id_counts.get(test_case_id, 0) + 1
+    refs = []
+    for position, tc in enumerate(test_cases):
+        test_case_id = str(tc.get('test_case_id') or '').strip()
+        refs.append(test_case_id if test_case_id and id_counts[test_case_id] == 1 else f"#{position}")
+    return refs
+
+def parse_json_response(text: str):
+    """Decodes a JSON reply, tolerating a surrounding markdown code fence."""
+    cleaned_text = text.strip()
+    if cleaned_text.startswith("```"):
+        cleaned_text = cleaned_text.split("\n", 1)[1] if "\n" in cleaned_text else ""
+        cleaned_text = cleaned_text.rsplit("```", 1)[0]
+    return json.loads(cleaned_text)
+
+def select_cases_to_edit(user_prompt: str, test_cases: list, refs: list) -> tuple:
+    """Asks the model which cases an instruction affects, from a one-line summary of each.
+
+    Returns (set of selected refs, whether the instruction affects every case, whether it adds new cases).
+    """
+    index_lines = "\n".join(
+        f"{ref} | {tc.get('requirement_id', 'N/A')} | {tc.get('test_type', 'N/A')} | {tc.get('priority', 'N/A')} | {tc.get('description', 'N/A')}"
+        for ref, tc in zip(refs, test_cases)
+    )
+    prompt = f"""Your task is to decide which test cases a user's editing instruction applies to. You are given the instruction and a one-line summary of every test case (ID | requirement | type | priority | description).
 
     **User's Instruction:**
     {user_prompt}
 
-    **Current Test Cases:**
-    {test_cases_text}
+    **Test Case Summaries:**
+    {index_lines}
+
+    **FORMAT:**
+    Return a JSON object: {{"affected_ids": [IDs of the test cases to change or delete], "applies_to_all": true if every test case must change, "adds_new_cases": true if new test cases must be created}}
 
-    **Output Format Instructions:**
-    - You MUST return the test cases in the same `===TEST CASE START===`...`===TEST CASE END===` format.
-    - Do NOT return any text, explanations, or formatting outside of this format.
-    - The returned text must contain all test cases, including those that were not changed.
-    - If the user's instruction is unclear or cannot be applied, return the original, unchanged text that you were given.
+    **INSTRUCTIONS:**
+    - Only list IDs that appear in the summaries.
+    - Do NOT return any text outside the JSON object.
     """
 
-    print("--- DEBUG: AI Editor --- ")
-    print(f"--- PROMPT SENT TO AI ---\n{prompt}\n-------------------------")
+    def parse_selection(text):
+        selection = parse_json_response(text)
+        if not isinstance(selection, dict) or not isinstance(selection.get('affected_ids', []), list):
+            raise ValueError("Selection must be a JSON object with an 'affected_ids' list.")
+        known_refs = set(refs)
+        selected = {str(ref).strip() for ref in selection.get('affected_ids', [])} & known_refs
+        return selected, bool(selection.get('applies_to_all')), bool(selection.get('adds_new_cases'))
 
-    try:
-        response = gemini_model.generate_content(prompt)
-        print(f"--- RAW AI RESPONSE ---\n{response.text}\n-----------------------")
-        
-        updated_test_cases = parse_ai_response_to_dicts(response.text)
-        
-        if updated_test_cases:
-            print("--- DEBUG: AI response parsed successfully. ---")
-            return updated_test_cases
+    return generate_with_cache(EDIT_SELECT_PROMPT_VERSION, f"{user_prompt}\n{index_lines}", prompt, parse_selection, kind='edit-select')
+
+def request_edit_patches(user_prompt: str, batch: list, other_refs: list, allow_add: bool = False) -> list:
+    """Sends one batch of (ref, test case) pairs with the instruction; returns the validated patches for that batch.
+
+    Only a call with allow_add may create test cases, so a suite edited in several batches gets
+    each requested new case once.
+    """
+    batch_text = "".join(format_test_case_text(tc, ref) for ref, tc in batch)
+    batch_refs = {ref for ref, _ in batch}
+    add_format = """
+    - Create a test case: {"test_case_id": "<new unique ID>", "action": "add", "fields": {<all fields>}}""" if allow_add else ""
+    add_instruction = "" if allow_add else """
+    - Do NOT create new test cases; another request handles those."""
+    prompt = f"""Your task is to act as an intelligent test case editor. Apply the user's instruction to the test cases below and return only the changes, as patches keyed by test case ID.
+
+    **User's Instruction:**
+    {user_prompt}
+
+    **Test Cases To Edit:**
+    {batch_text or "(none; the instruction only adds new test cases)"}
+
+    **IDs Already In Use Elsewhere In The Suite:**
+    {", ".join(other_refs) or "(none)"}
+
+    **FORMAT:**
+    Return a JSON array of patch objects:
+    - Change a test case: {{"test_case_id": "<ID>", "action": "update", "fields": {{<only the changed fields>}}}}
+    - Delete a test case: {{"test_case_id": "<ID>", "action": "delete"}}{add_format}
+    Field names are: requirement_id, description, test_type, priority, steps (a list of strings), expected_result, rtm_compliance_mapping, confidence_score.
+
+    **INSTRUCTIONS:**
+    - Only update or delete the test cases listed above. Leave out test cases that do not change.{add_instruction}
+    - If the instruction is unclear or cannot be applied, return an empty array `[]`.
+    - Do NOT return any text outside the JSON array.
+    """
+
+    def parse_patches(text):
+        patches = parse_json_response(text)
+        if not isinstance(patches, list):
+            raise ValueError("Edit patches must be a JSON array.")
+        valid = []
+        for patch in patches:
+            if not isinstance(patch, dict) or patch.get('action') not in ('update', 'delete', 'add'):
+                continue
+            ref = str(patch.get('test_case_id') or '').strip()
+            fields = patch.get('fields') if isinstance(patch.get('fields'), dict) else {}
+            if patch['action'] == 'add':
+                if not allow_add:
+                    continue
+                added = validate_test_cases([dict(fields, test_case_id=ref)])
+                if added:
+                    valid.append({'action': 'add', 'test_case': added[0]})
+            elif ref in batch_refs: # Patches may only touch the cases that were sent
+                valid.append({'action': patch['action'], 'ref': ref, 'fields': fields})
+        return valid
+
+    return generate_with_cache(EDIT_PROMPT_VERSION, f"{user_prompt}\n{batch_text}\n{','.join(other_refs)}\n{allow_add}", prompt, parse_patches, kind='edit')
+
+def apply_edit_patches(test_cases: list, refs: list, patches: list) -> tuple:
+    """Merges patches into a copy of the suite, keeping its order. Returns (updated suite, counts by action).
+
+    Edited cases keep every field outside EDITABLE_FIELDS, including the result store's case_uid,
+    so exports still match them to their issues. An added case whose ID is missing or already
+    used in the suite is renumbered with a suffix.
+    """
+    patches_by_ref = {}
+    added = []
+    for patch in patches:
+        if patch['action'] == 'add':
+            added.append(patch['test_case'])
         else:
-            print("--- DEBUG: AI editor failed to return valid text format. Reverting changes. ---")
-            return test_cases
-    except Exception as e:
-        print(f"--- DEBUG: An error occurred during AI editing: {e} ---")
+            patches_by_ref.setdefault(patch['ref'], []).append(patch)
+
+    counts = {'updated': 0, 'deleted': 0, 'added': len(added)}
+    updated_suite = []
+    for ref, tc in zip(refs, test_cases):
+        ref_patches = patches_by_ref.get(ref)
+        if not ref_patches:
+            updated_suite.append(tc)
+            continue
+        if any(patch['action'] == 'delete' for patch in ref_patches):
+            counts['deleted'] += 1
+            continue
+        changes = {}
+        for patch in ref_patches:
+            changes.update(patch['fields'])
+        # Run the changes through the same validation as generated cases so types stay consistent
+        validated = validate_test_cases([dict(tc, **changes)])
+        if not validated:
+            updated_suite.append(tc)
+            continue
+        updated = dict(tc)
+        for field in EDITABLE_FIELDS:
+            if field in changes and field in validated[0]:
+                updated[field] = validated[0][field]
+        updated.pop('quality_assessment', None) # The review no longer describes the edited case
+        counts['updated'] += 1
+        updated_suite.append(updated)
+
+    used_ids = {str(tc.get('test_case_id') or '').strip() for tc in updated_suite}
+    for tc in added:
+        base_id = str(tc.get('test_case_id') or '').strip() or 'TC-NEW'
+        test_case_id, suffix = base_id, 2
+        while test_case_id in used_ids:
+            test_case_id, suffix = f"{base_id}-{suffix}", suffix + 1
+        if test_case_id != base_id:
+            print(f"--- DEBUG: AI Editor renumbered new test case {base_id} to {test_case_id}; the ID was already in use. ---")
+        tc['test_case_id'] = test_case_id
+        used_ids.add(test_case_id)
+    return updated_suite + added, counts
+
+@span('edit')
+def edit_test_cases_with_ai(user_prompt: str, test_cases: list) -> list:
+    """Uses the AI to edit a suite by sending only the affected test cases and merging back patches.
+
+    A selection call picks the affected cases from a one-line summary of each (skipped for small
+    suites), the selected cases are sent in batches of EDIT_BATCH_SIZE in parallel, and the model
+    returns patches keyed by test_case_id. Cases in a batch that fails are left unchanged.
+    """
+    if not gemini_model:
+        raise ConnectionError("Google AI model not initialized.")
+
+    refs = assign_edit_refs(test_cases)
+    adds_new_cases = True
+    if len(test_cases) < EDIT_SELECTION_MIN_CASES:
+        selected = set(refs)
+    else:
+        try:
+            selected, applies_to_all, adds_new_cases = select_cases_to_edit(user_prompt, test_cases, refs)
+            if applies_to_all:
+                selected = set(refs)
+        except Exception as e:
+            print(f"--- DEBUG: AI Editor selection failed ({e}). Sending every test case. ---")
+            selected = set(refs)
+
+    batch_pairs = [(ref, tc) for ref, tc in zip(refs, test_cases) if ref in selected]
+    batches = [batch_pairs[start:start + EDIT_BATCH_SIZE] for start in range(0, len(batch_pairs), EDIT_BATCH_SIZE)]
+    if not batches and adds_new_cases:
+        batches = [[]] # One call that only adds cases
+    print(f"--- DEBUG: AI Editor selected {len(batch_pairs)} of {len(test_cases)} test cases, in {len(batches)} batch(es). ---")
+    if not batches:
         return test_cases
 
+    # Refs outside each batch are listed so new cases do not reuse them
+    def edit_batch(batch, allow_add):
+        batch_refs = {ref for ref, _ in batch}
+        return request_edit_patches(user_prompt, batch, [ref for ref in refs if ref not in batch_refs], allow_add)
+
+    patches = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(EDIT_MAX_PARALLEL_BATCHES, len(batches))) as executor:
+        # Copy the context so each batch stays in the caller's scheduler queue. Only the first
+        # batch may add cases, or every batch would create the same requested case.
+        futures = [executor.submit(contextvars.copy_context().run, edit_batch, batch, adds_new_cases and index == 0)
+                   for index, batch in enumerate(batches)]
+        for future in futures:
+            try:
+                patches.extend(future.result())
+            except Exception as e:
+                print(f"--- DEBUG: An AI Editor batch failed ({e}). Its test cases are unchanged. ---")
+
+    updated_test_cases, counts = apply_edit_patches(test_cases, refs, patches)
+    print(f"--- DEBUG: AI Editor applied {len(patches)} patches: {counts['updated']} updated, {counts['deleted']} deleted, {counts['added']} added. ---")
+    return updated_test_cases
+
+@span('ambiguity')
 def detect_ambiguity(full_text: str) -> list:
-    """Analyzes the full text of a document for ambiguities using Google AI."""
+    """Analyzes a document, or one chunk of it, for ambiguities using Google AI."""
     if not gemini_model:
         raise ConnectionError("Google AI model not initialized.")
 
-    prompt = f"""Your task is to act as an expert requirements analyst. Read the following software requirement document and identify any statements that are ambiguous, subjective, contradictory, or incomplete. For each issue you find, provide the ambiguous phrase, explain why it is an issue, and suggest a clearer alternative.
+    prompt = f"""Your task is to act as an expert requirements analyst. Read the following software requirement document (or section of a document) and identify any statements that are ambiguous, subjective, contradictory, or incomplete. For each issue you find, provide the ambiguous phrase, explain why it is an issue, and suggest a clearer alternative.
 
     **Requirement Document Text:**
     {full_text}
@@ -192,13 +491,39 @@ def detect_ambiguity(full_text: str) -> list:
     - If no ambiguities are found, return an empty array `[]`.
     """
 
-    try:
-        response = gemini_model.generate_content(prompt)
+    def parse_report(text):
         # Clean the response to ensure it's valid JSON
-        cleaned_text = response.text.strip().replace('\n', '').replace('```json', '').replace('```', '')
-        report = json.loads(cleaned_text)
-        return report
+        cleaned_text = text.strip().replace('\n', '').replace('```json', '').replace('```', '')
+        return json.loads(cleaned_text)
+
+    def parse_structured_report(text):
+        return validate_ambiguity_items(json.loads(text))
+
+    try:
+        if STRUCTURED_OUTPUT:
+            return generate_with_cache(AMBIGUITY_JSON_PROMPT_VERSION, full_text, prompt, parse_structured_report,
+                                       kind='ambiguity', response_schema=AMBIGUITY_SCHEMA)
+        return generate_with_cache(AMBIGUITY_PROMPT_VERSION, full_text, prompt, parse_report, kind='ambiguity')
     except (json.JSONDecodeError, Exception) as e:
         print(f"    -> An error occurred during ambiguity detection: {e}")
         # Return a structured error message for the frontend
         return [{ "phrase": "Error during analysis", "issue": str(e), "suggestion": "Could not generate ambiguity report." }]
+
+def normalize_phrase(phrase) -> str:
+    """Normalizes an ambiguous phrase for de-duplication (case, whitespace and trailing punctuation)."""
+    return re.sub(r"\s+", " ", str(phrase)).strip().strip('.,;:!?"\'').lower()
+
+def merge_ambiguity_reports(reports: list) -> list:
+    """Merges per-chunk ambiguity reports, keeping the first occurrence of each phrase."""
+    merged = []
+    seen_phrases = set()
+    for report in reports:
+        for item in report or []:
+            if not isinstance(item, dict):
+                continue
+            key = normalize_phrase(item.get('phrase', ''))
+            if not key or key in seen_phrases:
+                continue
+            seen_phrases.add(key)
+            merged.append(item)
+    return merged
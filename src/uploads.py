@@ -0,0 +1,117 @@
+import os
+import tempfile
+import threading
+from io import BytesIO
+
+from flask import Request
+
+# Largest accepted upload; checked against Content-Length before any of the body is read
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', str(50 * 1024 * 1024)))
+# Uploads larger than this are written to a temp file instead of being held in memory
+UPLOAD_SPOOL_THRESHOLD_BYTES = int(os.getenv('UPLOAD_SPOOL_THRESHOLD_BYTES', str(1024 * 1024)))
+# Total size of uploads being processed at once across all requests (0 = unlimited)
+UPLOAD_INFLIGHT_MAX_BYTES = int(os.getenv('UPLOAD_INFLIGHT_MAX_BYTES', str(256 * 1024 * 1024)))
+
+
+class SpoolingRequest(Request):
+    """Request class that spools large file uploads to a named temp file.
+
+    Werkzeug's default stream is an anonymous SpooledTemporaryFile, which the parsers could only
+    read back into memory. A named file can be memory-mapped, or opened by path in the PDF
+    extraction workers, so the upload never has to be copied into a bytes object.
+
+    Spooled files outlive the request's file handles (a streamed response is still parsing after
+    Flask has closed them), so their paths are kept in `spooled_paths` for explicit removal.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.spooled_paths = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= UPLOAD_SPOOL_THRESHOLD_BYTES:
+            return BytesIO()
+        spooled = tempfile.NamedTemporaryFile('w+b', prefix='upload-', suffix=os.path.splitext(filename or '')[1], delete=False)
+        self.spooled_paths.append(spooled.name)
+        return spooled
+
+def remove_spooled_files(paths: list):
+    while paths:
+        try:
+            os.remove(paths.pop())
+        except OSError:
+            pass
+
+
+def upload_source(file_storage):
+    """Returns what the document parser should read: the spooled file's path, or the bytes of a small upload.
+
+    The spooled file is removed when the request's UploadLease (or the request itself) is closed.
+    """
+    stream = file_storage.stream
+    if isinstance(getattr(stream, 'name', None), str) and os.path.exists(stream.name):
+        stream.flush()
+        return stream.name
+    return file_storage.read()
+
+
+class UploadAdmission:
+    """Bounds the total bytes of uploads being processed at once.
+
+    Requests reserve their Content-Length before their body is read; a request that would push
+    the total over max_bytes is turned away (with a retry hint) instead of queueing in memory.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._admitted = 0
+        self._rejected = 0
+
+    def reserve(self, nbytes: int) -> bool:
+        with self._lock:
+            # A lone upload is always admitted so max_bytes below UPLOAD_MAX_BYTES cannot lock everyone out
+            if self.max_bytes and self._in_flight and self._in_flight + nbytes > self.max_bytes:
+                self._rejected += 1
+                return False
+            self._in_flight += nbytes
+            self._admitted += 1
+            return True
+
+    def release(self, nbytes: int):
+        with self._lock:
+            self._in_flight -= nbytes
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'in_flight_bytes': self._in_flight,
+                'max_in_flight_bytes': self.max_bytes,
+                'admitted_uploads': self._admitted,
+                'rejected_uploads': self._rejected
+            }
+
+
+class UploadLease:
+    """An admitted upload: its reserved bytes plus the temp files it was spooled to. close() frees both."""
+
+    def __init__(self, admission: UploadAdmission, nbytes: int):
+        self.admission = admission
+        self.nbytes = nbytes
+        self.spooled_paths = []
+        self._closed = False
+
+    def adopt_spooled_files(self, request):
+        """Takes over removal of the request's spooled files, for processing that outlives the request."""
+        self.spooled_paths.extend(request.spooled_paths)
+        request.spooled_paths.clear()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.admission.release(self.nbytes)
+        remove_spooled_files(self.spooled_paths)
+
+upload_admission = UploadAdmission(UPLOAD_INFLIGHT_MAX_BYTES)